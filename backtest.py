@@ -0,0 +1,268 @@
+"""
+Бэктест модели на истории статистики
+
+Каждый матч из базы предсказывается так, как его предсказал бы make_prediction
+накануне: признаки собираются по состоянию игроков после их предыдущих матчей
+(без заглядывания вперед), рейтинги считаются не указанными - в базе их нет.
+Матчи делятся на части, которые собираются и оцениваются моделью в нескольких
+процессах. Результат - точность, log-loss, Brier score и калибровка в целом,
+по кортам и по периодам.
+
+Запуск из каталога с базой статистики и моделью:
+    python backtest.py --workers 4 --period Q --output backtest.xlsx
+"""
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from feature_matrix import DEFAULT_RATING, assemble_match_features, build_feature_matrix
+from model_holder import get_model_holder
+from player_snapshot import RECENT_MATCHES, PlayerSnapshot, build_snapshot, window_counts, window_stats
+from stats_table import load_stats_table
+
+
+CHUNK_SIZE = 100000
+CALIBRATION_BINS = 10
+# Вероятности обрезаются, чтобы log-loss оставался конечным
+PROBABILITY_EPSILON = 1e-15
+# Показатели последней строки игрока, из которых build_feature_matrix собирает его признаки
+LATEST_COLUMNS = ['court', 'result', 'cumulative_wins', 'cumulative_losses', 'streak', 'court_wins',
+                  'court_losses', 'wins_last_5']
+
+
+def player_states(table):
+    """
+    Считает для каждой строки статистики состояние игрока сразу после этого матча
+
+    Возвращает:
+    tuple: (latest - показатели строки для build_feature_matrix, windows - окна 5 матчей
+    и 30 дней по матчам игрока до этой строки включительно, как window_stats;
+    previous - номер предыдущей строки того же игрока или -1); индекс - номер строки
+    """
+    stats = table.stats.reset_index(drop=True)
+    by_player = stats.groupby('player', sort=False)
+    position = by_player.cumcount()
+
+    latest = stats[LATEST_COLUMNS].copy()
+    latest['court'] = stats['court'].astype(object).where(stats['court'].notna(), None)
+
+    # Самый старый из 5 последних матчей: 4 матча назад или первый матч игрока
+    oldest_result = by_player['result'].shift(RECENT_MATCHES - 1)
+    oldest_result = oldest_result.where(position >= RECENT_MATCHES - 1, by_player['result'].transform('first'))
+    matches_last_30d, wins_last_30d = window_counts(stats[['player', 'date', 'result']])
+    windows = pd.DataFrame({
+        'last_5_count': np.minimum(position + 1, RECENT_MATCHES),
+        'last_5_oldest_result': oldest_result,
+        'matches_last_30d': matches_last_30d,
+        'wins_last_30d': wins_last_30d
+    })
+
+    previous = pd.Series(np.arange(len(stats)), index=stats.index).groupby(stats['player']).shift()
+    return latest, windows, previous.fillna(-1).astype(np.int64)
+
+
+def pair_matches(table, previous):
+    """
+    Собирает матчи из пар строк с одним match_id
+
+    Возвращает:
+    pd.DataFrame: date, court, result (победа первого игрока) и номера предыдущих
+    строк обоих игроков (-1 - первый матч игрока) в порядке дат
+    """
+    stats = table.stats.reset_index(drop=True)
+    rows = pd.DataFrame({'match_id': stats['match_id'], 'row': stats.index, 'is_player1': stats['is_player1']})
+    player1 = rows[rows['is_player1']].drop_duplicates('match_id')
+    player2 = rows[~rows['is_player1']].drop_duplicates('match_id')
+    pairs = player1.merge(player2, on='match_id', suffixes=('1', '2')).sort_values('row1', kind='stable')
+
+    row1 = pairs['row1'].to_numpy()
+    return pd.DataFrame({
+        'date': stats['date'].to_numpy()[row1],
+        'court': stats['court'].to_numpy()[row1],
+        'result': stats['result'].to_numpy()[row1].astype(np.int8),
+        'previous1': previous.to_numpy()[row1],
+        'previous2': previous.to_numpy()[pairs['row2'].to_numpy()]
+    })
+
+
+def match_features_before(latest, windows, matches, feature_cols):
+    """
+    Собирает признаки матчей так же, как make_prediction, по состоянию игроков до матча
+
+    Строки предыдущих матчей выступают "игроками" FeatureMatrix: их показатели
+    продолжаются теми же правилами, что и показатели последней строки игрока в
+    индексе статистики; у игрока без предыдущих матчей - нулевые показатели.
+    """
+    needed = np.unique(np.concatenate([matches['previous1'], matches['previous2']]))
+    needed = needed[needed >= 0]
+    snapshot = PlayerSnapshot(latest=latest.loc[needed], courts=None, recent=None)
+    matrix = build_feature_matrix(snapshot, windows.loc[needed])
+
+    courts = matches['court'].astype(object).where(matches['court'].notna(), None)
+    no_rating = [None] * len(matches)
+    pairs = list(zip(matches['previous1'], matches['previous2'], no_rating, no_rating, courts))
+    return assemble_match_features(matrix, pairs, feature_cols)
+
+
+def _score_chunk(latest, windows, matches, model_path, feature_info_path, engine):
+    # Выполняется в процессе пула: модель загружается один раз на процесс
+    loaded = get_model_holder(model_path, feature_info_path, engine).get()
+    features = match_features_before(latest, windows, matches, loaded.feature_cols)
+    return loaded.model.predict_proba(features)[:, 1]
+
+
+def run_backtest(workers=None, chunk_size=CHUNK_SIZE, engine=None, model_path='best_xgb_model.json',
+                 feature_info_path='feature_info.pkl'):
+    """
+    Предсказывает все матчи истории
+
+    Параметры:
+    workers (int, optional): Число процессов (по умолчанию - число ядер)
+    chunk_size (int): Сколько матчей собирается и оценивается за один вызов модели
+    engine (str, optional): Движок модели (по умолчанию PREDICTION_ENGINE)
+
+    Возвращает:
+    pd.DataFrame: Матчи (date, court, result) и probability - предсказанная вероятность победы первого игрока
+    """
+    if engine is None:
+        from prediction_functions import PREDICTION_ENGINE
+        engine = PREDICTION_ENGINE
+
+    table = load_stats_table()
+    latest, windows, previous = player_states(table)
+    matches = pair_matches(table, previous)
+
+    chunks = [matches.iloc[start:start + chunk_size] for start in range(0, len(matches), chunk_size)]
+    workers = workers or os.cpu_count()
+    probabilities = []
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = []
+            for chunk in chunks:
+                # В процесс передаются только строки, нужные для признаков этой части
+                needed = np.unique(np.concatenate([chunk['previous1'], chunk['previous2']]))
+                needed = needed[needed >= 0]
+                futures.append(executor.submit(_score_chunk, latest.loc[needed], windows.loc[needed], chunk,
+                                               model_path, feature_info_path, engine))
+            probabilities = [future.result() for future in futures]
+    else:
+        probabilities = [_score_chunk(latest, windows, chunk, model_path, feature_info_path, engine)
+                         for chunk in chunks]
+
+    result = matches[['date', 'court', 'result']].copy()
+    result['probability'] = np.concatenate(probabilities) if probabilities else np.array([], dtype=np.float64)
+    return result
+
+
+def backtest_report(predictions, period='Q', bins=CALIBRATION_BINS):
+    """
+    Считает метрики качества предсказаний
+
+    Параметры:
+    predictions (pd.DataFrame): Результат run_backtest
+    period (str): Период группировки в обозначениях pandas (M - месяц, Q - квартал, Y - год)
+    bins (int): Число интервалов вероятности для калибровки
+
+    Возвращает:
+    dict: DataFrame "Итого", "По кортам", "По периодам" и "Калибровка"
+    """
+    probability = predictions['probability'].to_numpy(dtype=np.float64)
+    result = predictions['result'].to_numpy(dtype=np.float64)
+    clipped = np.clip(probability, PROBABILITY_EPSILON, 1 - PROBABILITY_EPSILON)
+
+    scored = pd.DataFrame({
+        'court': predictions['court'].astype(object).where(predictions['court'].notna(), 'не указан'),
+        'period': predictions['date'].dt.to_period(period).astype(str),
+        'probability': probability,
+        'result': result,
+        # Порог тот же, что в format_prediction
+        'correct': ((probability > 0.5) == (result == 1)).astype(np.float64),
+        'log_loss': -(result * np.log(clipped) + (1 - result) * np.log(1 - clipped)),
+        'brier': (probability - result) ** 2
+    })
+    scored['bin'] = pd.cut(scored['probability'], np.linspace(0, 1, bins + 1), include_lowest=True).astype(str)
+
+    def metrics(group_columns):
+        grouped = scored.groupby(group_columns, sort=True) if group_columns else scored.groupby(lambda _: 'Все')
+        return grouped.agg(matches=('result', 'size'), accuracy=('correct', 'mean'), log_loss=('log_loss', 'mean'),
+                           brier=('brier', 'mean'), mean_probability=('probability', 'mean'),
+                           win_rate=('result', 'mean')).reset_index()
+
+    calibration = pd.concat([
+        scored.assign(court='Все').groupby(['court', 'bin']).agg(
+            matches=('result', 'size'), mean_probability=('probability', 'mean'), win_rate=('result', 'mean')),
+        scored.groupby(['court', 'bin']).agg(
+            matches=('result', 'size'), mean_probability=('probability', 'mean'), win_rate=('result', 'mean'))
+    ]).reset_index()
+
+    return {
+        'Итого': metrics(None).drop(columns='index'),
+        'По кортам': metrics('court'),
+        'По периодам': metrics('period'),
+        'Калибровка': calibration
+    }
+
+
+def check_point_in_time(samples=50, seed=0, feature_info_path='feature_info.pkl'):
+    """
+    Проверяет, что признаки бэктеста совпадают с признаками make_prediction
+
+    Для случайных матчей строится снимок игроков только по строкам до матча,
+    по нему - признаки тем же путем, что в индексе статистики, и сравниваются
+    с признаками бэктеста. При расхождении - AssertionError.
+    """
+    table = load_stats_table()
+    latest, windows, previous = player_states(table)
+    matches = pair_matches(table, previous)
+    feature_cols = get_model_holder(feature_info_path=feature_info_path).get().feature_cols
+
+    stats = table.decoded().reset_index(drop=True)
+    positions = np.random.default_rng(seed).choice(len(matches), min(samples, len(matches)), replace=False)
+    for position in positions:
+        match = matches.iloc[[position]]
+        features = match_features_before(latest, windows, match, feature_cols)
+
+        # Состояние игроков - по всем их строкам до строк этого матча
+        rows = [match['previous1'].iloc[0], match['previous2'].iloc[0]]
+        names = [stats['player'].iloc[row] if row >= 0 else f"unknown {number}" for number, row in enumerate(rows)]
+        history = [stats.iloc[:row + 1][stats['player'].iloc[:row + 1] == player]
+                   for player, row in zip(names, rows) if row >= 0]
+        snapshot = build_snapshot(pd.concat(history) if history else stats.iloc[:0])
+        matrix = build_feature_matrix(snapshot, window_stats(snapshot))
+        court = match['court'].iloc[0]
+        court = None if pd.isna(court) else court
+        expected = assemble_match_features(matrix, [(names[0], names[1], None, None, court)], feature_cols)
+
+        assert np.array_equal(features, expected), f"Признаки матча {position} не совпадают: {features} != {expected}"
+        assert features[0, feature_cols.index('r1')] == DEFAULT_RATING
+
+    return len(positions)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--period", default='Q')
+    parser.add_argument("--engine", default=None)
+    parser.add_argument("--output", default=None, help="файл .xlsx для отчета")
+    parser.add_argument("--check", action="store_true", help="только проверить признаки на случайных матчах")
+    args = parser.parse_args()
+
+    if args.check:
+        from prediction_functions import check_feature_consistency
+        print(f"Признаки совпадают для {check_point_in_time()} матчей")
+        print(f"Признаки индекса совпадают с build_match_data для {check_feature_consistency()['pairs']} матчей")
+    else:
+        report = backtest_report(run_backtest(args.workers, args.chunk_size, args.engine), args.period)
+        for name, frame in report.items():
+            print(f"\n{name}\n{frame.to_string(index=False)}")
+        if args.output:
+            with pd.ExcelWriter(args.output) as writer:
+                for name, frame in report.items():
+                    frame.to_excel(writer, sheet_name=name, index=False)
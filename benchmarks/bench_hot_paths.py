@@ -0,0 +1,250 @@
+"""
+Бенчмарки горячих путей статистики и предсказаний на синтетических данных
+
+Для каждого размера данных в отдельном процессе (чтобы индексы и кеши не
+переходили между размерами) измеряются время и пиковая память (tracemalloc):
+загрузка истории и догрузка новых матчей, построение индекса, загрузка всей
+таблицы статистики (с построением кеша и из кеша), поиск статистики
+игрока, одиночное предсказание (по готовому словарю признаков и полное - от имен
+игроков), пакетное предсказание, вызов модели каждым движком на разном числе строк.
+Время измеряется отдельным проходом без tracemalloc.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_hot_paths --sizes small,medium --output bench.json
+    python -m benchmarks.bench_hot_paths --sizes small --compare bench.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+
+SIZES = {
+    'small': {'players': 200, 'matches': 2000, 'days': 365},
+    'medium': {'players': 1000, 'matches': 20000, 'days': 3 * 365},
+    'large': {'players': 3000, 'matches': 100000, 'days': 10 * 365}
+}
+
+# Число строк в вызове модели для сравнения движков предсказаний (выбор PREDICTION_ENGINE по умолчанию)
+ENGINE_ROWS = (1, 64, 256, 1024, 16000)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_PATH = os.path.join(ROOT, 'best_xgb_model.json')
+FEATURE_INFO_PATH = os.path.join(ROOT, 'feature_info.pkl')
+
+
+def measure(func, repeat=1, memory=True):
+    """
+    Возвращает среднее время вызова func и пиковую память одного вызова
+    """
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    result = {'seconds': (time.perf_counter() - started) / repeat, 'repeat': repeat}
+
+    if memory:
+        result['peak_mb'] = peak_memory(func)
+    return result
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+@contextlib.contextmanager
+def workdir(path):
+    previous = os.getcwd()
+    os.makedirs(path, exist_ok=True)
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(previous)
+
+
+def measure_ingest(base_dir, name, xlsx_path):
+    # Загрузка меняет базу (повторная загрузка того же файла пропускается целиком),
+    # поэтому время и память меряются на двух копиях исходной базы
+    from stat_upload import add_batch_matches_and_update_stats
+
+    result = {}
+    for run in ['time', 'memory']:
+        run_dir = os.path.join(base_dir, f"{name}_{run}")
+        shutil.copytree(os.path.join(base_dir, 'db'), run_dir)
+        with workdir(run_dir), contextlib.redirect_stdout(io.StringIO()):
+            if run == 'time':
+                result.update(measure(lambda: add_batch_matches_and_update_stats(xlsx_path), memory=False))
+            else:
+                result['peak_mb'] = peak_memory(lambda: add_batch_matches_and_update_stats(xlsx_path))
+    return result
+
+
+def run_size(size_name, params, seed):
+    """
+    Выполняет все бенчмарки для одного размера данных (в отдельном процессе)
+    """
+    import pandas as pd
+
+    from benchmarks.synthetic_data import generate_fixtures, generate_matches, player_names, write_xlsx
+
+    base_dir = tempfile.mkdtemp(prefix=f"bench_{size_name}_")
+    try:
+        history = generate_matches(params['players'], params['matches'], days=params['days'], seed=seed)
+        start = history['Дата'].max() + pd.Timedelta(days=1)
+        new_matches = generate_matches(params['players'], max(1, params['matches'] // 20), days=30,
+                                       start=start, seed=seed + 1)
+        history_xlsx = write_xlsx(history, os.path.join(base_dir, 'history.xlsx'))
+        new_xlsx = write_xlsx(new_matches, os.path.join(base_dir, 'new_matches.xlsx'))
+        os.makedirs(os.path.join(base_dir, 'db'))
+
+        results = {'params': params}
+        results['ingest_history'] = measure_ingest(base_dir, 'history', history_xlsx)
+
+        # Догрузка новых матчей поверх загруженной истории
+        shutil.rmtree(os.path.join(base_dir, 'db'))
+        shutil.copytree(os.path.join(base_dir, 'history_time'), os.path.join(base_dir, 'db'))
+        results['ingest_new_matches'] = measure_ingest(base_dir, 'new', new_xlsx)
+
+        with workdir(os.path.join(base_dir, 'new_time')):
+            # compute_prediction берет модель по относительным путям
+            shutil.copy(MODEL_PATH, '.')
+            shutil.copy(FEATURE_INFO_PATH, '.')
+
+            import stats_index
+            from prediction_functions import (build_match_data, compute_prediction, get_player_stats,
+                                              make_predictions_batch, predict_using_match_data)
+
+            results['index_load'] = measure(stats_index.load_stats_index)
+
+            import stats_table
+
+            def build_stats_table():
+                if os.path.exists(stats_table.TABLE_CACHE_PATH):
+                    os.remove(stats_table.TABLE_CACHE_PATH)
+                stats_table.load_stats_table()
+
+            results['stats_table_build'] = measure(build_stats_table)
+            results['stats_table_cached'] = measure(stats_table.load_stats_table, repeat=5)
+
+            rng = random.Random(seed)
+            names = player_names(params['players'])
+            results['player_lookup'] = measure(lambda: get_player_stats(rng.choice(names), 'hard'),
+                                               repeat=1000)
+
+            match_data = build_match_data(names[0], names[1], 350, 420, 'hard')
+            predict = lambda: predict_using_match_data(match_data, model_path=MODEL_PATH,
+                                                       feature_info_path=FEATURE_INFO_PATH)
+            predict()
+            results['predict_single'] = measure(predict, repeat=200)
+            results['compute_prediction'] = measure(lambda: compute_prediction(names[0], names[1], 350, 420, 'hard'),
+                                                    repeat=200)
+
+            fixtures = generate_fixtures(params['players'], 1000, seed=seed)
+            pairs = list(zip(fixtures['Игрок 1'], fixtures['Игрок 2'], fixtures['R1'], fixtures['R2'],
+                             fixtures['Корт']))
+            results['predict_batch_1000'] = measure(
+                lambda: make_predictions_batch(pairs, model_path=MODEL_PATH, feature_info_path=FEATURE_INFO_PATH),
+                repeat=5
+            )
+
+            # Один вызов модели на готовой матрице признаков каждым движком
+            from model_holder import ENGINES, get_model_holder
+            from prediction_functions import match_features
+
+            engine_fixtures = generate_fixtures(params['players'], max(ENGINE_ROWS), seed=seed)
+            engine_pairs = list(zip(engine_fixtures['Игрок 1'], engine_fixtures['Игрок 2'], engine_fixtures['R1'],
+                                    engine_fixtures['R2'], engine_fixtures['Корт']))
+            for engine in ENGINES:
+                loaded = get_model_holder(MODEL_PATH, FEATURE_INFO_PATH, engine).get()
+                features = match_features(engine_pairs, loaded.feature_cols)
+                for rows in ENGINE_ROWS:
+                    rows_features = features[:rows]
+                    results[f'engine_{engine}_{rows}'] = measure(lambda: loaded.model.predict_proba(rows_features),
+                                                                 repeat=max(3, 2000 // rows), memory=False)
+        return results
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+def environment():
+    import numpy
+    import pandas
+    import xgboost
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'pandas': pandas.__version__,
+        'xgboost': xgboost.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def compare(baseline, current):
+    """
+    Печатает отношение времени и памяти текущего прогона к сохраненному
+    """
+    print(f"{'size':<8} {'benchmark':<20} {'seconds':>12} {'ratio':>7} {'peak_mb':>9} {'ratio':>7}")
+    for size_name, results in current['results'].items():
+        for name, result in results.items():
+            if name == 'params':
+                continue
+            base = baseline['results'].get(size_name, {}).get(name)
+            time_ratio = result['seconds'] / base['seconds'] if base else float('nan')
+            peak_mb = result.get('peak_mb', float('nan'))
+            memory_ratio = peak_mb / base['peak_mb'] if base and base.get('peak_mb') else float('nan')
+            print(f"{size_name:<8} {name:<20} {result['seconds']:>12.6f} {time_ratio:>7.2f} "
+                  f"{peak_mb:>9.2f} {memory_ratio:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='small,medium', help=f"через запятую из {', '.join(SIZES)}")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="файл для результатов в JSON (по умолчанию - stdout)")
+    parser.add_argument('--compare', help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    report = {'environment': environment(), 'results': {}}
+    context = multiprocessing.get_context('spawn')
+    for size_name in args.sizes.split(','):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            report['results'][size_name] = executor.submit(run_size, size_name, SIZES[size_name], args.seed).result()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
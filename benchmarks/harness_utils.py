@@ -0,0 +1,126 @@
+import asyncio
+import itertools
+import time
+import typing
+from collections import Counter, defaultdict, deque
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage, TelegramMethod
+from aiogram.types import Chat, Message, User
+
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "harness_bot"}
+
+
+class FakeSession(BaseSession):
+    """
+    Сессия бота без сети: каждый запрос к Bot API сразу получает правдоподобный ответ
+
+    latency - искусственная задержка ответа Bot API в секундах. Для каждого чата
+    можно дождаться следующего отправленного ботом сообщения (wait_message).
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.requests = Counter()
+        self._message_ids = itertools.count(1)
+        self._waiters = defaultdict(deque)
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    def wait_message(self, chat_id: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append(future)
+        return future
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: int | None = None):
+        self.requests[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        result = self._fake_result(bot, method)
+        if isinstance(method, SendMessage):
+            waiters = self._waiters.get(method.chat_id)
+            while waiters:
+                future = waiters.popleft()
+                if not future.done():
+                    future.set_result(result)
+                    break
+        return result
+
+    def _fake_result(self, bot: Bot, method: TelegramMethod):
+        returning = method.__returning__
+        types = typing.get_args(returning) or (returning,)
+        if Message in types:
+            chat_id = getattr(method, "chat_id", None) or 0
+            return Message(message_id=next(self._message_ids), date=datetime.now(),
+                           chat=Chat(id=chat_id, type="private"), from_user=User(**BOT_USER),
+                           text=getattr(method, "text", None)).as_(bot)
+        if User in types:
+            return User(**BOT_USER)
+        if bool in types:
+            return True
+        return []
+
+
+_update_ids = itertools.count(1)
+
+
+def message_update(user_id: int, text: str) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+            "text": text
+        }
+    }
+
+
+def callback_update(user_id: int, data: str, text: str = "") -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(_update_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": text
+            }
+        }
+    }
+
+
+def prediction_dialog(user_id: int, first_player: str, second_player: str) -> list[dict]:
+    """
+    Обновления полного диалога /make_prediction; на каждое бот отвечает сообщением
+    """
+    return [
+        message_update(user_id, "/make_prediction"),
+        message_update(user_id, first_player),
+        message_update(user_id, second_player),
+        callback_update(user_id, "skip-rating-writing"),
+        callback_update(user_id, "skip-rating-writing"),
+        callback_update(user_id, "court-type:hard")
+    ]
+
+
+def percentiles(values: list[float], points=(50, 95, 99)) -> dict:
+    if not values:
+        return {f"p{point}": None for point in points}
+    ordered = sorted(values)
+    return {f"p{point}": ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))] for point in points}
@@ -0,0 +1,139 @@
+"""
+Нагрузочная проверка диспетчера с виртуальными пользователями без сети
+
+Обновления подаются прямо в Dispatcher.feed_update с настоящими роутерами из
+handlers/custom, сессия бота подменена на FakeSession. Каждый пользователь
+проходит полный диалог /make_prediction (имена игроков, пропуск рейтингов,
+выбор корта). Для каждого уровня одновременности (сколько пользователей ведут
+диалог одновременно) печатаются задержки обработчиков p50/p95/p99, пропускная
+способность и задержка цикла событий.
+
+Запуск из корня репозитория:
+    python -m benchmarks.load_harness --users 200 --concurrency 1,8,32,128
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+
+os.environ.setdefault("BOT_TOKEN", "123456:harness")
+
+from aiogram.types import Update
+
+from benchmarks.harness_utils import FakeSession, percentiles, prediction_dialog
+from loader import bot, dp, job_runner
+from main import setup_routers
+from prediction_functions import prediction_cache
+from stats_store import load_snapshot
+
+
+class LoopLagMonitor:
+    """
+    Измеряет, на сколько просыпание цикла событий опаздывает относительно interval
+    """
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - started - self.interval))
+
+    def start(self) -> None:
+        self.lags = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> list[float]:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return self.lags
+
+
+async def run_user(updates: list[dict], latencies: list[float], errors: Counter) -> None:
+    for update in updates:
+        started = time.perf_counter()
+        try:
+            await dp.feed_update(bot, Update.model_validate(update, context={"bot": bot}))
+        except Exception as exc:
+            # Ошибка в обработчике обрывает диалог: следующие шаги не имеют смысла
+            errors[type(exc).__name__] += 1
+            return
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_level(concurrency: int, users: int, players: list[str], first_user_id: int) -> dict:
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = Counter()
+
+    async def limited_user(user_id: int) -> None:
+        dialog = prediction_dialog(user_id, players[user_id % len(players)], players[(user_id + 1) % len(players)])
+        async with slots:
+            await run_user(dialog, latencies, errors)
+
+    # Кеш предсказаний очищается, чтобы уровни не пользовались результатами предыдущих
+    prediction_cache.clear()
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(limited_user(user_id) for user_id in range(first_user_id, first_user_id + users)))
+    duration = time.perf_counter() - started
+    lags = await monitor.stop()
+
+    return {
+        "concurrency": concurrency,
+        "users": users,
+        "updates": len(latencies),
+        "failed_dialogs": sum(errors.values()),
+        "errors": dict(errors),
+        "duration": duration,
+        "updates_per_second": len(latencies) / duration,
+        "dialogs_per_second": (users - sum(errors.values())) / duration,
+        "latency": percentiles(latencies),
+        "loop_lag": {**percentiles(lags), "max": max(lags, default=None)}
+    }
+
+
+async def main(users: int, levels: list[int], latency: float) -> dict:
+    session = FakeSession(latency=latency)
+    bot.session = session
+    setup_routers()
+    job_runner.start()
+
+    players = list(load_snapshot().players[:100]) or ["Player A", "Player B"]
+    results = []
+    try:
+        # Прогревочный диалог: запуск процессов пула не должен попадать в первый уровень
+        await run_user(prediction_dialog(0, players[0], players[1 % len(players)]), [], Counter())
+        for index, concurrency in enumerate(levels):
+            results.append(await run_level(concurrency, users, players, first_user_id=1 + index * users))
+    finally:
+        await job_runner.shutdown()
+
+    return {
+        "levels": results,
+        "bot_api_requests": dict(session.requests),
+        "jobs": job_runner.stats(),
+        "fsm": dp.storage.stats()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100, help="число пользователей на каждом уровне")
+    parser.add_argument("--concurrency", default="1,8,32,128",
+                        help="уровни одновременности через запятую - сколько диалогов идет одновременно")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа Bot API, сек")
+    args = parser.parse_args()
+    result = asyncio.run(main(args.users, [int(level) for level in args.concurrency.split(",")], args.latency))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -0,0 +1,69 @@
+"""
+Время холодного запуска бота
+
+В отдельном процессе (чтобы модули не были уже импортированы) замеряются
+импорт main.py, импорт тяжелых модулей, загрузка индекса статистики и модели.
+Проверяется, что main.py не импортирует pandas, xgboost и openpyxl. Печатает JSON;
+результаты разных коммитов можно сравнивать между собой.
+
+Запуск из корня репозитория (в каталоге с базой статистики и моделью):
+    python -m benchmarks.startup_time --repeat 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['pandas', 'numpy', 'xgboost', 'openpyxl', 'prediction_functions', 'stat_upload']
+
+MEASURE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+heavy_loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+import prediction_functions, stat_upload, stats_index
+from model_holder import get_model_holder
+heavy_imported = time.perf_counter()
+stats_index.load_stats_index()
+index_loaded = time.perf_counter()
+get_model_holder(engine=prediction_functions.PREDICTION_ENGINE).get()
+model_loaded = time.perf_counter()
+print(json.dumps({
+    "import_main": imported - started,
+    "heavy_imports": heavy_imported - imported,
+    "stats_index": index_loaded - heavy_imported,
+    "model": model_loaded - index_loaded,
+    "total": model_loaded - started,
+    "heavy_modules_loaded_by_main": heavy_loaded
+}))
+"""
+
+
+def measure_once():
+    env = dict(os.environ, BOT_TOKEN=os.environ.get("BOT_TOKEN", "123456:startup"),
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    code = f"HEAVY_MODULES = {HEAVY_MODULES!r}\n{MEASURE}"
+    output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(repeat):
+    runs = [measure_once() for _ in range(repeat)]
+    stages = [stage for stage in runs[0] if stage != "heavy_modules_loaded_by_main"]
+    return {
+        "python": sys.version.split()[0],
+        "repeat": repeat,
+        "best": {stage: min(run[stage] for run in runs) for stage in stages},
+        "runs": runs
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(main(args.repeat), ensure_ascii=False, indent=2))
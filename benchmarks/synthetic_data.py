@@ -0,0 +1,76 @@
+"""
+Генератор синтетических матчей и списков матчей для бенчмарков
+
+Файлы имеют те же колонки, что и реальные выгрузки: матчи для /upload_stat
+(Игрок 1, Игрок 2, Дата, Круг, Корт, R1, R2, Сеты) и матчи для /predict_batch
+(Игрок 1, Игрок 2, R1, R2, Корт).
+"""
+import numpy as np
+import pandas as pd
+
+
+COURTS = ['hard', 'i.hard', 'clay', 'capret', 'grass']
+STAGES = ['R1', 'R2', 'R3', 'QF', 'SF', 'F']
+
+
+def player_names(n_players):
+    return [f"Player {i:05d}" for i in range(n_players)]
+
+
+def generate_matches(n_players, n_matches, days=365, start='2023-01-01', seed=0):
+    """
+    Генерирует матчи между n_players игроками, равномерно распределенные по days дням
+
+    Часть имен первого игрока идет с посевом "(N) ", часть результатов пустая -
+    как в реальных файлах.
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array(player_names(n_players), dtype=object)
+
+    player1 = rng.integers(0, n_players, n_matches)
+    player2 = (player1 + rng.integers(1, n_players, n_matches)) % n_players
+    dates = pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.integers(0, days, n_matches)), unit='D')
+
+    # Счет по сетам: победитель берет 2 сета, проигравший 0 или 1
+    player1_wins = rng.random(n_matches) < 0.5
+    loser_sets = rng.integers(0, 2, n_matches)
+    sets = np.where(player1_wins,
+                    [f"2-{sets}" for sets in loser_sets],
+                    [f"{sets}-2" for sets in loser_sets]).astype(object)
+    sets[rng.random(n_matches) < 0.01] = None
+
+    seeded = rng.random(n_matches) < 0.2
+    first_names = np.where(seeded, [f"({seed_number}) " for seed_number in rng.integers(1, 9, n_matches)], '')
+
+    return pd.DataFrame({
+        'Игрок 1': first_names + names[player1],
+        'Игрок 2': names[player2],
+        'Дата': dates,
+        'Круг': rng.choice(STAGES, n_matches),
+        'Корт': rng.choice(COURTS, n_matches),
+        'R1': rng.integers(50, 700, n_matches),
+        'R2': rng.integers(50, 700, n_matches),
+        'Сеты': sets
+    })
+
+
+def generate_fixtures(n_players, n_fixtures, seed=0):
+    """
+    Генерирует список матчей для пакетного предсказания
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array(player_names(n_players), dtype=object)
+    player1 = rng.integers(0, n_players, n_fixtures)
+    player2 = (player1 + rng.integers(1, n_players, n_fixtures)) % n_players
+    return pd.DataFrame({
+        'Игрок 1': names[player1],
+        'Игрок 2': names[player2],
+        'R1': rng.integers(50, 700, n_fixtures),
+        'R2': rng.integers(50, 700, n_fixtures),
+        'Корт': rng.choice(COURTS, n_fixtures)
+    })
+
+
+def write_xlsx(df, path):
+    df.to_excel(path, index=False)
+    return path
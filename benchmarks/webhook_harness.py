@@ -0,0 +1,96 @@
+"""
+Локальная проверка webhook-режима без сети
+
+Поднимает webhook-приложение бота на локальном порту, подменяет сессию бота
+на FakeSession и отправляет POST-запросами синтетические обновления: каждый
+пользователь проходит диалог /make_prediction, дожидаясь ответа бота на каждый
+шаг. Печатает JSON с пропускной способностью и задержками (от POST до ответа бота).
+
+Запуск из корня репозитория:
+    python -m benchmarks.webhook_harness --users 200 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("BOT_TOKEN", "123456:harness")
+
+import aiohttp
+from aiohttp.test_utils import TestServer
+
+from benchmarks.harness_utils import FakeSession, percentiles, prediction_dialog
+from loader import bot, dp, job_runner
+from main import health_info, setup_routers
+from stats_store import load_snapshot
+from utils.webhook_server import create_webhook_app
+
+
+async def run_user(client: aiohttp.ClientSession, url: str, session: FakeSession, updates: list[dict],
+                   latencies: list[float], timeout: float) -> int:
+    for update in updates:
+        user_id = (update.get("message") or update["callback_query"])["from"]["id"]
+        reply = session.wait_message(user_id)
+        started = time.perf_counter()
+        async with client.post(url, json=update) as response:
+            response.raise_for_status()
+        try:
+            await asyncio.wait_for(reply, timeout)
+        except asyncio.TimeoutError:
+            # Бот не ответил (например, ошибка в обработчике) - остальной диалог не имеет смысла
+            return 1
+        latencies.append(time.perf_counter() - started)
+    return 0
+
+
+async def main(users: int, concurrency: int, latency: float, timeout: float) -> dict:
+    session = FakeSession(latency=latency)
+    bot.session = session
+    setup_routers()
+    job_runner.start()
+
+    players = list(load_snapshot().players[:100]) or ["Player A", "Player B"]
+    app = create_webhook_app(dp, bot, path="/webhook", max_concurrency=concurrency, health_info=health_info)
+    server = TestServer(app)
+    await server.start_server()
+    url = str(server.make_url("/webhook"))
+
+    latencies = []
+    try:
+        async with aiohttp.ClientSession() as client:
+            started = time.perf_counter()
+            failed = await asyncio.gather(*(
+                run_user(client, url, session,
+                         prediction_dialog(user_id, players[user_id % len(players)],
+                                           players[(user_id + 1) % len(players)]), latencies, timeout)
+                for user_id in range(1, users + 1)
+            ))
+            duration = time.perf_counter() - started
+            async with client.get(server.make_url("/health")) as response:
+                health = await response.json()
+    finally:
+        await server.close()
+        await job_runner.shutdown()
+
+    return {
+        "users": users,
+        "updates": len(latencies),
+        "failed_dialogs": sum(failed),
+        "duration": duration,
+        "updates_per_second": len(latencies) / duration,
+        "latency": percentiles(latencies),
+        "bot_api_requests": dict(session.requests),
+        "health": health
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=64, help="лимит одновременно обрабатываемых обновлений")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа Bot API, сек")
+    parser.add_argument("--timeout", type=float, default=60.0, help="сколько ждать ответа бота на шаг диалога, сек")
+    args = parser.parse_args()
+    result = asyncio.run(main(args.users, args.concurrency, args.latency, args.timeout))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -0,0 +1,167 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from model_holder import get_model_holder
+from prediction_functions import PREDICTION_ENGINE, match_features
+from stat_upload import strip_seed
+
+
+# Сколько раз разыгрывается сетка по умолчанию
+DRAW_SIMULATIONS = int(os.getenv("DRAW_SIMULATIONS", 10000))
+# Пустое место в сетке: соперник проходит дальше без игры
+BYE_NAMES = {'', 'bye'}
+
+
+class DrawError(ValueError):
+    pass
+
+
+def read_draw(draw_xlsx):
+    """
+    Читает сетку турнира: пары первого круга в порядке сетки
+
+    Файл имеет те же колонки, что и файл матчей для предсказаний:
+    Игрок 1, Игрок 2, R1, R2, Корт. Пустое имя или "Bye" - свободное место.
+    Корт берется из первой заполненной ячейки колонки Корт.
+
+    Возвращает:
+    tuple: (участники по местам сетки, None для свободного места; рейтинги; корт)
+    """
+    draw = pd.read_excel(draw_xlsx, usecols=['Игрок 1', 'Игрок 2', 'R1', 'R2', 'Корт'])
+    slots = len(draw) * 2
+    if slots < 2 or slots & (slots - 1):
+        raise DrawError(f"В сетке должно быть 2, 4, 8, 16... мест, а в файле {slots}")
+
+    names = []
+    ratings = []
+    for name_column, rating_column in [('Игрок 1', 'R1'), ('Игрок 2', 'R2')]:
+        column_names = strip_seed(draw[name_column].fillna('').astype(str))
+        names.append([None if name.strip().lower() in BYE_NAMES else name for name in column_names])
+        ratings.append(draw[rating_column].astype(object).where(draw[rating_column].notna(), None).tolist())
+
+    # Места сетки идут парами: первый и второй игрок каждой строки
+    slot_names = [name for pair in zip(*names) for name in pair]
+    slot_ratings = [rating for pair in zip(*ratings) for rating in pair]
+    courts = draw['Корт'].dropna()
+    court = courts.iloc[0] if not courts.empty else None
+    return slot_names, slot_ratings, court
+
+
+def pairwise_win_matrix(players, ratings, court, model_path='best_xgb_model.json',
+                        feature_info_path='feature_info.pkl'):
+    """
+    Считает вероятности побед каждого участника над каждым одним вызовом модели
+
+    Модель оценивает победу первого игрока, поэтому для пары берется среднее
+    оценок при обоих порядках игроков: matrix[i, j] + matrix[j, i] = 1.
+
+    Возвращает:
+    np.ndarray: Матрица (участники x участники), matrix[i, j] - вероятность победы i над j
+    """
+    n_players = len(players)
+    first, second = np.nonzero(~np.eye(n_players, dtype=bool))
+    pairs = [(players[i], players[j], ratings[i], ratings[j], court) for i, j in zip(first, second)]
+
+    matrix = np.full((n_players, n_players), 0.5)
+    if pairs:
+        loaded = get_model_holder(model_path, feature_info_path, PREDICTION_ENGINE).get()
+        matrix[first, second] = loaded.model.predict_proba(match_features(pairs, loaded.feature_cols))[:, 1]
+    return (matrix + 1 - matrix.T) / 2
+
+
+def simulate_bracket(win_matrix, slots, iterations=DRAW_SIMULATIONS, seed=None):
+    """
+    Разыгрывает сетку iterations раз одновременно (по строке массива на розыгрыш)
+
+    Параметры:
+    win_matrix (np.ndarray): Вероятности побед участников друг над другом
+    slots (np.ndarray): Номер участника на каждом месте сетки, -1 - свободное место
+    iterations (int): Число розыгрышей
+
+    Возвращает:
+    np.ndarray: reach[r, i] - доля розыгрышей, в которых участник i сыграл в круге r + 1;
+    последняя строка - доля побед в турнире
+    """
+    rng = np.random.default_rng(seed)
+    n_players = len(win_matrix)
+    # Свободное место - дополнительный участник, который всегда проигрывает
+    bye = n_players
+    probabilities = np.zeros((n_players + 1, n_players + 1))
+    probabilities[:n_players, :n_players] = win_matrix
+    probabilities[:n_players, bye] = 1.0
+    probabilities[bye, bye] = 1.0
+
+    alive = np.tile(np.where(slots < 0, bye, slots), (iterations, 1))
+    reach = []
+    while True:
+        counts = np.bincount(alive.ravel(), minlength=n_players + 1)[:n_players]
+        reach.append(counts / iterations)
+        if alive.shape[1] == 1:
+            break
+        first, second = alive[:, 0::2], alive[:, 1::2]
+        first_wins = rng.random(first.shape) < probabilities[first, second]
+        alive = np.where(first_wins, first, second)
+
+    return np.array(reach)
+
+
+def round_names(n_slots):
+    """
+    Названия кругов после первого по числу оставшихся мест; последний элемент - победа в турнире
+    """
+    names = []
+    for remaining in (2 ** power for power in range(n_slots.bit_length() - 2, 0, -1)):
+        if remaining == 2:
+            names.append("Финал")
+        elif remaining == 4:
+            names.append("1/2 финала")
+        else:
+            names.append(f"1/{remaining // 2} финала")
+    names.append("Победа в турнире")
+    return names
+
+
+def simulate_draw(draw_xlsx, iterations=DRAW_SIMULATIONS, seed=None):
+    """
+    Считает для каждого участника сетки вероятность дойти до каждого круга
+
+    Возвращает:
+    pd.DataFrame: Участники (по убыванию вероятности победы) и вероятности кругов
+    """
+    slot_names, slot_ratings, court = read_draw(draw_xlsx)
+    entrants = [position for position, name in enumerate(slot_names) if name is not None]
+    if not entrants:
+        raise DrawError("В сетке нет ни одного игрока")
+
+    players = [slot_names[position] for position in entrants]
+    ratings = [slot_ratings[position] for position in entrants]
+    slots = np.full(len(slot_names), -1)
+    slots[entrants] = np.arange(len(entrants))
+
+    win_matrix = pairwise_win_matrix(players, ratings, court)
+    reach = simulate_bracket(win_matrix, slots, iterations, seed)
+
+    # Первый круг все участники играют (или проходят без игры) - его не выводим
+    names = round_names(len(slots))
+    result = pd.DataFrame(reach[1:].T, columns=names)
+    result.insert(0, 'Игрок', players)
+    return result.sort_values(names[::-1], ascending=False, kind='stable').reset_index(drop=True)
+
+
+def simulate_draw_xlsx_bytes(draw_xlsx, iterations=DRAW_SIMULATIONS):
+    """
+    Разыгрывает сетку и возвращает содержимое файла результатов и короткую сводку
+
+    Используется пулом задач: из процесса возвращаются только байты файла и текст.
+    """
+    result = simulate_draw(draw_xlsx, iterations)
+    results_xlsx = io.BytesIO()
+    result.to_excel(results_xlsx, index=False)
+
+    favourites = result.head(5)
+    summary = "\n".join(f"{player}: {probability:.1%}"
+                        for player, probability in zip(favourites['Игрок'], favourites.iloc[:, -1]))
+    return results_xlsx.getvalue(), summary
@@ -0,0 +1,214 @@
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+
+# Показатели игрока, из которых складывается его половина вектора признаков матча
+PLAYER_FEATURES = ['cumulative_wins', 'cumulative_losses', 'streak', 'court_wins', 'court_losses', 'wins_last_5',
+                   'wins_last_30d', 'matches_last_30d', 'win_rt', 'court_win_rt', 'win_rt_last_30']
+# Показатели, которые зависят от того, совпадает ли корт матча с кортом последнего матча игрока
+COURT_FEATURES = ['court_wins', 'court_losses', 'court_win_rt']
+# Признаки-разности показателей первого и второго игрока
+DIFF_FEATURES = {
+    'losses_diff': 'cumulative_losses',
+    'streak_diff': 'streak',
+    'court_wins_diff': 'court_wins',
+    'court_losses_diff': 'court_losses',
+    'last_5wins_diff': 'wins_last_5',
+    'last_30d_wins_diff': 'wins_last_30d',
+    'last_30d_games_diff': 'matches_last_30d',
+    'win_rt_diff': 'win_rt',
+    'court_win_rt_diff': 'court_win_rt',
+    'win_rt_last_30_diff': 'win_rt_last_30'
+}
+# Признаки, которые модель получает постоянными значениями (как в build_match_data)
+CONSTANT_FEATURES = {'Unnamed: 0': 20000, 'p1_cumulative_wins': 2500, 'p2_cumulative_wins': 500, 'wins_diff': 2000}
+RATING_FEATURES = ['r1', 'r2', 'r1_was_missing', 'r2_was_missing', 'rating_diff', 'rating_mean', 'rating_ratio']
+# Рейтинг, который подставляется, если рейтинг не указан
+DEFAULT_RATING = 329
+
+_COURT_POSITIONS = [PLAYER_FEATURES.index(feature) for feature in COURT_FEATURES]
+_DIFF_POSITIONS = [PLAYER_FEATURES.index(feature) for feature in DIFF_FEATURES.values()]
+
+
+@dataclass(frozen=True)
+class FeatureMatrix:
+    """
+    Показатели игроков для признаков матча, уложенные в матрицу NumPy
+
+    features[player_ids[игрок]] - показатели игрока (PLAYER_FEATURES) для матча на
+    корте его последнего матча или без указания корта; other_court - показатели
+    COURT_FEATURES для матча на любом другом корте; courts - корт последнего матча.
+    Последняя строка - нулевые показатели игрока, которого нет в статистике.
+    """
+    player_ids: dict
+    features: np.ndarray
+    other_court: np.ndarray
+    courts: np.ndarray
+
+    @property
+    def unknown_id(self):
+        return len(self.features) - 1
+
+    def rows(self, players, courts):
+        """
+        Возвращает показатели игроков (по строке на игрока) для матчей на указанных кортах
+        """
+        ids = np.fromiter((self.player_ids.get(player, self.unknown_id) for player in players), dtype=np.intp)
+        rows = self.features[ids]
+        # Как в get_player_stats: счетчики корта продолжаются, только если корт не указан
+        # или совпадает с кортом последнего матча
+        other = np.fromiter((court is not None and court != latest_court
+                             for court, latest_court in zip(courts, self.courts[ids])), dtype=bool, count=len(ids))
+        if other.any():
+            rows[np.ix_(other, _COURT_POSITIONS)] = self.other_court[ids[other]]
+        return rows
+
+    def updated(self, changed):
+        """
+        Возвращает матрицу, в которой строки игроков из changed заменены или добавлены
+        """
+        player_ids = dict(self.player_ids)
+        known = len(player_ids)
+        for player in changed.player_ids:
+            if player not in player_ids:
+                player_ids[player] = len(player_ids)
+
+        size = len(player_ids) + 1
+        features = _resized(self.features, known, size)
+        other_court = _resized(self.other_court, known, size)
+        courts = _resized(self.courts, known, size)
+
+        targets = np.fromiter((player_ids[player] for player in changed.player_ids), dtype=np.intp)
+        sources = np.fromiter(changed.player_ids.values(), dtype=np.intp)
+        features[targets] = changed.features[sources]
+        other_court[targets] = changed.other_court[sources]
+        courts[targets] = changed.courts[sources]
+        return FeatureMatrix(player_ids=player_ids, features=features, other_court=other_court, courts=courts)
+
+
+def _resized(array, known, size):
+    # Строки известных игроков копируются, новые строки и строка неизвестного игрока - нулевые
+    resized = np.zeros((size,) + array.shape[1:], dtype=array.dtype)
+    if array.dtype == object:
+        resized[:] = None
+    resized[:known] = array[:known]
+    return resized
+
+
+def build_feature_matrix(snapshot, windows):
+    """
+    Считает показатели игроков снимка так же, как get_player_stats, но сразу для всех
+
+    Параметры:
+    snapshot (PlayerSnapshot): Снимок состояния игроков
+    windows (pd.DataFrame): window_stats(snapshot)
+
+    Возвращает:
+    FeatureMatrix: Матрица показателей игроков снимка
+    """
+    latest = snapshot.latest
+    windows = windows.reindex(latest.index)
+
+    def column(frame, name):
+        return frame[name].to_numpy(dtype=np.float64)
+
+    result = column(latest, 'result')
+    cumulative_wins = column(latest, 'cumulative_wins') + result
+    cumulative_losses = column(latest, 'cumulative_losses') + (1 - result)
+    streak = column(latest, 'streak')
+    streak = np.where(result == 1, np.where(streak < 0, 1, streak + 1), np.where(streak > 0, -1, streak - 1))
+
+    court_wins = column(latest, 'court_wins')
+    court_losses = column(latest, 'court_losses')
+
+    # Если из 5 последних матчей известны все, самый старый выходит из окна
+    wins_last_5 = column(latest, 'wins_last_5') + result
+    wins_last_5 = np.where(column(windows, 'last_5_count') == 5,
+                           wins_last_5 - column(windows, 'last_5_oldest_result'), wins_last_5)
+    wins_last_30d = column(windows, 'wins_last_30d')
+    matches_last_30d = column(windows, 'matches_last_30d')
+
+    features = np.column_stack([
+        cumulative_wins, cumulative_losses, streak,
+        court_wins + result, court_losses + (1 - result),
+        wins_last_5, wins_last_30d, matches_last_30d,
+        _rate(cumulative_wins, cumulative_losses), _rate(court_wins + result, court_losses + (1 - result)),
+        _share(wins_last_30d, matches_last_30d)
+    ]).reshape(len(latest), len(PLAYER_FEATURES))
+    other_court = np.column_stack([court_wins, court_losses, _rate(court_wins, court_losses)]
+                                  ).reshape(len(latest), len(COURT_FEATURES))
+
+    return FeatureMatrix(
+        player_ids={player: position for position, player in enumerate(latest.index)},
+        features=np.vstack([features, np.zeros((1, len(PLAYER_FEATURES)))]),
+        other_court=np.vstack([other_court, np.zeros((1, len(COURT_FEATURES)))]),
+        courts=np.append(latest['court'].to_numpy(dtype=object), None)
+    )
+
+
+def empty_feature_matrix():
+    return FeatureMatrix(player_ids={}, features=np.zeros((1, len(PLAYER_FEATURES))),
+                         other_court=np.zeros((1, len(COURT_FEATURES))), courts=np.array([None], dtype=object))
+
+
+def _rate(wins, losses):
+    # Победы на поражение; без поражений - 1, если есть победы, иначе 0
+    ratio = np.divide(wins, losses, out=np.zeros_like(wins), where=losses > 0)
+    return np.where(losses > 0, ratio, np.where(wins > 0, 1.0, 0.0))
+
+
+def _share(wins, matches):
+    return np.divide(wins, matches, out=np.zeros_like(wins), where=matches > 0)
+
+
+def _ratings(values):
+    values = list(values)
+    # Пустой рейтинг заменяется значением по умолчанию, как при пропуске ввода в диалоге
+    missing = np.fromiter((not value for value in values), dtype=bool, count=len(values))
+    ratings = np.array([DEFAULT_RATING if is_missing else value for value, is_missing in zip(values, missing)],
+                       dtype=np.float64)
+    return ratings, missing.astype(np.float64)
+
+
+@lru_cache(maxsize=8)
+def _column_order(feature_cols):
+    candidates = (list(CONSTANT_FEATURES) + RATING_FEATURES + [f"p1_{feature}" for feature in PLAYER_FEATURES]
+                  + [f"p2_{feature}" for feature in PLAYER_FEATURES] + list(DIFF_FEATURES))
+    # Постоянные признаки идут первыми и перекрывают одноименные показатели игроков
+    positions = {}
+    for position, name in enumerate(candidates):
+        positions.setdefault(name, position)
+
+    missing_features = [col for col in feature_cols if col not in positions]
+    if missing_features:
+        raise ValueError(f"В данных отсутствуют следующие признаки: {missing_features}")
+    return np.array([positions[col] for col in feature_cols], dtype=np.intp)
+
+
+def assemble_match_features(matrix, pairs, feature_cols):
+    """
+    Собирает признаки матчей в порядке feature_cols без промежуточных словарей и DataFrame
+
+    Параметры:
+    matrix (FeatureMatrix): Показатели игроков
+    pairs (list): Кортежи (name1, name2, r1, r2, court), как аргументы make_prediction
+    feature_cols (list): Порядок признаков модели
+
+    Возвращает:
+    np.ndarray: Матрица признаков (по строке на матч)
+    """
+    names1, names2, r1_values, r2_values, courts = zip(*pairs)
+    player1 = matrix.rows(names1, courts)
+    player2 = matrix.rows(names2, courts)
+    r1, r1_missing = _ratings(r1_values)
+    r2, r2_missing = _ratings(r2_values)
+
+    constants = np.broadcast_to(np.array(list(CONSTANT_FEATURES.values()), dtype=np.float64),
+                                (len(pairs), len(CONSTANT_FEATURES)))
+    ratings = np.column_stack([r1, r2, r1_missing, r2_missing, r1 - r2, (r1 + r2) / 2, r1 / r2])
+    differences = player1[:, _DIFF_POSITIONS] - player2[:, _DIFF_POSITIONS]
+
+    candidates = np.hstack([constants, ratings, player1, player2, differences])
+    return candidates[:, _column_order(tuple(feature_cols))]
@@ -5,7 +5,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.exceptions import TelegramBadRequest
 
 from loader import logger
-from state_storage.states import UploadStat, MakePrediction
+from state_storage.states import UploadStat, MakePrediction, PredictBatch, SimulateDraw
 
 
 router = Router(name="cancel_handler")
@@ -13,7 +13,9 @@ router = Router(name="cancel_handler")
 
 @router.callback_query(F.data == "cancel-event", StateFilter(UploadStat.take_file,
                                                              MakePrediction.write_first_player,
-                                                             MakePrediction.write_second_player))
+                                                             MakePrediction.write_second_player,
+                                                             PredictBatch.take_file,
+                                                             SimulateDraw.take_file))
 async def cancel_event(call: CallbackQuery, state: FSMContext) -> None:
     await state.clear()
     try:
@@ -8,11 +8,13 @@ from aiogram.filters import StateFilter
 from aiogram.exceptions import TelegramBadRequest
 
 from state_storage.states import MakePrediction
-from loader import bot, logger
+from loader import bot, logger, job_runner
 from keyboards.inline.skip_keyboard import create_skip_rating_writing
 from keyboards.inline.court_select import create_court_select_keyboard
 from keyboards.inline.cancel_keyboard import create_cancel_keyboard
-from prediction_functions import make_prediction
+from keyboards.inline.player_select import create_player_select_keyboard
+from utils.metrics import span
+from utils.startup import import_module
 
 
 router = Router(name="make_prediction")
@@ -25,22 +27,71 @@ async def make_prediction_handler(message: Message, state: FSMContext) -> None:
     await state.set_state(MakePrediction.write_first_player)
 
 
-@router.message(MakePrediction.write_first_player)
-async def take_first_player(message: Message, state: FSMContext) -> None:
-    await state.set_data({"first_player": message.text})
+async def find_player(message: Message, state: FSMContext, step: str) -> str | None:
+    # Поиск может дочитать из базы игроков, обновленных загрузкой, поэтому выполняется в потоке
+    stats_index = await import_module("stats_index")
+    player = await asyncio.to_thread(stats_index.resolve_player_name, message.text)
+    if player is not None:
+        return player
+
+    suggestions = await asyncio.to_thread(stats_index.suggest_player_names, message.text)
+    if not suggestions:
+        return message.text
+
+    data = await state.get_data()
+    data["typed_player"] = message.text
+    data["suggestions"] = suggestions
+    await state.set_data(data)
+    await message.answer("Такого игрока нет в статистике. Возможно, вы имели в виду 👇",
+                         reply_markup=create_player_select_keyboard(step, suggestions))
+    return None
+
+
+async def save_first_player(message: Message, state: FSMContext, player: str) -> None:
+    await state.set_data({"first_player": player})
     await message.answer("Введите имя второго игрока 👇", reply_markup=create_cancel_keyboard())
     await state.set_state(MakePrediction.write_second_player)
 
 
-@router.message(MakePrediction.write_second_player)
-async def take_second_player(message: Message, state: FSMContext) -> None:
+async def save_second_player(message: Message, state: FSMContext, player: str) -> None:
     data = await state.get_data()
-    data["second_player"] = message.text
+    data["second_player"] = player
     await state.set_data(data)
     await message.answer("Введите рейтинг первого игрока 👇", reply_markup=create_skip_rating_writing())
     await state.set_state(MakePrediction.write_first_rating)
 
 
+@router.message(MakePrediction.write_first_player)
+async def take_first_player(message: Message, state: FSMContext) -> None:
+    player = await find_player(message, state, "first")
+    if player is not None:
+        await save_first_player(message, state, player)
+
+
+@router.message(MakePrediction.write_second_player)
+async def take_second_player(message: Message, state: FSMContext) -> None:
+    player = await find_player(message, state, "second")
+    if player is not None:
+        await save_second_player(message, state, player)
+
+
+@router.callback_query(F.data.startswith("player-choice"), StateFilter(MakePrediction.write_first_player,
+                                                                      MakePrediction.write_second_player))
+async def take_player_choice(call: CallbackQuery, state: FSMContext) -> None:
+    try:
+        await call.message.edit_reply_markup(reply_markup=None)
+    except TelegramBadRequest as exc:
+        logger.debug(exc)
+    data = await state.get_data()
+    _, step, choice = call.data.split(":")
+    player = data["typed_player"] if choice == "typed" else data["suggestions"][int(choice)]
+    state_name = await state.get_state()
+    if state_name == "MakePrediction:write_first_player" and step == "first":
+        await save_first_player(call.message, state, player)
+    elif state_name == "MakePrediction:write_second_player" and step == "second":
+        await save_second_player(call.message, state, player)
+
+
 @router.message(MakePrediction.write_first_rating)
 async def take_first_rating(message: Message, state: FSMContext) -> None:
     if message.text:
@@ -67,15 +118,28 @@ async def take_court_type(call: CallbackQuery, state: FSMContext) -> None:
     except TelegramBadRequest as exc:
         logger.debug(exc)
     data = await state.get_data()
-    result = await asyncio.to_thread(make_prediction, name1=data["first_player"],
-                                            name2=data["second_player"],
-                                            r1=data.get("first_rating"),
-                                            r2=data.get("second_rating"),
-                                            court=call.data.split(":")[1]
-                                            )
+    result = await predict(name1=data["first_player"],
+                           name2=data["second_player"],
+                           r1=data.get("first_rating"),
+                           r2=data.get("second_rating"),
+                           court=call.data.split(":")[1]
+                           )
     await call.message.answer(text=result.get("prediction_label"))
 
 
+async def predict(**match) -> dict:
+    # Кеш общий для всех пользователей и живет в процессе бота, расчет выполняется в пуле задач
+    prediction_functions = await import_module("prediction_functions")
+    with span("prediction.cache_key"):
+        cache_key = await asyncio.to_thread(prediction_functions.prediction_cache_key, **match)
+    prediction = prediction_functions.prediction_cache.get(cache_key)
+    if prediction is None:
+        with span("prediction.job"):
+            prediction = await job_runner.run("prediction", prediction_functions.compute_prediction, **match)
+        prediction_functions.prediction_cache.put(cache_key, prediction)
+    return dict(prediction)
+
+
 @router.callback_query(StateFilter(MakePrediction.write_first_rating, MakePrediction.write_second_rating),
                        F.data == "skip-rating-writing")
 async def skip_rating(call: CallbackQuery, state: FSMContext) -> None:
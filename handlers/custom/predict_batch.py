@@ -0,0 +1,45 @@
+from aiogram import Router, F
+from aiogram.filters import Command, StateFilter
+from aiogram.types import Message, BufferedInputFile
+from aiogram.fsm.context import FSMContext
+
+from keyboards.inline.cancel_keyboard import create_cancel_keyboard
+from state_storage.states import PredictBatch
+from utils.download_file import downloaded_document
+from utils.startup import import_module
+from loader import job_runner
+
+
+router = Router(name="predict_batch")
+
+FIXTURES_COLUMNS = "Игрок 1, Игрок 2, R1, R2, Корт"
+
+
+@router.message(Command("predict_batch"))
+async def predict_batch_handler(message: Message, state: FSMContext) -> None:
+    await state.clear()
+    await message.answer(f"Пришлите документ в формате \".xlsx\" с колонками {FIXTURES_COLUMNS}",
+                         reply_markup=create_cancel_keyboard())
+    await state.set_state(PredictBatch.take_file)
+
+
+@router.message(StateFilter(PredictBatch.take_file), F.document)
+async def take_fixtures_file(message: Message, state: FSMContext) -> None:
+    if message.document.file_name.endswith(".xlsx"):
+        async with downloaded_document(message, in_memory=True) as source:
+            if source is None:
+                return
+            try:
+                prediction_functions = await import_module("prediction_functions")
+                results = await job_runner.run("predict_batch", prediction_functions.make_predictions_xlsx_bytes,
+                                               fixtures_xlsx=source)
+            except (ValueError, KeyError) as error:
+                # Состояние не сбрасываем: можно сразу прислать исправленный файл или отменить
+                await message.answer(f"Не удалось прочитать матчи: {error}\n"
+                                     f"В файле должны быть колонки {FIXTURES_COLUMNS}, пришлите исправленный файл",
+                                     reply_markup=create_cancel_keyboard())
+                return
+        await message.answer_document(BufferedInputFile(results, filename="predictions.xlsx"))
+        await state.clear()
+    else:
+        await message.answer("Этот файл имеет недопустимый формат, пришлите файл в формате \".xlsx\"")
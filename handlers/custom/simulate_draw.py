@@ -0,0 +1,42 @@
+from aiogram import Router, F
+from aiogram.filters import Command, StateFilter
+from aiogram.types import Message, BufferedInputFile
+from aiogram.fsm.context import FSMContext
+
+from keyboards.inline.cancel_keyboard import create_cancel_keyboard
+from state_storage.states import SimulateDraw
+from utils.download_file import downloaded_document
+from utils.startup import import_module
+from loader import job_runner
+
+
+router = Router(name="simulate_draw")
+
+
+@router.message(Command("simulate_draw"))
+async def simulate_draw_handler(message: Message, state: FSMContext) -> None:
+    await state.clear()
+    await message.answer("Пришлите сетку турнира в формате \".xlsx\" с колонками Игрок 1, Игрок 2, R1, R2, Корт: "
+                         "пары первого круга по порядку сетки, пустое имя или Bye - свободное место",
+                         reply_markup=create_cancel_keyboard())
+    await state.set_state(SimulateDraw.take_file)
+
+
+@router.message(StateFilter(SimulateDraw.take_file), F.document)
+async def take_draw_file(message: Message, state: FSMContext) -> None:
+    if message.document.file_name.endswith(".xlsx"):
+        async with downloaded_document(message, in_memory=True) as source:
+            if source is None:
+                return
+            try:
+                draw_simulator = await import_module("draw_simulator")
+                results, summary = await job_runner.run("simulate_draw", draw_simulator.simulate_draw_xlsx_bytes,
+                                                        draw_xlsx=source)
+            except ValueError as error:
+                await message.answer(f"Не удалось разыграть сетку: {error}")
+                return
+        await message.answer_document(BufferedInputFile(results, filename="draw_simulation.xlsx"),
+                                      caption=f"Вероятность победы в турнире:\n{summary}")
+        await state.clear()
+    else:
+        await message.answer("Этот файл имеет недопустимый формат, пришлите файл в формате \".xlsx\"")
@@ -1,35 +1,60 @@
-import os
-import asyncio
-
 from aiogram import Router, F
 from aiogram.filters import Command, StateFilter
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
+from aiogram.exceptions import TelegramBadRequest
 
+from loader import logger, job_runner
 from keyboards.inline.cancel_keyboard import create_cancel_keyboard
 from state_storage.states import UploadStat
-from utils.download_file import download_file
-from loader import logger
-from stat_upload import add_batch_matches_and_update_stats
+from utils.download_file import downloaded_document
+from utils.startup import import_module
 
 
 router = Router(name="upload_stat")
 
+MATCHES_COLUMNS = "Игрок 1, Игрок 2, Дата, Круг, Корт, R1, R2, Сеты"
+
 
 @router.message(Command("upload_stat"))
 async def upload_stat_handler(message: Message, state: FSMContext) -> None:
     await state.clear()
-    await message.answer("Пришлите документ в формате \".xlsx\"", reply_markup=create_cancel_keyboard())
+    await message.answer(f"Пришлите документ в формате \".xlsx\" с колонками {MATCHES_COLUMNS}",
+                         reply_markup=create_cancel_keyboard())
     await state.set_state(UploadStat.take_file)
 
 
 @router.message(StateFilter(UploadStat.take_file), F.document)
 async def take_file(message: Message, state: FSMContext) -> None:
     if message.document.file_name.endswith(".xlsx"):
-        save_path = await download_file(message)
-        updated_stats = await asyncio.to_thread(add_batch_matches_and_update_stats, new_matches_xlsx=save_path)
-        os.remove(save_path)
-        logger.debug("The file was successfuly deleted")
+        async with downloaded_document(message, in_memory=True) as source:
+            if source is None:
+                return
+            status_message = await message.answer(f"Файл поставлен в очередь на обработку "
+                                                  f"(загрузок в очереди: {job_runner.upload_queue_depth})")
+
+            async def show_progress(text: str) -> None:
+                try:
+                    await status_message.edit_text(text)
+                except TelegramBadRequest as exc:
+                    logger.debug(exc)
+
+            try:
+                stat_upload = await import_module("stat_upload")
+                added_rows = await job_runner.submit_upload(stat_upload.add_batch_matches_and_update_stats,
+                                                            new_matches_xlsx=source, on_progress=show_progress)
+            except (ValueError, KeyError) as error:
+                # Состояние не сбрасываем: можно сразу прислать исправленный файл или отменить
+                await message.answer(f"Не удалось прочитать матчи: {error}\n"
+                                     f"В файле должны быть колонки {MATCHES_COLUMNS}, пришлите исправленный файл",
+                                     reply_markup=create_cancel_keyboard())
+                return
+            except Exception:
+                logger.exception("Failed to upload the statistics file")
+                await show_progress("Не удалось загрузить статистику, попробуйте позже")
+                await state.clear()
+                return
+        await show_progress(f"Готово! Добавлено {added_rows} записей статистики.")
         await state.clear()
     else:
         await message.answer("Этот файл имеет недопустимый формат, пришлите файл в формате \".xlsx\"")
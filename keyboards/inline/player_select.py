@@ -0,0 +1,11 @@
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+def create_player_select_keyboard(step: str, suggestions: list) -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton(text=name, callback_data=f"player-choice:{step}:{number}")]
+        for number, name in enumerate(suggestions)
+    ]
+    keyboard.append([InlineKeyboardButton(text="Оставить как ввели ✍️", callback_data=f"player-choice:{step}:typed")])
+
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
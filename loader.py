@@ -2,11 +2,16 @@ import os
 
 import loguru
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from utils.get_logger import get_logger
+from utils.job_runner import JobRunner
+from utils.startup import warm_worker
+from state_storage.bounded_storage import BoundedStorage
 
 
 bot = Bot(token=os.getenv("BOT_TOKEN"))
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(storage=BoundedStorage(maxsize=int(os.getenv("FSM_MAX_SESSIONS", 10000)),
+                                       ttl=float(os.getenv("FSM_SESSION_TTL", 24 * 60 * 60)),
+                                       db_path=os.getenv("FSM_STORAGE_PATH")))
 logger = get_logger(loguru.logger)
+job_runner = JobRunner(max_workers=int(os.getenv("JOB_WORKERS", 2)), logger=logger, worker_warmup=warm_worker)
@@ -1,22 +1,147 @@
+import time
+
+# Отсчет времени запуска для отчета о запуске - до импорта остальных модулей
+STARTED_AT = time.perf_counter()
+
+import argparse
 import asyncio
+import os
+import signal
 
 from aiogram.types import BotCommandScopeDefault
+from aiohttp import web
 
-from loader import bot, dp, logger
+from loader import bot, dp, logger, job_runner
 from handlers.custom.make_prediction import router as make_prediction
 from handlers.custom.cancel_handler import router as cancel_router
 from handlers.custom.upload_stat import router as upload_stat_router
+from handlers.custom.predict_batch import router as predict_batch_router
+from handlers.custom.simulate_draw import router as simulate_draw_router
+from middlewares.timing_middleware import TelegramTimingMiddleware, TimingMiddleware
 from set_commands import set_commands
+from utils.download_file import close_session
+from utils.metrics import cache_metrics
+from utils.metrics_server import start_metrics_server
+from utils.startup import StartupReport, import_module
+from utils.webhook_server import create_webhook_app
+
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+# Сколько обновлений обрабатывается одновременно и сколько секунд ждать их при остановке
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", 64))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 30))
+# Метрики Prometheus отдаются на локальном порту (0 - не запускать сервер метрик)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+# Обработчики дольше этого числа секунд попадают в журнал с разбивкой по этапам
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", 2))
+
+startup_report = StartupReport(STARTED_AT)
+_background_tasks = set()
+
+
+def setup_routers() -> None:
+    routers = (make_prediction, cancel_router, upload_stat_router, predict_batch_router, simulate_draw_router)
+    for router in routers:
+        TimingMiddleware.setup(router, logger=logger, slow_threshold=SLOW_REQUEST_SECONDS)
+    dp.include_routers(*routers)
+
+
+def health_info() -> dict:
+    return {"jobs": job_runner.stats(), "fsm": dp.storage.stats(), "caches": cache_metrics.stats(),
+            "startup": startup_report.as_dict()}
+
+
+async def prewarm() -> None:
+    """
+    Импортирует тяжелые модули, загружает индекс статистики и запускает процессы пула
+
+    Модель загружает каждый процесс пула при запуске (все предсказания выполняются
+    в пуле), процессу бота нужен только индекс статистики для ключей кеша и поиска
+    игроков. Выполняется в фоне, когда бот уже принимает обновления; обработчики,
+    которым все это нужно раньше, дождутся тех же импортов и загрузок.
+    """
+    try:
+        await import_module("prediction_functions")
+        stats_index = await import_module("stats_index")
+        await import_module("stat_upload")
+        startup_report.mark("heavy_imports")
+        await asyncio.to_thread(stats_index.load_stats_index)
+        startup_report.mark("stats_index")
+        await job_runner.prewarm()
+        startup_report.mark("workers")
+    except Exception as exc:
+        logger.exception(f"Prewarm failed: {exc!r}")
+    logger.info(f"Startup report: {startup_report.summary()}")
+
+
+async def on_startup() -> None:
+    startup_report.mark("dispatcher_started")
+    task = asyncio.create_task(prewarm())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def run_webhook() -> None:
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL is required in webhook mode")
+
+    app = create_webhook_app(dp, bot, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                             max_concurrency=WEBHOOK_MAX_CONCURRENCY, drain_timeout=WEBHOOK_DRAIN_TIMEOUT,
+                             health_info=health_info)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+    await bot.set_webhook(f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET,
+                          max_connections=WEBHOOK_MAX_CONCURRENCY)
+    logger.debug(f"Webhook server listens on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    try:
+        await stop_event.wait()
+    finally:
+        # Сервер перестает принимать запросы и дожидается начатых обработчиков
+        logger.debug("Webhook server is stopping")
+        await runner.cleanup()
 
 
-async def main() -> None:
+async def main(webhook: bool = False) -> None:
+    startup_report.mark("imports")
     bot_info = await bot.get_me()
     await bot.delete_my_commands(scope=BotCommandScopeDefault())
     await set_commands()
+    startup_report.mark("bot_ready")
     logger.debug(f"Bot {bot_info.username} starts working")
-    dp.include_routers(make_prediction, cancel_router, upload_stat_router)
-    await dp.start_polling(bot)
+    bot.session.middleware(TelegramTimingMiddleware())
+    setup_routers()
+    dp.startup.register(on_startup)
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    job_runner.start()
+    try:
+        if webhook:
+            await run_webhook()
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await job_runner.shutdown()
+        # Дописывает в базу изменения состояний FSM (в режиме webhook диспетчер сам хранилище не закрывает)
+        await dp.storage.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await close_session()
 
 
 if __name__ == "__main__":
-    asyncio.run(main=main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--webhook", action="store_true", help="принимать обновления через webhook вместо polling")
+    args = parser.parse_args()
+    asyncio.run(main=main(webhook=args.webhook))
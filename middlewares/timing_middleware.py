@@ -0,0 +1,69 @@
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot, Router
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject
+
+from utils.metrics import handler_duration, record_span, track_request_spans
+
+
+class TimingMiddleware(BaseMiddleware):
+    """
+    Замеряет длительность обработчиков роутера и пишет в журнал медленные запросы
+
+    Для медленного запроса (дольше slow_threshold секунд) в журнал попадает
+    разбивка по этапам, замеренным внутри обработчика (в том числе в пуле задач).
+    """
+
+    def __init__(self, router_name: str, logger, slow_threshold: float) -> None:
+        self.router_name = router_name
+        self.logger = logger
+        self.slow_threshold = slow_threshold
+
+    @classmethod
+    def setup(cls, router: Router, logger, slow_threshold: float) -> None:
+        middleware = cls(router.name, logger, slow_threshold)
+        router.message.middleware(middleware)
+        router.callback_query.middleware(middleware)
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: dict[str, Any]) -> Any:
+        handler_name = data["handler"].callback.__name__
+        status = "ok"
+        started = time.perf_counter()
+        with track_request_spans() as spans:
+            try:
+                return await handler(event, data)
+            except Exception:
+                status = "error"
+                raise
+            finally:
+                duration = time.perf_counter() - started
+                handler_duration.observe(duration, router=self.router_name, handler=handler_name, status=status)
+                if duration >= self.slow_threshold:
+                    self._log_slow_request(handler_name, duration, spans)
+
+    def _log_slow_request(self, handler_name: str, duration: float, spans: list) -> None:
+        stages = defaultdict(float)
+        for stage, seconds in spans:
+            stages[stage] += seconds
+        breakdown = ", ".join(f"{stage} {seconds:.3f}s"
+                              for stage, seconds in sorted(stages.items(), key=lambda item: -item[1]))
+        self.logger.warning(f"Slow request {self.router_name}.{handler_name} took {duration:.3f}s"
+                            f"{': ' + breakdown if breakdown else ''}")
+
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    """
+    Замеряет запросы к Bot API как этапы telegram.<метод>
+    """
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            record_span(f"telegram.{type(method).__name__}", time.perf_counter() - started)
@@ -0,0 +1,103 @@
+import os
+import pickle
+import threading
+from dataclasses import dataclass
+from typing import Any
+
+
+# Движки предсказаний: деревья, скомпилированные в массивы NumPy, или сама библиотека XGBoost
+ENGINES = ('numpy', 'xgboost')
+
+
+@dataclass(frozen=True)
+class LoadedModel:
+    model: Any  # XGBClassifier или CompiledTrees - у обоих есть predict_proba
+    feature_cols: list
+    signature: tuple
+
+
+class ModelHolder:
+    """
+    Держит в памяти модель и информацию о признаках и подменяет их при изменении файлов
+
+    Загруженная модель неизменяема: запросы, получившие ее до перезагрузки,
+    дорабатывают со старой версией, новые получают уже обновленную.
+    engine определяет, чем считаются предсказания (см. ENGINES).
+    """
+
+    def __init__(self, model_path, feature_info_path, engine='numpy'):
+        if engine not in ENGINES:
+            raise ValueError(f"Неизвестный движок предсказаний: {engine}")
+        self.model_path = model_path
+        self.feature_info_path = feature_info_path
+        self.engine = engine
+        self._loaded = None
+        self._reload_lock = threading.Lock()
+
+    def _signature(self):
+        # Проверяем наличие файлов
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"Файл модели не найден: {self.model_path}")
+
+        if not os.path.exists(self.feature_info_path):
+            raise FileNotFoundError(f"Файл с информацией о признаках не найден: {self.feature_info_path}")
+
+        model_stat = os.stat(self.model_path)
+        feature_info_stat = os.stat(self.feature_info_path)
+        return (model_stat.st_mtime_ns, model_stat.st_size,
+                feature_info_stat.st_mtime_ns, feature_info_stat.st_size)
+
+    def _load(self, signature):
+        # Загружаем информацию о признаках
+        with open(self.feature_info_path, 'rb') as f:
+            feature_info = pickle.load(f)
+
+        # Загружаем модель; xgboost импортируется только для движка xgboost
+        if self.engine == 'numpy':
+            from tree_model import compile_model
+
+            model = compile_model(self.model_path)
+        else:
+            import xgboost as xgb
+
+            model = xgb.XGBClassifier()
+            model.load_model(self.model_path)
+
+        return LoadedModel(model=model, feature_cols=feature_info['feature_cols'], signature=signature)
+
+    def get(self):
+        """
+        Возвращает актуальную модель, при необходимости перечитывая файлы
+        """
+        signature = self._signature()
+        loaded = self._loaded
+        if loaded is not None and loaded.signature == signature:
+            return loaded
+
+        # Пока другой поток перечитывает файлы, отдаем ранее загруженную модель
+        if loaded is not None and not self._reload_lock.acquire(blocking=False):
+            return loaded
+        if loaded is None:
+            self._reload_lock.acquire()
+
+        try:
+            if self._loaded is None or self._loaded.signature != signature:
+                self._loaded = self._load(signature)
+            return self._loaded
+        finally:
+            self._reload_lock.release()
+
+
+_holders = {}
+_holders_lock = threading.Lock()
+
+
+def get_model_holder(model_path='best_xgb_model.json', feature_info_path='feature_info.pkl', engine='numpy'):
+    """
+    Возвращает общий для процесса держатель модели для указанной пары файлов и движка
+    """
+    key = (model_path, feature_info_path, engine)
+    with _holders_lock:
+        if key not in _holders:
+            _holders[key] = ModelHolder(model_path, feature_info_path, engine)
+        return _holders[key]
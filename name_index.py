@@ -0,0 +1,81 @@
+import math
+import threading
+from collections import defaultdict
+
+
+def normalize_name(name):
+    """
+    Приводит имя к виду для сравнения: нижний регистр, одинарные пробелы, "ё" -> "е"
+    """
+    return ' '.join(str(name).lower().replace('ё', 'е').split())
+
+
+def _trigrams(normalized_name):
+    padded = f"  {normalized_name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """
+    Триграммный индекс имен игроков для поиска по неточному вводу
+
+    Имена только добавляются, поэтому после загрузки статистики индекс
+    дополняется новыми игроками без перестроения.
+    """
+
+    def __init__(self):
+        self._names = {}
+        self._trigram_sets = {}
+        self._postings = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, names):
+        with self._lock:
+            for name in names:
+                normalized = normalize_name(name)
+                if not normalized or normalized in self._names:
+                    continue
+                trigrams = _trigrams(normalized)
+                self._names[normalized] = name
+                self._trigram_sets[normalized] = trigrams
+                for trigram in trigrams:
+                    self._postings[trigram].add(normalized)
+
+    def resolve(self, query):
+        """
+        Возвращает имя игрока, совпадающее с запросом с точностью до регистра и пробелов
+        """
+        return self._names.get(normalize_name(query))
+
+    def suggest(self, query, limit=5, min_score=0.3):
+        """
+        Возвращает до limit наиболее похожих имен (по доле общих триграмм)
+        """
+        normalized = normalize_name(query)
+        if not normalized:
+            return []
+
+        query_trigrams = _trigrams(normalized)
+        # Похожее имя делит с запросом не меньше required триграмм, значит встречается
+        # хотя бы в одном из (len - required + 1) самых редких списков - остальные не просматриваем
+        required = max(1, math.ceil(min_score * len(query_trigrams)))
+        with self._lock:
+            postings = sorted((self._postings.get(trigram, ()) for trigram in query_trigrams), key=len)
+            candidates = set().union(*postings[:len(postings) - required + 1])
+
+            scored = []
+            for candidate in candidates:
+                candidate_trigrams = self._trigram_sets[candidate]
+                common = len(query_trigrams & candidate_trigrams)
+                score = common / (len(query_trigrams) + len(candidate_trigrams) - common)
+                if score >= min_score:
+                    scored.append((-score, candidate))
+
+            scored.sort()
+            return [self._names[candidate] for _, candidate in scored[:limit]]
+
+
+player_names = NameIndex()
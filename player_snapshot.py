@@ -0,0 +1,183 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+RECENT_MATCHES = 5
+RECENT_DAYS = 30
+
+
+@dataclass
+class PlayerSnapshot:
+    """
+    Сжатое состояние игроков, достаточное, чтобы продолжить счетчики без истории
+
+    latest - последняя строка статистики каждого игрока (индекс - имя игрока),
+    courts - последняя строка на каждом корте (player, court, court_wins, court_losses, result),
+    recent - результаты последних матчей (player, date, result) в порядке матчей: не меньше
+    5 последних и все матчи за 30 дней до последнего матча игрока
+    """
+    latest: pd.DataFrame
+    courts: pd.DataFrame
+    recent: pd.DataFrame
+
+    @property
+    def players(self):
+        return self.latest.index
+
+    def select(self, players):
+        """
+        Возвращает снимок только для указанных игроков
+        """
+        players = pd.Index(players)
+        return PlayerSnapshot(
+            latest=self.latest[self.latest.index.isin(players)],
+            courts=self.courts[self.courts['player'].isin(players)],
+            recent=self.recent[self.recent['player'].isin(players)]
+        )
+
+
+def empty_snapshot(columns):
+    latest = pd.DataFrame(columns=columns).set_index('player', drop=False)
+    latest.index.name = None
+    return PlayerSnapshot(
+        latest=latest,
+        courts=pd.DataFrame(columns=['player', 'court', 'court_wins', 'court_losses', 'result']),
+        recent=pd.DataFrame({'player': pd.Series(dtype=object), 'date': pd.Series(dtype='datetime64[ns]'),
+                             'result': pd.Series(dtype=int)})
+    )
+
+
+def concat_snapshots(snapshots):
+    """
+    Объединяет снимки разных игроков в один
+    """
+    def concat(parts, **kwargs):
+        non_empty = [part for part in parts if not part.empty]
+        return pd.concat(non_empty, **kwargs) if non_empty else parts[0]
+
+    return PlayerSnapshot(
+        latest=concat([snapshot.latest for snapshot in snapshots]),
+        courts=concat([snapshot.courts for snapshot in snapshots], ignore_index=True),
+        recent=concat([snapshot.recent for snapshot in snapshots], ignore_index=True)
+    )
+
+
+def build_snapshot(df_stats):
+    """
+    Строит снимок по строкам статистики
+
+    Параметры:
+    df_stats (pd.DataFrame): Строки статистики в порядке записи в базу
+
+    Возвращает:
+    PlayerSnapshot: Снимок всех игроков из df_stats
+    """
+    return advance_snapshot(empty_snapshot(list(df_stats.columns)), df_stats)
+
+
+def advance_snapshot(snapshot, new_stats):
+    """
+    Продолжает снимок новыми строками статистики
+
+    Строки new_stats должны идти после всех строк, по которым построен снимок
+    (не раньше по дате); снимок остальных игроков не меняется.
+
+    Возвращает:
+    PlayerSnapshot: Снимок игроков из snapshot и new_stats
+    """
+    if new_stats.empty:
+        return snapshot
+
+    # Стабильная сортировка сохраняет порядок записей внутри одного дня
+    new_stats = new_stats.sort_values('date', kind='stable')
+
+    latest = new_stats.groupby('player', sort=False).tail(1).set_index('player', drop=False)
+    latest.index.name = None
+    latest = pd.concat([part for part in [snapshot.latest[~snapshot.latest.index.isin(latest.index)], latest]
+                        if not part.empty])
+
+    # Строки без корта не продолжают ни одну серию по корту, поэтому не сохраняются
+    court_rows = new_stats[new_stats['court'].notna()]
+    court_rows = court_rows.groupby(['player', 'court'], sort=False).tail(1)
+    court_rows = court_rows[['player', 'court', 'court_wins', 'court_losses', 'result']]
+    court_keys = pd.MultiIndex.from_frame(court_rows[['player', 'court']])
+    kept_courts = ~pd.MultiIndex.from_frame(snapshot.courts[['player', 'court']]).isin(court_keys)
+    courts = pd.concat([part for part in [snapshot.courts[kept_courts], court_rows] if not part.empty],
+                       ignore_index=True)
+
+    recent = pd.concat([part for part in [snapshot.recent, new_stats[['player', 'date', 'result']]]
+                        if not part.empty], ignore_index=True)
+
+    return PlayerSnapshot(latest=latest, courts=courts, recent=trim_recent(recent))
+
+
+def trim_recent(recent):
+    """
+    Оставляет из результатов (player, date, result) в порядке матчей только нужные для
+    продолжения окон: 5 последних матчей и все матчи за 30 дней до последнего матча игрока
+    """
+    by_player = recent.groupby('player', sort=False)
+    in_window = recent['date'] >= by_player['date'].transform('max') - pd.Timedelta(days=RECENT_DAYS)
+    is_last = by_player.cumcount(ascending=False) < RECENT_MATCHES
+    return recent[in_window | is_last].reset_index(drop=True)
+
+
+def window_stats(snapshot):
+    """
+    Считает для каждого игрока показатели окон по последним результатам снимка
+
+    Возвращает:
+    pd.DataFrame: Индекс - имя игрока; колонки last_5_count и last_5_oldest_result (сколько
+    из 5 последних матчей известно и результат самого старого из них), matches_last_30d и
+    wins_last_30d (матчи и победы за 30 дней до последнего матча игрока)
+    """
+    recent = snapshot.recent
+    by_player = recent.groupby('player', sort=False)
+
+    last_5 = by_player.tail(RECENT_MATCHES).groupby('player', sort=False)['result']
+
+    # Окно 30 дней отсчитывается от даты последнего матча игрока
+    latest_date = by_player['date'].transform('max')
+    in_window = recent[recent['date'] >= latest_date - pd.Timedelta(days=RECENT_DAYS)]
+    window = in_window.groupby('player', sort=False)['result']
+
+    return pd.DataFrame({
+        'last_5_count': last_5.size(),
+        'last_5_oldest_result': last_5.first(),
+        'matches_last_30d': window.size(),
+        'wins_last_30d': window.sum()
+    })
+
+
+def window_counts(sequence):
+    """
+    Считает для каждой строки последовательности матчи и победы игрока за 30 дней
+    до даты строки, включая ее саму (строки игрока идут в порядке дат)
+
+    Вместо перебора предыдущих матчей начало окна ищется двоичным поиском:
+    строки сортируются по игроку, даты заменяются номерами среди всех дат,
+    и пара (игрок, дата) кодируется одним числом, возрастающим по строкам.
+
+    Возвращает:
+    tuple: (матчи окна, победы окна) - pd.Series с индексом sequence
+    """
+    codes = pd.factorize(sequence['player'])[0]
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    dates = sequence['date'].to_numpy()[order]
+    results = sequence['result'].to_numpy(dtype=np.int64)[order]
+
+    unique_dates, date_ranks = np.unique(dates, return_inverse=True)
+    keys = codes * len(unique_dates) + date_ranks.ravel()
+    start_ranks = np.searchsorted(unique_dates, dates - np.timedelta64(RECENT_DAYS, 'D'), side='left')
+    starts = np.searchsorted(keys, codes * len(unique_dates) + start_ranks, side='left')
+
+    positions = np.arange(len(order))
+    cumulative = np.concatenate([[0], np.cumsum(results)])
+    matches = np.empty(len(order), dtype=np.int64)
+    wins = np.empty(len(order), dtype=np.int64)
+    matches[order] = positions - starts + 1
+    wins[order] = cumulative[positions + 1] - cumulative[starts]
+    return pd.Series(matches, index=sequence.index), pd.Series(wins, index=sequence.index)
@@ -1,11 +1,32 @@
+import io
+import os
+
 import pandas as pd
 import numpy as np
-import xgboost as xgb
-import os
-import pickle
+
+from feature_matrix import assemble_match_features
+from model_holder import get_model_holder
+from stats_index import get_feature_matrix, get_index_entry, get_stats_version
+from stat_upload import strip_seed
+from utils.lru_cache import LRUCache
+from utils.metrics import cache_metrics, span
+
+
+# Чем считаются предсказания: "xgboost" - сама библиотека XGBoost, "numpy" - деревья модели,
+# скомпилированные в массивы NumPy (tree_model.py, без импорта xgboost). XGBoost не медленнее
+# деревьев на одной строке и в 2-5 раз быстрее на пакетах от сотни строк
+# (benchmarks/bench_hot_paths.py, замеры engine_*), поэтому он используется по умолчанию
+PREDICTION_ENGINE = os.getenv("PREDICTION_ENGINE", "xgboost")
+
+# Кеш готовых предсказаний; ключ включает версию статистики, поэтому после загрузки записи устаревают
+prediction_cache = LRUCache(maxsize=int(os.getenv("PREDICTION_CACHE_SIZE", 1024)),
+                            ttl=int(os.getenv("PREDICTION_CACHE_TTL", 3600)))
+
+
+
 def get_player_stats(player_name, court_type=None):
     """
-    Получает актуальную статистику игрока из файла player_stats.csv,
+    Получает актуальную статистику игрока из индекса статистики,
     учитывая результат последнего матча.
 
     Параметры:
@@ -20,91 +41,10 @@ def get_player_stats(player_name, court_type=None):
     dict
         Словарь с актуальной статистикой игрока
     """
-    import pandas as pd
-
-    try:
-        # Загружаем файл статистики игроков
-        df_stats = pd.read_csv('player_stats.csv')
-
-        # Преобразуем даты в формат datetime
-        df_stats['date'] = pd.to_datetime(df_stats['date'])
-
-        # Фильтруем строки для указанного игрока
-        player_stats = df_stats[df_stats['player'] == player_name]
-
-        # Если игрок существует в статистике
-        if not player_stats.empty:
-            # Сортируем по дате и получаем самую свежую строку
-            latest_stats = player_stats.sort_values('date').iloc[-1].to_dict()
-            latest_result = latest_stats['result']
-
-            # Обновляем cumulative_wins/losses с учетом последнего результата
-            latest_stats['cumulative_wins'] += latest_result
-            latest_stats['cumulative_losses'] += (1 - latest_result)
-
-            # Обновляем streak
-            if latest_result == 1:  # Победа
-                latest_stats['streak'] = 1 if latest_stats['streak'] < 0 else latest_stats['streak'] + 1
-            else:  # Поражение
-                latest_stats['streak'] = -1 if latest_stats['streak'] > 0 else latest_stats['streak'] - 1
-
-            # Обновляем court_wins/losses для данного корта
-            latest_court = latest_stats['court']
-            if court_type is None or court_type == latest_court:
-                latest_stats['court_wins'] += latest_result
-                latest_stats['court_losses'] += (1 - latest_result)
-
-            # Обновляем wins_last_5 (добавляем новый результат, возможно удаляем старый)
-            last_5_matches = player_stats.sort_values('date').tail(5)
-            if len(last_5_matches) == 5:
-                # Если уже было 5 матчей, вычитаем самый старый результат
-                oldest_result = last_5_matches.iloc[0]['result']
-                latest_stats['wins_last_5'] = latest_stats['wins_last_5'] - oldest_result + latest_result
-            else:
-                # Если было меньше 5 матчей, просто добавляем новый результат
-                latest_stats['wins_last_5'] += latest_result
-
-            # Обновляем wins_last_30d и matches_last_30d
-            latest_date = latest_stats['date']
-            thirty_days_ago = pd.to_datetime(latest_date) - pd.Timedelta(days=30)
-            matches_30d = player_stats[(player_stats['date'] >= thirty_days_ago) &
-                                       (player_stats['date'] <= latest_date)]
-
-            # Удаляем результаты, которые стали старше 30 дней, и добавляем новый
-            latest_stats['matches_last_30d'] = len(matches_30d)
-            latest_stats['wins_last_30d'] = matches_30d['result'].sum()
-
-            # Пересчитываем производные показатели
-            latest_stats['win_rt'] = (latest_stats['cumulative_wins'] / latest_stats['cumulative_losses']
-                                      if latest_stats['cumulative_losses'] > 0 else
-                                      (1 if latest_stats['cumulative_wins'] > 0 else 0))
-
-            latest_stats['court_win_rt'] = (latest_stats['court_wins'] / latest_stats['court_losses']
-                                            if latest_stats['court_losses'] > 0 else
-                                            (1 if latest_stats['court_wins'] > 0 else 0))
-
-            latest_stats['win_rt_last_30'] = (latest_stats['wins_last_30d'] / latest_stats['matches_last_30d']
-                                              if latest_stats['matches_last_30d'] > 0 else 0)
-
-            return latest_stats
-        else:
-            # Если игрок новый, возвращаем значения по умолчанию
-            return {
-                'player': player_name,
-                'cumulative_wins': 0,
-                'cumulative_losses': 0,
-                'streak': 0,
-                'court_wins': 0,
-                'court_losses': 0,
-                'wins_last_5': 0,
-                'wins_last_30d': 0,
-                'matches_last_30d': 0,
-                'win_rt': 0,
-                'court_win_rt': 0,
-                'win_rt_last_30': 0
-            }
-    except FileNotFoundError:
-        # Если файл player_stats.csv не существует, возвращаем значения по умолчанию
+    entry = get_index_entry(player_name)
+
+    # Если игрок новый или файла статистики нет, возвращаем значения по умолчанию
+    if entry is None:
         return {
             'player': player_name,
             'cumulative_wins': 0,
@@ -120,6 +60,53 @@ def get_player_stats(player_name, court_type=None):
             'win_rt_last_30': 0
         }
 
+    # Берем самую свежую строку из индекса
+    latest_stats = entry['latest'].copy()
+    latest_result = latest_stats['result']
+
+    # Обновляем cumulative_wins/losses с учетом последнего результата
+    latest_stats['cumulative_wins'] += latest_result
+    latest_stats['cumulative_losses'] += (1 - latest_result)
+
+    # Обновляем streak
+    if latest_result == 1:  # Победа
+        latest_stats['streak'] = 1 if latest_stats['streak'] < 0 else latest_stats['streak'] + 1
+    else:  # Поражение
+        latest_stats['streak'] = -1 if latest_stats['streak'] > 0 else latest_stats['streak'] - 1
+
+    # Обновляем court_wins/losses для данного корта
+    latest_court = latest_stats['court']
+    if court_type is None or court_type == latest_court:
+        latest_stats['court_wins'] += latest_result
+        latest_stats['court_losses'] += (1 - latest_result)
+
+    # Обновляем wins_last_5 (добавляем новый результат, возможно удаляем старый)
+    if entry['last_5_count'] == 5:
+        # Если уже было 5 матчей, вычитаем самый старый результат
+        oldest_result = entry['last_5_oldest_result']
+        latest_stats['wins_last_5'] = latest_stats['wins_last_5'] - oldest_result + latest_result
+    else:
+        # Если было меньше 5 матчей, просто добавляем новый результат
+        latest_stats['wins_last_5'] += latest_result
+
+    # Обновляем wins_last_30d и matches_last_30d (окно уже посчитано в индексе)
+    latest_stats['matches_last_30d'] = entry['matches_last_30d']
+    latest_stats['wins_last_30d'] = entry['wins_last_30d']
+
+    # Пересчитываем производные показатели
+    latest_stats['win_rt'] = (latest_stats['cumulative_wins'] / latest_stats['cumulative_losses']
+                              if latest_stats['cumulative_losses'] > 0 else
+                              (1 if latest_stats['cumulative_wins'] > 0 else 0))
+
+    latest_stats['court_win_rt'] = (latest_stats['court_wins'] / latest_stats['court_losses']
+                                    if latest_stats['court_losses'] > 0 else
+                                    (1 if latest_stats['court_wins'] > 0 else 0))
+
+    latest_stats['win_rt_last_30'] = (latest_stats['wins_last_30d'] / latest_stats['matches_last_30d']
+                                      if latest_stats['matches_last_30d'] > 0 else 0)
+
+    return latest_stats
+
 def predict_using_match_data(match_data, model_path='best_xgb_model.json', feature_info_path='feature_info.pkl'):
     """
     Делает предсказание для одного матча
@@ -132,37 +119,36 @@ def predict_using_match_data(match_data, model_path='best_xgb_model.json', featu
     Возвращает:
     dict: Результаты предсказания, включая вероятность победы и прогноз
     """
-    # Проверяем наличие файлов
-    if not os.path.exists(model_path):
-        raise FileNotFoundError(f"Файл модели не найден: {model_path}")
-
-    if not os.path.exists(feature_info_path):
-        raise FileNotFoundError(f"Файл с информацией о признаках не найден: {feature_info_path}")
-
-    # Загружаем информацию о признаках
-    with open(feature_info_path, 'rb') as f:
-        feature_info = pickle.load(f)
-
-    feature_cols = feature_info['feature_cols']
-
-    # Загружаем модель
-    model = xgb.XGBClassifier()
-    model.load_model(model_path)
+    # Берем загруженную один раз модель (перечитывается только при изменении файлов)
+    with span("prediction.model_load"):
+        loaded = get_model_holder(model_path, feature_info_path, PREDICTION_ENGINE).get()
+    model = loaded.model
+    feature_cols = loaded.feature_cols
 
     # Проверяем наличие всех необходимых признаков
     missing_features = [col for col in feature_cols if col not in match_data]
     if missing_features:
         raise ValueError(f"В данных отсутствуют следующие признаки: {missing_features}")
 
-    # Создаем DataFrame из данных матча
-    match_df = pd.DataFrame([match_data])
+    with span("prediction.features"):
+        # Создаем DataFrame из данных матча
+        match_df = pd.DataFrame([match_data])
 
-    # Выбираем только нужные признаки
-    match_features = match_df[feature_cols]
+        # Выбираем только нужные признаки
+        match_features = match_df[feature_cols]
 
     # Делаем предсказание
-    win_probability = model.predict_proba(match_features)[0, 1]
-    prediction = model.predict(match_features)[0]
+    with span("prediction.model_predict"):
+        win_probability = model.predict_proba(match_features)[0, 1]
+
+    return format_prediction(win_probability)
+
+def format_prediction(win_probability):
+    """
+    Формирует результат предсказания по вероятности победы первого игрока
+    """
+    # Метка класса определяется тем же порогом 0.5, что и в model.predict
+    prediction = int(win_probability > 0.5)
 
     result = {
         'win_probability': win_probability,
@@ -172,7 +158,10 @@ def predict_using_match_data(match_data, model_path='best_xgb_model.json', featu
 
     return result
 
-def make_prediction(name1, name2, r1=None, r2=None, court=None):
+def build_match_data(name1, name2, r1=None, r2=None, court=None):
+    """
+    Собирает признаки матча для модели по именам игроков, рейтингам и корту
+    """
     r1_was_missing = 0
     r2_was_missing = 0
 
@@ -230,5 +219,142 @@ def make_prediction(name1, name2, r1=None, r2=None, court=None):
         'win_rt_last_30_diff': result1['win_rt_last_30'] - result2['win_rt_last_30']
     }
 
-    prediction = predict_using_match_data(match_data)
-    return prediction
+    return match_data
+
+def prediction_cache_key(name1, name2, r1=None, r2=None, court=None):
+    return (name1, name2, r1, r2, court, get_stats_version())
+
+def match_features(pairs, feature_cols):
+    """
+    Собирает матрицу признаков матчей (по строке на матч, в порядке feature_cols)
+    из материализованных показателей игроков - те же значения, что build_match_data
+    """
+    return assemble_match_features(get_feature_matrix(), pairs, feature_cols)
+
+def compute_prediction(name1, name2, r1=None, r2=None, court=None):
+    """
+    Делает предсказание без обращения к кешу (выполняется в том числе в процессах пула задач)
+    """
+    with span("prediction.model_load"):
+        loaded = get_model_holder(engine=PREDICTION_ENGINE).get()
+    with span("prediction.features"):
+        features = match_features([(name1, name2, r1, r2, court)], loaded.feature_cols)
+    with span("prediction.model_predict"):
+        win_probability = loaded.model.predict_proba(features)[0, 1]
+    return format_prediction(win_probability)
+
+def make_prediction(name1, name2, r1=None, r2=None, court=None):
+    cache_key = prediction_cache_key(name1, name2, r1, r2, court)
+    prediction = prediction_cache.get(cache_key)
+    if prediction is not None:
+        return dict(prediction)
+
+    prediction = compute_prediction(name1, name2, r1, r2, court)
+    prediction_cache.put(cache_key, prediction)
+    return dict(prediction)
+
+def get_prediction_cache_stats():
+    """
+    Возвращает счетчики кеша предсказаний (попадания, промахи, вытеснения)
+    """
+    return prediction_cache.stats()
+
+# Счетчики кеша попадают в /metrics и /health процесса, как только модуль импортирован
+cache_metrics.register("prediction", get_prediction_cache_stats)
+
+def make_predictions_batch(pairs, model_path='best_xgb_model.json', feature_info_path='feature_info.pkl'):
+    """
+    Делает предсказания для списка матчей одним вызовом модели
+
+    Параметры:
+    pairs (iterable): Кортежи (name1, name2, r1, r2, court), как аргументы make_prediction
+    model_path (str): Путь к сохраненной модели
+    feature_info_path (str): Путь к информации о признаках
+
+    Возвращает:
+    list: Результаты предсказаний в порядке матчей
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return []
+
+    loaded = get_model_holder(model_path, feature_info_path, PREDICTION_ENGINE).get()
+
+    # Все матчи собираются в одну матрицу признаков
+    win_probabilities = loaded.model.predict_proba(match_features(pairs, loaded.feature_cols))[:, 1]
+
+    return [format_prediction(win_probability) for win_probability in win_probabilities]
+
+def make_predictions_from_xlsx(fixtures_xlsx, results_xlsx):
+    """
+    Делает предсказания для всех матчей из файла и сохраняет результаты в новый файл
+
+    Файл матчей имеет те же колонки, что и файл статистики:
+    Игрок 1, Игрок 2, R1, R2, Корт
+
+    Возвращает:
+    pd.DataFrame: Таблица матчей с вероятностью и прогнозом
+    """
+    fixtures = pd.read_excel(fixtures_xlsx, usecols=['Игрок 1', 'Игрок 2', 'R1', 'R2', 'Корт'])
+    fixtures['Игрок 1'] = strip_seed(fixtures['Игрок 1'])
+    fixtures['Игрок 2'] = strip_seed(fixtures['Игрок 2'])
+
+    # Пустые рейтинги считаются отсутствующими, как при пропуске ввода в диалоге
+    ratings = fixtures[['R1', 'R2']].astype(object).where(fixtures[['R1', 'R2']].notna(), None)
+    pairs = zip(fixtures['Игрок 1'], fixtures['Игрок 2'], ratings['R1'], ratings['R2'], fixtures['Корт'])
+
+    results = make_predictions_batch(list(pairs))
+
+    fixtures['Вероятность победы игрока 1'] = [result['win_probability'] for result in results]
+    fixtures['Прогноз'] = [result['prediction_label'] for result in results]
+    fixtures.to_excel(results_xlsx, index=False)
+
+    return fixtures
+
+def make_predictions_xlsx_bytes(fixtures_xlsx):
+    """
+    Делает предсказания для файла матчей и возвращает содержимое файла результатов
+
+    Используется пулом задач: из процесса возвращаются только байты файла.
+    """
+    results_xlsx = io.BytesIO()
+    make_predictions_from_xlsx(fixtures_xlsx, results_xlsx)
+    return results_xlsx.getvalue()
+
+def check_feature_consistency(pairs=None, feature_info_path='feature_info.pkl', seed=0):
+    """
+    Сверяет признаки из матрицы показателей игроков с признаками build_match_data
+
+    Параметры:
+    pairs (list, optional): Кортежи (name1, name2, r1, r2, court); по умолчанию - случайные
+        пары игроков из статистики и неизвестных игроков на всех кортах, с рейтингами и без
+    feature_info_path (str): Путь к информации о признаках
+
+    Возвращает:
+    dict: Число матчей и несовпавших значений; при несовпадении выбрасывает AssertionError
+    """
+    import pickle
+
+    with open(feature_info_path, 'rb') as f:
+        feature_cols = pickle.load(f)['feature_cols']
+
+    if pairs is None:
+        rng = np.random.default_rng(seed)
+        players = list(get_feature_matrix().player_ids)[:1000] + ['Неизвестный игрок']
+        courts = [None, 'hard', 'i.hard', 'clay', 'capret', 'grass']
+        ratings = [None, 0, 150, 329, 512.5]
+        pairs = [(players[rng.integers(len(players))], players[rng.integers(len(players))],
+                  ratings[rng.integers(len(ratings))], ratings[rng.integers(len(ratings))],
+                  courts[rng.integers(len(courts))]) for _ in range(2000)]
+
+    expected = pd.DataFrame([build_match_data(*pair) for pair in pairs])[feature_cols].to_numpy(dtype=np.float64)
+    actual = match_features(pairs, feature_cols)
+    mismatches = ~((expected == actual) | (np.isnan(expected) & np.isnan(actual)))
+
+    result = {'pairs': len(pairs), 'mismatched_values': int(mismatches.sum())}
+    if result['mismatched_values']:
+        rows, columns = np.nonzero(mismatches)
+        result['first_mismatch'] = {'pair': pairs[rows[0]], 'feature': feature_cols[columns[0]],
+                                    'expected': expected[rows[0], columns[0]], 'actual': actual[rows[0], columns[0]]}
+        raise AssertionError(f"Признаки из матрицы расходятся с build_match_data: {result}")
+    return result
@@ -6,6 +6,8 @@ from loader import bot
 async def set_commands():
     commands = [
         BotCommand(command="make_prediction", description="Получить предсказание"),
+        BotCommand(command="predict_batch", description="Получить предсказания для списка матчей"),
+        BotCommand(command="simulate_draw", description="Разыграть турнирную сетку"),
         BotCommand(command="upload_stat", description="Обновить статистику игроков")
     ]
 
@@ -1,352 +1,617 @@
+from dataclasses import dataclass
+
+import openpyxl
 import pandas as pd
 import numpy as np
-import os
 
+from player_snapshot import (RECENT_DAYS, RECENT_MATCHES, advance_snapshot, build_snapshot, concat_snapshots,
+                             trim_recent, window_counts)
+from stats_index import sync_stats_index
+from stats_store import (STATS_COLUMNS, append_stats, find_ingested_matches, get_max_match_id, load_players_stats,
+                         load_snapshot, match_hashes, open_transaction, record_ingested_matches,
+                         record_update, replace_players_stats, save_snapshot)
+from utils.metrics import span, timed_iter
 
 
-def add_batch_matches_and_update_stats(new_matches_xlsx):
-    df = pd.read_excel(new_matches_xlsx)
-    columns_to_keep = ['Игрок 1', 'Игрок 2', 'Дата', 'Круг', 'Корт', 'R1', 'R2', 'Сеты']
-    df = df[columns_to_keep]
-    df['Игрок 1'] = df['Игрок 1'].str.replace(r'^\([^)]*\)\s*', '', regex=True)
-    df['Игрок 2'] = df['Игрок 2'].str.replace(r'^\([^)]*\)\s*', '', regex=True)
-    df.columns = ['player1', 'player2', 'date', 'stage', 'court', 'r1', 'r2', 'sets']
-    new_matches = df
+MATCH_COLUMNS = ['Игрок 1', 'Игрок 2', 'Дата', 'Круг', 'Корт', 'R1', 'R2', 'Сеты']
+CHUNK_SIZE = 5000
+
+
+@dataclass
+class RunningState:
+    """
+    Состояние игроков после последнего обработанного матча загрузки
+
+    players - накопительные показатели, серия и показатели по текущему корту (индекс - имя игрока),
+    recent - результаты игроков (player, date, result) в порядке дат: 5 последних матчей
+    и все матчи за 30 дней до последнего матча игрока
+    """
+    players: pd.DataFrame
+    recent: pd.DataFrame
+
+
+def add_batch_matches_and_update_stats(new_matches_xlsx, chunk_size=CHUNK_SIZE, progress=print):
+    """
+    Загружает матчи из файла и дописывает в базу статистику игроков
+
+    Файл читается потоково частями по chunk_size строк. Если матчи в файле идут
+    по возрастанию даты, каждая часть сразу обрабатывается и записывается, а
+    состояние игроков переносится в следующую часть - результат тот же, что при
+    обработке всего файла. Иначе файл собирается целиком (только нужные колонки)
+    и сортируется по дате, как раньше. Все части записываются одной транзакцией.
+
+    Уже загруженные матчи (повторная загрузка файла или пересекающейся выгрузки)
+    пропускаются по хешу содержимого. Если матчи игрока оказались раньше уже
+    записанных, его строки пересчитываются начиная с первого нового матча.
 
-    # Проверка необходимых колонок
-    required_columns = ['player1', 'player2', 'date', 'r1', 'r2', 'sets', 'court', 'stage']
+    Сообщения о ходе обработки передаются в progress (по умолчанию печатаются);
+    бот передает сюда функцию, которая обновляет статусное сообщение в чате.
 
-    matches = new_matches.copy()
-    matches['date'] = pd.to_datetime(matches['date'])
+    Возвращает:
+    int: Количество добавленных записей статистики
+    """
+    with open_transaction() as conn:
+        conn.execute("SAVEPOINT streamed_chunks")
+        try:
+            added_rows, players = _ingest_chunks(timed_iter(iter_match_chunks(new_matches_xlsx, chunk_size),
+                                                            "upload.read"), conn, progress)
+        except _UnsortedMatches:
+            # Файл не упорядочен по дате: откатываем записанные части и обрабатываем файл целиком,
+            # не отпуская блокировку записи
+            conn.execute("ROLLBACK TO streamed_chunks")
+            progress("Матчи в файле не упорядочены по дате, файл обрабатывается целиком...")
+            with span("upload.read"):
+                matches = pd.concat(iter_match_chunks(new_matches_xlsx, chunk_size), ignore_index=True)
 
-    # Сортируем по дате - это критически важно для правильного обновления статистики
-    matches = matches.sort_values('date').reset_index(drop=True)
+            # Сортируем по дате - это критически важно для правильного обновления статистики
+            matches = matches.sort_values('date').reset_index(drop=True)
+            added_rows, players = _ingest_chunks([matches], conn, progress, ordered=False)
 
-    # Загружаем текущую статистику игроков, если она существует
-    if os.path.exists('player_stats.csv'):
-        player_stats_df = pd.read_csv('player_stats.csv')
-        player_stats_df['date'] = pd.to_datetime(player_stats_df['date'])
-    else:
-        player_stats_df = pd.DataFrame(columns=[
-            'player', 'court', 'stage', 'date', 'result', 'is_player1',
-            'match_id', 'cumulative_wins', 'cumulative_losses', 'streak',
-            'court_wins', 'court_losses', 'wins_last_5', 'wins_last_30d',
-            'matches_last_30d', 'win_rt', 'court_win_rt', 'win_rt_last_30'
-        ])
+        # Новая версия фиксируется вместе с данными: по ней все процессы обновляют
+        # индекс статистики и перестают использовать закешированные предсказания
+        if players:
+            record_update(conn, players)
 
-    # Словари для хранения актуальной статистики и последних 5 матчей для каждого игрока
-    player_stats_cache = {}
-    player_last_5_matches = {}
+    with span("upload.index_sync"):
+        sync_stats_index()
 
-    # Список для новых записей статистики
-    new_stats_rows = []
+    progress(f"Готово! Добавлено {added_rows} записей статистики.")
 
-    print(f"Обработка {len(matches)} новых матчей...")
+    return added_rows
 
+
+class _UnsortedMatches(Exception):
+    pass
+
+
+def iter_match_chunks(xlsx_path, chunk_size=CHUNK_SIZE):
+    """
+    Потоково читает из первого листа только нужные колонки и отдает матчи частями
+
+    Книга открывается в режиме read_only, поэтому в памяти одновременно
+    находится не больше chunk_size строк из восьми колонок. Пустые строки
+    (в таком режиме openpyxl отдает, например, оформленные строки в конце листа)
+    пропускаются, как и в pd.read_excel.
+    """
+    workbook = openpyxl.load_workbook(xlsx_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        missing_columns = [column for column in MATCH_COLUMNS if column not in header]
+        if missing_columns:
+            raise KeyError(f"В файле отсутствуют колонки: {missing_columns}")
+        positions = [header.index(column) for column in MATCH_COLUMNS]
+
+        chunk = []
+        for row in rows:
+            values = tuple(row[position] if position < len(row) else None for position in positions)
+            if all(value is None for value in values):
+                continue
+            chunk.append(values)
+            if len(chunk) == chunk_size:
+                yield prepare_matches(pd.DataFrame(chunk, columns=MATCH_COLUMNS))
+                chunk = []
+        if chunk:
+            yield prepare_matches(pd.DataFrame(chunk, columns=MATCH_COLUMNS))
+    finally:
+        workbook.close()
+
+
+def prepare_matches(df):
+    """
+    Приводит колонки файла матчей к внутренним именам и типам
+    """
+    df['Игрок 1'] = strip_seed(df['Игрок 1'])
+    df['Игрок 2'] = strip_seed(df['Игрок 2'])
+    df.columns = ['player1', 'player2', 'date', 'stage', 'court', 'r1', 'r2', 'sets']
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def _ingest_chunks(chunks, conn, progress, ordered=True):
     # Генерируем match_id, начиная со следующего после максимального в текущей статистике
-    max_match_id = player_stats_df['match_id'].max() if not player_stats_df.empty else -1
-    current_match_id = max_match_id + 1
+    next_match_id = get_max_match_id(conn=conn) + 1
+    running_state = None
+    updated_snapshot = None
+    stale_dates = []
+    last_date = None
+    added_rows = 0
+    processed_matches = 0
+    skipped_matches = 0
+    players = set()
+
+    for matches in chunks:
+        if ordered:
+            # Последовательная обработка частей возможна только при возрастании дат
+            if not matches['date'].is_monotonic_increasing or (last_date is not None
+                                                               and matches['date'].iloc[0] < last_date):
+                raise _UnsortedMatches()
+            last_date = matches['date'].iloc[-1]
+
+        processed_matches += len(matches)
+        matches, skipped = _skip_ingested_matches(matches, conn)
+        skipped_matches += skipped
+        if matches.empty:
+            progress(_progress_text(processed_matches, skipped_matches))
+            continue
+
+        # Состояние из базы загружаем только для игроков, которых еще не было в предыдущих частях
+        appearances = pd.concat([matches[['player1', 'date']].set_axis(['player', 'date'], axis=1),
+                                 matches[['player2', 'date']].set_axis(['player', 'date'], axis=1)])
+        first_dates = appearances.groupby('player')['date'].min()
+        if running_state is not None:
+            first_dates = first_dates[~first_dates.index.isin(running_state.players.index)]
+        with span("upload.load_state"):
+            snapshot = load_snapshot(first_dates.index, conn=conn)
+
+            # Игрокам, у которых в базе есть матчи не раньше загружаемых, снимок не подходит:
+            # для них, как раньше, берется история до первого матча загрузки
+            latest_dates = snapshot.latest['date']
+            stale = latest_dates.index[latest_dates >= first_dates.reindex(latest_dates.index)]
+            player_stats_df = load_players_stats(stale, conn=conn)
+        stale_dates.append(first_dates[stale])
+
+        with span("upload.compute_stats"):
+            new_stats, running_state = compute_batch_stats(matches, player_stats_df, next_match_id, running_state,
+                                                           snapshot=snapshot)
+        with span("upload.write"):
+            append_stats(new_stats, conn=conn)
+
+        with span("upload.snapshot"):
+            base_snapshot = snapshot if updated_snapshot is None else concat_snapshots([updated_snapshot, snapshot])
+            updated_snapshot = advance_snapshot(base_snapshot, new_stats[STATS_COLUMNS])
+
+        next_match_id += len(new_stats) // 2
+        added_rows += len(new_stats)
+        players.update(new_stats['player'])
+        progress(_progress_text(processed_matches, skipped_matches))
+
+    if updated_snapshot is not None:
+        stale_dates = pd.concat(stale_dates).groupby(level=0).min()
+        if not stale_dates.empty:
+            # Матчи вставлены в середину истории: строки таких игроков пересчитываем
+            # с первого нового матча, а снимок строим заново
+            with span("upload.recompute"):
+                recompute_players_stats(stale_dates, conn)
+            with span("upload.snapshot"):
+                rebuilt = build_snapshot(load_players_stats(stale_dates.index, conn=conn))
+                updated_snapshot = concat_snapshots([updated_snapshot.select(updated_snapshot.players.difference(rebuilt.players)),
+                                                     rebuilt])
+        with span("upload.write"):
+            save_snapshot(conn, updated_snapshot.select(players))
+
+    return added_rows, players
+
+
+def _progress_text(processed_matches, skipped_matches):
+    if skipped_matches:
+        return f"Обработано {processed_matches} матчей (пропущено уже загруженных: {skipped_matches})..."
+    return f"Обработано {processed_matches} матчей..."
+
+
+def _skip_ingested_matches(matches, conn):
+    """
+    Убирает из части матчи, которые уже есть в базе или встречались раньше в файле,
+    и запоминает хеши остальных
 
-    # Обрабатываем каждый матч
-    for idx, match in matches.iterrows():
-        if idx % 100 == 0 and idx > 0:
-            print(f"Обработано {idx} матчей...")
+    Матчи без корректного результата тоже убираются (их пропустил бы compute_batch_stats),
+    но в число пропущенных не входят.
 
-        # Анализируем результат матча
-        if pd.isnull(match['sets']) or match['sets'] == '':
-            continue  # Пропускаем матчи без результата
+    Возвращает:
+    tuple: (оставшиеся матчи, сколько уже загруженных матчей пропущено)
+    """
+    sets1, sets2 = parse_set_scores(matches['sets'])
+    player1_win = sets1 > sets2
+    valid = (sets1.notna() & sets2.notna() & matches['player1'].notna() & matches['player2'].notna()).to_numpy()
+    if not valid.any():
+        return matches[valid], 0
+
+    with span("upload.dedup"):
+        valid_matches = matches[valid]
+        player1_win = player1_win[valid].to_numpy()
+        winner_sets = np.where(player1_win, sets1[valid], sets2[valid]).astype(int)
+        loser_sets = np.where(player1_win, sets2[valid], sets1[valid]).astype(int)
+        scores = [f"{won}-{lost}" for won, lost in zip(winner_sets, loser_sets)]
+        match_key = (valid_matches['player1'], valid_matches['player2'], valid_matches['date'], player1_win,
+                     valid_matches['court'], valid_matches['stage'])
+        hashes = match_hashes(*match_key, scores)
+        # История, загруженная до появления хешей, хранит хеши без счета (счета в базе нет)
+        is_ingested = find_ingested_matches(conn, hashes) | find_ingested_matches(conn, match_hashes(*match_key))
+        is_new = ~pd.Series(hashes).duplicated().to_numpy() & ~is_ingested
+        record_ingested_matches(conn, hashes[is_new])
+
+    keep = valid.copy()
+    keep[valid] = is_new
+    return matches[keep].reset_index(drop=True), int((~is_new).sum())
+
+
+def recompute_players_stats(first_dates, conn):
+    """
+    Пересчитывает строки игроков, начиная с указанной для каждого даты
 
-        try:
-            sets_parts = match['sets'].split('-')
-            sets1 = int(sets_parts[0])
-            sets2 = int(sets_parts[1])
-            player1_win = 1 if sets1 > sets2 else 0
-        except:
-            continue  # Пропускаем некорректные записи сетов
-
-        match_date = match['date']
-        court_type = match['court']
-
-        # Обрабатываем статистику для player1
-        p1_stats = get_player_stats(
-            match['player1'],
-            player_stats_cache,
-            player_last_5_matches,
-            player_stats_df,
-            match_date,
-            court_type
-        )
-
-        # Создаем запись статистики для player1
-        p1_record = {
-            'player': match['player1'],
-            'court': court_type,
-            'stage': match['stage'],
-            'date': match_date,
-            'result': player1_win,
-            'is_player1': True,
-            'match_id': current_match_id,
-            'cumulative_wins': p1_stats['cumulative_wins'],
-            'cumulative_losses': p1_stats['cumulative_losses'],
-            'streak': p1_stats['streak'],
-            'court_wins': p1_stats['court_wins'],
-            'court_losses': p1_stats['court_losses'],
-            'wins_last_5': p1_stats['wins_last_5'],
-            'wins_last_30d': p1_stats['wins_last_30d'],
-            'matches_last_30d': p1_stats['matches_last_30d'],
-            'win_rt': p1_stats['win_rt'],
-            'court_win_rt': p1_stats['court_win_rt'],
-            'win_rt_last_30': p1_stats['win_rt_last_30']
-        }
-        new_stats_rows.append(p1_record)
-
-        # Обрабатываем статистику для player2
-        p2_stats = get_player_stats(
-            match['player2'],
-            player_stats_cache,
-            player_last_5_matches,
-            player_stats_df,
-            match_date,
-            court_type
-        )
-
-        # Создаем запись статистики для player2
-        p2_record = {
-            'player': match['player2'],
-            'court': court_type,
-            'stage': match['stage'],
-            'date': match_date,
-            'result': 1 - player1_win,
-            'is_player1': False,
-            'match_id': current_match_id,
-            'cumulative_wins': p2_stats['cumulative_wins'],
-            'cumulative_losses': p2_stats['cumulative_losses'],
-            'streak': p2_stats['streak'],
-            'court_wins': p2_stats['court_wins'],
-            'court_losses': p2_stats['court_losses'],
-            'wins_last_5': p2_stats['wins_last_5'],
-            'wins_last_30d': p2_stats['wins_last_30d'],
-            'matches_last_30d': p2_stats['matches_last_30d'],
-            'win_rt': p2_stats['win_rt'],
-            'court_win_rt': p2_stats['court_win_rt'],
-            'win_rt_last_30': p2_stats['win_rt_last_30']
-        }
-        new_stats_rows.append(p2_record)
-
-        # Обновляем кеш статистики обоих игроков
-        update_player_cache(
-            player_stats_cache,
-            player_last_5_matches,
-            match['player1'],
-            player1_win,
-            match_date,
-            court_type
-        )
-
-        update_player_cache(
-            player_stats_cache,
-            player_last_5_matches,
-            match['player2'],
-            1 - player1_win,
-            match_date,
-            court_type
-        )
-
-        current_match_id += 1
-
-    print("Объединение данных...")
-
-    # Объединяем существующую статистику с новыми данными
-    updated_stats = pd.concat([player_stats_df, pd.DataFrame(data=new_stats_rows)], ignore_index=True)
-
-    print("Сохранение обновленной статистики...")
-    updated_stats.to_csv('player_stats.csv', index=False)
-
-    print(f"Готово! Добавлено {len(new_stats_rows)} записей статистики.")
-
-    return updated_stats
-
-
-def get_player_stats(player_name, player_stats_cache, player_last_5_matches, player_stats_df, match_date, court_type):
+    Статистика строки зависит только от предыдущих матчей самого игрока, поэтому
+    достаточно заново пройти строки затронутых игроков от первой измененной даты.
+    Счетчики продолжаются из состояния после последней строки до этой даты по тем же
+    правилам, что и между частями одной загрузки, - результат совпадает с загрузкой
+    всех матчей заново. match_id и порядок строк сохраняются.
+
+    Параметры:
+    first_dates (pd.Series): Дата первого измененного матча (индекс - имя игрока)
+    conn (sqlite3.Connection): Соединение с открытой транзакцией записи
+    """
+    history = load_players_stats(first_dates.index, conn=conn)
+    is_changed = history['date'] >= history['player'].map(first_dates)
+    changed = history[is_changed]
+    long_stats = changed[['player', 'court', 'stage', 'date', 'result', 'is_player1', 'match_id']].reset_index(drop=True)
+    long_stats['result'] = long_stats['result'].astype(int)
+    long_stats['order'] = np.arange(len(long_stats))
+
+    new_stats, _ = _compute_player_rows(long_stats, history.iloc[:0], _running_state_after(history[~is_changed]))
+    replace_players_stats(conn, first_dates, new_stats)
+
+
+def _running_state_after(history):
     """
-    Получает актуальную статистику игрока на момент перед матчем
+    Восстанавливает по строкам статистики состояние игроков после их последней строки -
+    то же, что compute_batch_stats передал бы в следующую часть загрузки
+
+    Параметры:
+    history (pd.DataFrame): Строки игроков в порядке матчей
     """
-    # Проверяем кеш
-    if player_name in player_stats_cache:
-        return player_stats_cache[player_name]
-
-    # Фильтруем статистику игрока до текущей даты
-    player_stats = player_stats_df[(player_stats_df['player'] == player_name) &
-                                   (player_stats_df['date'] < match_date)]
-
-    # Инициализируем историю последних 5 матчей
-    if player_name not in player_last_5_matches:
-        player_last_5_matches[player_name] = []
-
-        # Если есть прошлая статистика, загружаем последние 5 матчей
-        if not player_stats.empty:
-            recent_matches = player_stats.sort_values('date').tail(5)
-            for _, match in recent_matches.iterrows():
-                player_last_5_matches[player_name].append({
-                    'date': match['date'],
-                    'result': match['result']
-                })
-
-    if not player_stats.empty:
-        # Берем последнюю доступную статистику перед матчем
-        latest_stats = player_stats.sort_values('date').iloc[-1].to_dict()
-
-        # Обновляем статистику за 30 дней
-        thirty_days_ago = match_date - pd.Timedelta(days=30)
-        matches_30d = player_stats[(player_stats['date'] >= thirty_days_ago) &
-                                   (player_stats['date'] < match_date)]
-
-        latest_stats['matches_last_30d'] = len(matches_30d)
-        latest_stats['wins_last_30d'] = matches_30d['result'].sum()
-
-        # Добавляем последний результат к накопительным показателям
-        last_result = latest_stats['result']
-        latest_stats['cumulative_wins'] += last_result
-        latest_stats['cumulative_losses'] += (1 - last_result)
-
-        # Обновляем streak
-        if last_result == 1:  # Победа
-            latest_stats['streak'] = 1 if latest_stats['streak'] < 0 else latest_stats['streak'] + 1
-        else:  # Поражение
-            latest_stats['streak'] = -1 if latest_stats['streak'] > 0 else latest_stats['streak'] - 1
-
-        # Обновляем статистику по корту
-        if court_type == latest_stats['court']:
-            latest_stats['court_wins'] += last_result
-            latest_stats['court_losses'] += (1 - last_result)
-        else:
-            # Ищем статистику для указанного корта
-            court_stats = player_stats[player_stats['court'] == court_type]
-            if not court_stats.empty:
-                latest_court = court_stats.sort_values('date').iloc[-1]
-                latest_stats['court_wins'] = latest_court['court_wins'] + latest_court['result']
-                latest_stats['court_losses'] = latest_court['court_losses'] + (1 - latest_court['result'])
-            else:
-                # Если для этого корта еще нет статистики
-                latest_stats['court_wins'] = 0
-                latest_stats['court_losses'] = 0
-
-        # Пересчитываем производные показатели
-        if latest_stats['cumulative_losses'] > 0:
-            latest_stats['win_rt'] = latest_stats['cumulative_wins'] / latest_stats['cumulative_losses']
-        else:
-            latest_stats['win_rt'] = 1.0 if latest_stats['cumulative_wins'] > 0 else 0.0
-
-        if latest_stats['court_losses'] > 0:
-            latest_stats['court_win_rt'] = latest_stats['court_wins'] / latest_stats['court_losses']
-        else:
-            latest_stats['court_win_rt'] = 1.0 if latest_stats['court_wins'] > 0 else 0.0
-
-        if latest_stats['matches_last_30d'] > 0:
-            latest_stats['win_rt_last_30'] = latest_stats['wins_last_30d'] / latest_stats['matches_last_30d']
-        else:
-            latest_stats['win_rt_last_30'] = 0.0
-
-        player_stats_cache[player_name] = latest_stats
-        return latest_stats
-    else:
-        # Для нового игрока создаем записи по умолчанию
-        default_stats = {
-            'player': player_name,
-            'court': court_type,
-            'stage': '',
-            'date': match_date,
-            'result': 0,  # Будет заполнено позже
-            'is_player1': True,  # Будет заполнено позже
-            'match_id': 0,  # Будет заполнено позже
-            'cumulative_wins': 0,
-            'cumulative_losses': 0,
-            'streak': 0,
-            'court_wins': 0,
-            'court_losses': 0,
-            'wins_last_5': 0,
-            'wins_last_30d': 0,
-            'matches_last_30d': 0,
-            'win_rt': 0.0,
-            'court_win_rt': 0.0,
-            'win_rt_last_30': 0.0
-        }
-        player_stats_cache[player_name] = default_stats
-        return default_stats
-
-
-def update_player_cache(player_stats_cache, player_last_5_matches, player_name, match_result, match_date, court_type):
+    by_player = history.groupby('player', sort=False)
+    last_rows = by_player.tail(1).index
+    last = history.loc[last_rows].set_index('player')
+    result = last['result']
+
+    # Счетчики корта после матча продолжают серию, только если корт совпадает
+    # с кортом предыдущего матча игрока (первый матч игрока начинает серию с нуля)
+    previous_court = by_player['court'].shift().loc[last_rows].to_numpy()
+    is_first = (by_player.cumcount() == 0).loc[last_rows].to_numpy()
+    same_court = is_first | (last['court'].to_numpy() == previous_court)
+
+    players = pd.DataFrame({
+        'cumulative_wins': last['cumulative_wins'] + result,
+        'cumulative_losses': last['cumulative_losses'] + (1 - result),
+        'streak': np.where(result == 1, np.where(last['streak'] < 0, 1, last['streak'] + 1),
+                           np.where(last['streak'] > 0, -1, last['streak'] - 1)),
+        'court': last['court'],
+        'court_wins': np.where(same_court, last['court_wins'], 0) + result,
+        'court_losses': np.where(same_court, last['court_losses'], 0) + (1 - result)
+    }, index=last.index)
+    recent = trim_recent(history[['player', 'date', 'result']].reset_index(drop=True))
+    recent['result'] = recent['result'].astype(int)
+    return RunningState(players=players, recent=recent)
+
+
+def strip_seed(players):
     """
-    Обновляет кешированную статистику игрока с учетом результата матча
+    Убирает из имен игроков префикс посева вида "(5) "
+    """
+    return players.str.replace(r'^\([^)]*\)\s*', '', regex=True)
+
+
+def parse_sets(sets):
+    """
+    Разбирает колонку счета по сетам ("2-1") для всех матчей сразу
+
+    Возвращает:
+    pd.Series: 1 - победа первого игрока, 0 - поражение, NaN - матч без корректного результата
+    """
+    sets1, sets2 = parse_set_scores(sets)
+    player1_win = (sets1 > sets2).astype(float)
+    return player1_win.where(sets1.notna() & sets2.notna())
+
+
+def parse_set_scores(sets):
+    """
+    Разбирает колонку счета по сетам ("2-1") на число сетов каждого игрока
+
+    Возвращает:
+    tuple: (сеты первого игрока, сеты второго игрока); NaN - некорректный счет
+    """
+    # Значения не-строки (пустые ячейки, даты, числа) считаются некорректными
+    sets = sets.where(sets.map(type) == str).astype('string')
+    sets_parts = sets.str.split('-')
+
+    def parse_part(part):
+        # Принимаем только то, что принял бы int(): целое число с пробелами по краям
+        part = part.astype('string')
+        part = part.where(part.str.fullmatch(r'\s*[+-]?\d+\s*').fillna(False))
+        return pd.to_numeric(part.str.strip(), errors='coerce')
+
+    return parse_part(sets_parts.str[0]), parse_part(sets_parts.str[1])
+
+
+def _ratio(numerator, denominator):
+    # Отношение по прежним правилам: при нулевом знаменателе 1.0, если числитель ненулевой, иначе 0.0
+    numerator = numerator.astype(float)
+    denominator = denominator.astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = numerator / denominator
+    return np.where(denominator > 0, ratio, np.where(numerator > 0, 1.0, 0.0))
+
+
+def _seed_stats(long_stats, player_stats_df, running_state=None, snapshot=None):
+    """
+    Статистика каждого игрока перед его первым матчем в загрузке: по состоянию
+    из предыдущих частей файла, по истории из базы (если она передана для игрока),
+    а для остальных игроков - по сохраненному снимку состояния
+
+    Возвращает:
+    tuple: (статистика по игрокам, последние матчи каждого игрока перед загрузкой:
+    не меньше 5 и все матчи окна 30 дней)
+    """
+    first = long_stats.groupby('player', sort=False).head(1)[['player', 'date', 'court']]
+    first = first.rename(columns={'date': 'first_date', 'court': 'first_court'})
+    seeds = first.set_index('player')
+
+    columns = ['cumulative_wins', 'cumulative_losses', 'streak', 'court_wins', 'court_losses',
+               'wins_last_5', 'wins_last_30d', 'matches_last_30d']
+    for column in columns:
+        seeds[column] = 0
+    seeds['state_court'] = seeds['first_court']
+
+    recent_parts = []
+    if running_state is not None:
+        carried = seeds.index[seeds.index.isin(running_state.players.index)]
+        first = first[~first['player'].isin(carried)]
+        recent_parts.append(_seed_from_running_state(seeds, running_state, carried))
+
+    # История до первого матча загрузки дает тот же снимок, что и сохраненный, но без более поздних матчей
+    history = player_stats_df.merge(first, on='player')
+    history_players = history['player'].unique()
+    history = history[history['date'] < history['first_date']].drop(columns=['first_date', 'first_court'])
+    snapshots = [build_snapshot(history)]
+    if snapshot is not None:
+        snapshot_players = first['player'][~first['player'].isin(history_players)]
+        snapshots.append(snapshot.select(snapshot_players))
+    snapshot = concat_snapshots(snapshots)
+    if snapshot.latest.empty:
+        return seeds, _concat_recent(recent_parts)
+    recent_parts.append(_seed_from_snapshot(seeds, snapshot, first))
+
+    return seeds, _concat_recent(recent_parts)
+
+
+def _seed_from_snapshot(seeds, snapshot, first):
+    recent = snapshot.recent[['player', 'date', 'result']]
+
+    # Последняя строка игрока с учетом ее собственного результата
+    last = snapshot.latest
+    last_result = last['result']
+    players = last.index
+
+    seeds.loc[players, 'state_court'] = last['court']
+    seeds.loc[players, 'cumulative_wins'] = last['cumulative_wins'] + last_result
+    seeds.loc[players, 'cumulative_losses'] = last['cumulative_losses'] + (1 - last_result)
+    seeds.loc[players, 'streak'] = np.where(
+        last_result == 1,
+        np.where(last['streak'] < 0, 1, last['streak'] + 1),
+        np.where(last['streak'] > 0, -1, last['streak'] - 1)
+    )
+    seeds.loc[players, 'wins_last_5'] = last['wins_last_5']
+
+    # Статистика по корту первого матча: последняя строка игрока на этом корте
+    court_last = snapshot.courts.merge(first, left_on=['player', 'court'], right_on=['player', 'first_court'])
+    court_last = court_last.set_index('player')
+    seeds.loc[court_last.index, 'court_wins'] = court_last['court_wins'] + court_last['result']
+    seeds.loc[court_last.index, 'court_losses'] = court_last['court_losses'] + (1 - court_last['result'])
+
+    # Матчи за 30 дней до первого матча (в снимке хранятся все матчи этого окна)
+    history = snapshot.recent.merge(first, on='player')
+    in_window = history[history['date'] >= history['first_date'] - pd.Timedelta(days=RECENT_DAYS)]
+    window = in_window.groupby('player', sort=False)['result']
+    seeds.loc[window.size().index, 'matches_last_30d'] = window.size()
+    seeds.loc[window.sum().index, 'wins_last_30d'] = window.sum()
+
+    return recent
+
+
+def _seed_from_running_state(seeds, running_state, carried):
+    # Продолжаем счетчики игроков, уже встречавшихся в предыдущих частях файла,
+    # так же, как если бы матчи шли в одной загрузке
+    state = running_state.players.loc[carried]
+    for column in ['cumulative_wins', 'cumulative_losses', 'streak', 'court_wins', 'court_losses']:
+        seeds.loc[carried, column] = state[column]
+    seeds.loc[carried, 'state_court'] = state['court']
+
+    recent = running_state.recent[running_state.recent['player'].isin(carried)]
+    by_player = recent.groupby('player', sort=False)
+    last_5 = by_player.tail(RECENT_MATCHES).groupby('player', sort=False)['result']
+    seeds.loc[last_5.size().index, 'wins_last_5'] = last_5.sum()
+
+    # Окно 30 дней отсчитывается от последнего из сохраненных матчей
+    in_window = recent[recent['date'] >= by_player['date'].transform('max') - pd.Timedelta(days=RECENT_DAYS)]
+    window = in_window.groupby('player', sort=False)['result']
+    seeds.loc[window.size().index, 'matches_last_30d'] = window.size()
+    seeds.loc[window.sum().index, 'wins_last_30d'] = window.sum()
+
+    return recent
+
+
+def _concat_recent(recent_parts):
+    recent_parts = [part for part in recent_parts if not part.empty]
+    if not recent_parts:
+        return pd.DataFrame({'player': pd.Series(dtype=object), 'date': pd.Series(dtype='datetime64[ns]'),
+                             'result': pd.Series(dtype=int)})
+    return pd.concat(recent_parts, ignore_index=True)
+
+
+def compute_batch_stats(matches, player_stats_df, first_match_id, running_state=None, snapshot=None):
+    """
+    Считает строки статистики для всех матчей загрузки сразу, без цикла по матчам
+
+    Каждая строка содержит статистику игрока на момент перед матчем - так же,
+    как при последовательной обработке: накопительные показатели, серия,
+    показатели по корту, последние 5 матчей и окно 30 дней.
+
+    Параметры:
+    matches (pd.DataFrame): Матчи, отсортированные по дате
+    player_stats_df (pd.DataFrame): История статистики игроков, для которых не подходит снимок
+    first_match_id (int): match_id первого нового матча
+    running_state (RunningState, optional): Состояние игроков после предыдущей части файла
+    snapshot (PlayerSnapshot, optional): Сохраненный снимок состояния остальных игроков
+
+    Возвращает:
+    tuple: (новые строки статистики в формате STATS_COLUMNS, состояние игроков после этих матчей)
+    """
+    # Анализируем результаты матчей; матчи без корректного результата или без имен игроков пропускаем
+    player1_win = parse_sets(matches['sets'])
+    valid = player1_win.notna() & matches['player1'].notna() & matches['player2'].notna()
+    matches = matches[valid].reset_index(drop=True)
+    player1_win = player1_win[valid].astype(int).reset_index(drop=True)
+
+    if matches.empty:
+        return pd.DataFrame(columns=STATS_COLUMNS), running_state
+
+    match_ids = first_match_id + np.arange(len(matches))
+    order = np.arange(len(matches)) * 2
+
+    # Две строки на матч: сначала player1, затем player2
+    long_stats = pd.concat([
+        pd.DataFrame({'player': matches['player1'], 'court': matches['court'], 'stage': matches['stage'],
+                      'date': matches['date'], 'result': player1_win, 'is_player1': True,
+                      'match_id': match_ids, 'order': order}),
+        pd.DataFrame({'player': matches['player2'], 'court': matches['court'], 'stage': matches['stage'],
+                      'date': matches['date'], 'result': 1 - player1_win, 'is_player1': False,
+                      'match_id': match_ids, 'order': order + 1})
+    ]).sort_values('order').reset_index(drop=True)
+
+    return _compute_player_rows(long_stats, player_stats_df, running_state, snapshot)
+
+
+def _compute_player_rows(long_stats, player_stats_df, running_state=None, snapshot=None):
+    """
+    Считает статистику строк игроков (по строке на игрока в матче) перед каждым матчем
+
+    Параметры:
+    long_stats (pd.DataFrame): Строки (player, court, stage, date, result, is_player1, match_id, order),
+    строки каждого игрока - в порядке матчей
+    player_stats_df, running_state, snapshot: Как в compute_batch_stats
+
+    Возвращает:
+    tuple: (строки статистики в формате STATS_COLUMNS, состояние игроков после этих матчей)
     """
-    if player_name not in player_stats_cache:
-        raise ValueError(f"Игрок {player_name} отсутствует в кеше")
-
-    stats = player_stats_cache[player_name].copy()
-
-    # Обновляем накопительные показатели
-    stats['cumulative_wins'] += match_result
-    stats['cumulative_losses'] += (1 - match_result)
-
-    # Обновляем streak
-    if match_result == 1:  # Победа
-        stats['streak'] = 1 if stats['streak'] < 0 else stats['streak'] + 1
-    else:  # Поражение
-        stats['streak'] = -1 if stats['streak'] > 0 else stats['streak'] - 1
-
-    # Обновляем статистику по корту
-    if court_type == stats['court']:
-        stats['court_wins'] += match_result
-        stats['court_losses'] += (1 - match_result)
-    else:
-        # Если сменился тип корта
-        stats['court'] = court_type
-        stats['court_wins'] = match_result
-        stats['court_losses'] = 1 - match_result
-
-    # Обновляем историю последних 5 матчей
-    if player_name not in player_last_5_matches:
-        player_last_5_matches[player_name] = []
-
-    player_last_5_matches[player_name].append({
-        'date': match_date,
-        'result': match_result
-    })
-
-    # Сортируем и оставляем только последние 5
-    player_last_5_matches[player_name] = sorted(
-        player_last_5_matches[player_name],
-        key=lambda x: x['date']
-    )[-5:]
-
-    # Обновляем wins_last_5
-    stats['wins_last_5'] = sum(match['result'] for match in player_last_5_matches[player_name])
-
-    # Обновляем статистику за 30 дней
-    thirty_days_ago = match_date - pd.Timedelta(days=30)
-
-    # Фильтруем матчи за последние 30 дней
-    recent_matches = [m for m in player_last_5_matches[player_name] if m['date'] >= thirty_days_ago]
-
-    # Обновляем статистику последних 30 дней
-    stats['matches_last_30d'] = len(recent_matches)
-    stats['wins_last_30d'] = sum(m['result'] for m in recent_matches)
+    seeds, history_tail = _seed_stats(long_stats, player_stats_df, running_state, snapshot)
+    seed = seeds.loc[long_stats['player']].reset_index(drop=True)
+
+    by_player = long_stats.groupby('player', sort=False)
+    result = long_stats['result']
+    match_number = by_player.cumcount()
+    is_first = match_number == 0
+
+    # Накопительные победы и поражения до матча
+    wins_before = by_player['result'].cumsum() - result
+    cumulative_wins = seed['cumulative_wins'] + wins_before
+    cumulative_losses = seed['cumulative_losses'] + (match_number - wins_before)
+
+    # Серия: длина текущей серии одинаковых результатов, в первой серии продолжаем серию из истории
+    run_id = (result != by_player['result'].shift()).groupby(long_stats['player']).cumsum()
+    run_length = long_stats.groupby([long_stats['player'], run_id]).cumcount() + 1
+    first_run = run_id == 1
+    streak_after = np.where(
+        result == 1,
+        run_length + np.where(first_run & (seed['streak'] >= 0), seed['streak'], 0),
+        -run_length + np.where(first_run & (seed['streak'] <= 0), seed['streak'], 0)
+    )
+    streak_after = pd.Series(streak_after)
+    streak = streak_after.groupby(long_stats['player']).shift().where(~is_first, seed['streak'])
+
+    # Показатели по корту: счетчики сбрасываются при смене корта между соседними матчами игрока
+    court = long_stats['court']
+    court_run_id = (court != by_player['court'].shift()).groupby(long_stats['player']).cumsum()
+    first_court_run = court_run_id == 1
+    continues_seed = first_court_run & (court == seed['state_court'])
+    court_group = [long_stats['player'], court_run_id]
+    court_wins_after = (result.groupby(court_group).cumsum()
+                        + np.where(continues_seed, seed['court_wins'], 0))
+    court_losses_after = ((1 - result).groupby(court_group).cumsum()
+                          + np.where(continues_seed, seed['court_losses'], 0))
+    court_wins = court_wins_after.groupby(long_stats['player']).shift().where(~is_first, seed['court_wins'])
+    court_losses = court_losses_after.groupby(long_stats['player']).shift().where(~is_first, seed['court_losses'])
+
+    # Последние 5 матчей и окно 30 дней считаются по последовательности
+    # "последние матчи из истории (5 и все за 30 дней) + матчи загрузки"
+    sequence_parts = [
+        pd.DataFrame({'player': history_tail['player'], 'date': history_tail['date'],
+                      'result': history_tail['result'].astype(int), 'position': -1}),
+        pd.DataFrame({'player': long_stats['player'], 'date': long_stats['date'],
+                      'result': result, 'position': long_stats.index})
+    ]
+    sequence = pd.concat([part for part in sequence_parts if not part.empty], ignore_index=True)
+    by_sequence_player = sequence.groupby('player', sort=False)
+
+    # Сумма результатов в скользящем окне из 5 матчей, включая текущий
+    cumulative_result = by_sequence_player['result'].cumsum()
+    wins_last_5_after = (cumulative_result
+                         - cumulative_result.groupby(sequence['player']).shift(RECENT_MATCHES).fillna(0))
+
+    # Матчи и победы за 30 дней до текущего матча, включая его
+    matches_30d_after, wins_30d_after = window_counts(sequence)
+
+    # Значение до матча - это состояние после предыдущего матча игрока
+    sequence['wins_last_5'] = wins_last_5_after.groupby(sequence['player']).shift()
+    sequence['matches_last_30d'] = matches_30d_after.groupby(sequence['player']).shift()
+    sequence['wins_last_30d'] = wins_30d_after.groupby(sequence['player']).shift()
+    batch_sequence = sequence[sequence['position'] >= 0].set_index('position').sort_index()
+
+    wins_last_5 = batch_sequence['wins_last_5'].where(~is_first, seed['wins_last_5'])
+    matches_last_30d = batch_sequence['matches_last_30d'].where(~is_first, seed['matches_last_30d'])
+    wins_last_30d = batch_sequence['wins_last_30d'].where(~is_first, seed['wins_last_30d'])
+
+    new_stats = long_stats[['player', 'court', 'stage', 'date', 'result', 'is_player1', 'match_id']].copy()
+    new_stats['cumulative_wins'] = cumulative_wins.astype(int)
+    new_stats['cumulative_losses'] = cumulative_losses.astype(int)
+    new_stats['streak'] = streak.astype(int)
+    new_stats['court_wins'] = court_wins.astype(int)
+    new_stats['court_losses'] = court_losses.astype(int)
+    new_stats['wins_last_5'] = wins_last_5.astype(int)
+    new_stats['wins_last_30d'] = wins_last_30d.astype(int)
+    new_stats['matches_last_30d'] = matches_last_30d.astype(int)
 
     # Пересчитываем производные показатели
-    if stats['cumulative_losses'] > 0:
-        stats['win_rt'] = stats['cumulative_wins'] / stats['cumulative_losses']
-    else:
-        stats['win_rt'] = 1.0 if stats['cumulative_wins'] > 0 else 0.0
-
-    if stats['court_losses'] > 0:
-        stats['court_win_rt'] = stats['court_wins'] / stats['court_losses']
-    else:
-        stats['court_win_rt'] = 1.0 if stats['court_wins'] > 0 else 0.0
-
-    if stats['matches_last_30d'] > 0:
-        stats['win_rt_last_30'] = stats['wins_last_30d'] / stats['matches_last_30d']
-    else:
-        stats['win_rt_last_30'] = 0.0
-
-    # Обновляем запись в кеше
-    player_stats_cache[player_name] = stats
\ No newline at end of file
+    new_stats['win_rt'] = _ratio(new_stats['cumulative_wins'], new_stats['cumulative_losses'])
+    new_stats['court_win_rt'] = _ratio(new_stats['court_wins'], new_stats['court_losses'])
+    new_stats['win_rt_last_30'] = _ratio(new_stats['wins_last_30d'], new_stats['matches_last_30d'])
+
+    # Состояние после последнего матча каждого игрока - для продолжения в следующей части
+    last_rows = by_player.tail(1).index
+    players_state = pd.DataFrame({
+        'player': long_stats['player'],
+        'cumulative_wins': cumulative_wins + result,
+        'cumulative_losses': cumulative_losses + (1 - result),
+        'streak': streak_after,
+        'court': court,
+        'court_wins': court_wins_after,
+        'court_losses': court_losses_after
+    }).loc[last_rows].set_index('player')
+    recent = trim_recent(sequence[['player', 'date', 'result']])
+
+    if running_state is not None:
+        # Игроки, не сыгравшие в этой части, сохраняют прежнее состояние
+        kept_players = ~running_state.players.index.isin(players_state.index)
+        kept_recent = ~running_state.recent['player'].isin(players_state.index)
+        players_state = pd.concat([running_state.players[kept_players], players_state])
+        recent = pd.concat([running_state.recent[kept_recent], recent], ignore_index=True)
+
+    return new_stats[STATS_COLUMNS], RunningState(players=players_state, recent=recent)
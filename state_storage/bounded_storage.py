@@ -0,0 +1,203 @@
+import asyncio
+import dataclasses
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Mapping
+
+from aiogram.exceptions import DataNotDictLikeError
+from loguru import logger
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm_records (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_records_expires_at ON fsm_records (expires_at);
+"""
+
+
+class _Record:
+    __slots__ = ('state', 'data', 'expires_at')
+
+    def __init__(self, state=None, data=None, expires_at=0.0):
+        self.state = state
+        self.data = data or {}
+        self.expires_at = expires_at
+
+
+class BoundedStorage(BaseStorage):
+    """
+    Хранилище состояний FSM с ограничением числа диалогов и сроком жизни
+
+    Диалог живет ttl секунд с последнего обращения (чтения или изменения); при
+    превышении maxsize вытесняется диалог, к которому дольше всего не обращались.
+    Пустые записи (без состояния и данных) не хранятся. Если задан db_path, изменения
+    записей дублируются в SQLite и восстанавливаются после перезапуска бота: запись
+    в базу выполняется в потоке, не блокируя цикл событий, и изменения, накопившиеся
+    за время предыдущей записи, пишутся одной транзакцией. Чтения в базу не пишутся,
+    поэтому после перезапуска срок жизни отсчитывается от последнего изменения.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 24 * 60 * 60, db_path: str | None = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._records: OrderedDict[StorageKey, _Record] = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+        # Несохраненные изменения: ключ в базе -> строка записи или None для удаления
+        self._pending: dict[str, tuple | None] = {}
+        self._flush_task: asyncio.Task | None = None
+        self._conn = None
+        if db_path is not None:
+            # Соединением пользуется одна задача записи за раз, но из разных потоков
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._restore()
+
+    def _restore(self) -> None:
+        with self._conn:
+            self._conn.execute("DELETE FROM fsm_records WHERE expires_at <= ?", (time.time(),))
+            self._conn.execute("DELETE FROM fsm_records WHERE key NOT IN "
+                               "(SELECT key FROM fsm_records ORDER BY expires_at DESC LIMIT ?)", (self.maxsize,))
+        rows = self._conn.execute("SELECT key, state, data, expires_at FROM fsm_records "
+                                  "ORDER BY expires_at DESC LIMIT ?", (self.maxsize,)).fetchall()
+        # Самые давние диалоги - в начале, как после обычной работы хранилища
+        for key, state, data, expires_at in reversed(rows):
+            self._records[StorageKey(*json.loads(key))] = _Record(state, json.loads(data), expires_at)
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self.flush()
+            self._conn.close()
+            self._conn = None
+
+    async def flush(self) -> None:
+        """
+        Дожидается записи в базу всех сделанных изменений
+        """
+        if self._pending:
+            self._start_flush()
+        while self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+
+    def _get(self, key: StorageKey) -> _Record | None:
+        record = self._records.get(key)
+        if record is None:
+            return None
+        if record.expires_at <= time.time():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        # Чтение тоже продлевает диалог: порядок записей остается порядком сроков жизни
+        record.expires_at = time.time() + self.ttl
+        self._records.move_to_end(key)
+        return record
+
+    def _touch(self, key: StorageKey, record: _Record) -> None:
+        record.expires_at = time.time() + self.ttl
+        self._records[key] = record
+        self._records.move_to_end(key)
+        self._purge()
+
+    def _purge(self) -> None:
+        # Записи упорядочены по последнему обращению, поэтому истекшие и вытесняемые - в начале
+        now = time.time()
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record.expires_at <= now:
+                self.expirations += 1
+            elif len(self._records) > self.maxsize:
+                self.evictions += 1
+            else:
+                break
+            self._remove(key)
+
+    def _remove(self, key: StorageKey) -> None:
+        self._records.pop(key, None)
+        if self._conn is not None:
+            self._schedule_write(self._dump_key(key), None)
+
+    def _save(self, key: StorageKey, record: _Record) -> None:
+        if record.state is None and not record.data:
+            self._remove(key)
+            return
+
+        self._touch(key, record)
+        if self._conn is not None:
+            self._schedule_write(self._dump_key(key), (record.state, json.dumps(record.data, ensure_ascii=False),
+                                                       record.expires_at))
+
+    def _schedule_write(self, key: str, row: tuple | None) -> None:
+        # Для ключа важно только последнее изменение, поэтому очередь - словарь
+        self._pending[key] = row
+        self._start_flush()
+
+    def _start_flush(self) -> None:
+        # Одна задача записи за раз: изменения попадают в базу в том же порядке, что и в память
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_pending())
+
+    async def _flush_pending(self) -> None:
+        while self._pending:
+            pending, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(self._write, pending)
+            except sqlite3.Error as exc:
+                # Несохраненные изменения запишутся со следующими, если ключ с тех пор не менялся
+                for key, row in pending.items():
+                    self._pending.setdefault(key, row)
+                logger.exception(f"FSM storage write failed: {exc!r}")
+                return
+
+    def _write(self, pending: dict[str, tuple | None]) -> None:
+        with self._conn:
+            self._conn.executemany("DELETE FROM fsm_records WHERE key = ?",
+                                   [(key,) for key, row in pending.items() if row is None])
+            self._conn.executemany("INSERT OR REPLACE INTO fsm_records (key, state, data, expires_at) "
+                                   "VALUES (?, ?, ?, ?)",
+                                   [(key, *row) for key, row in pending.items() if row is not None])
+
+    @staticmethod
+    def _dump_key(key: StorageKey) -> str:
+        return json.dumps(dataclasses.astuple(key))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._get(key) or _Record()
+        record.state = state.state if isinstance(state, State) else state
+        self._save(key, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        record = self._get(key)
+        return record.state if record is not None else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            msg = f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            raise DataNotDictLikeError(msg)
+        record = self._get(key) or _Record()
+        record.data = data.copy()
+        self._save(key, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        record = self._get(key)
+        return record.data.copy() if record is not None else {}
+
+    def stats(self) -> dict[str, int]:
+        """
+        Возвращает число живых диалогов и счетчики вытеснений и истечений
+        """
+        return {
+            'sessions': len(self._records),
+            'maxsize': self.maxsize,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
@@ -11,3 +11,11 @@ class MakePrediction(StatesGroup):
 
 class UploadStat(StatesGroup):
     take_file = State()
+
+
+class PredictBatch(StatesGroup):
+    take_file = State()
+
+
+class SimulateDraw(StatesGroup):
+    take_file = State()
@@ -0,0 +1,153 @@
+import threading
+
+from feature_matrix import build_feature_matrix, empty_feature_matrix
+from name_index import player_names
+from player_snapshot import window_stats
+from stats_store import get_updated_players, load_snapshot
+from stats_store import get_stats_version as get_stored_stats_version
+
+
+# Индекс: имя игрока -> последняя строка статистики и данные окон (последние 5 матчей, 30 дней)
+_stats_index = None
+# Показатели игроков для признаков матча (FeatureMatrix), строятся вместе с индексом
+_feature_matrix = None
+_build_lock = threading.Lock()
+
+# Версия статистики в базе, до которой индекс актуален
+_index_version = 0
+
+
+def build_stats_index(snapshot, windows=None):
+    """
+    Строит индекс актуальной статистики по снимку состояния игроков
+
+    Параметры:
+    snapshot (PlayerSnapshot): Снимок (последние строки и последние результаты игроков)
+    windows (pd.DataFrame, optional): Уже посчитанные window_stats(snapshot)
+
+    Возвращает:
+    dict: Словарь {игрок: запись индекса}
+    """
+    if snapshot.latest.empty:
+        return {}
+    if windows is None:
+        windows = window_stats(snapshot)
+
+    last_5_count = windows['last_5_count']
+    last_5_oldest = windows['last_5_oldest_result']
+    matches_30d = windows['matches_last_30d']
+    wins_30d = windows['wins_last_30d']
+
+    index = {}
+    for player, latest_stats in snapshot.latest.to_dict('index').items():
+        index[player] = {
+            'latest': latest_stats,
+            'last_5_count': int(last_5_count[player]),
+            'last_5_oldest_result': last_5_oldest[player],
+            'matches_last_30d': int(matches_30d[player]),
+            'wins_last_30d': wins_30d[player]
+        }
+
+    return index
+
+
+def load_stats_index():
+    """
+    Загружает снимок состояния всех игроков из базы и строит индекс; вызывается один раз при старте
+    """
+    global _stats_index, _feature_matrix, _index_version
+    # Версию читаем до загрузки: если загрузка статистики завершится между ними,
+    # ее игроки просто будут перечитаны при следующей синхронизации
+    version = get_stored_stats_version()
+    index, matrix = _build(load_snapshot())
+    player_names.add(index.keys())
+    _stats_index, _feature_matrix, _index_version = index, matrix, version
+
+
+def refresh_stats_index(players):
+    """
+    Перестраивает записи индекса для указанных игроков и атомарно подменяет индекс
+    """
+    global _stats_index, _feature_matrix
+    if _stats_index is None:
+        load_stats_index()
+        return
+
+    updated_entries, updated_matrix = _build(load_snapshot(players))
+    _stats_index, _feature_matrix = {**_stats_index, **updated_entries}, _feature_matrix.updated(updated_matrix)
+    player_names.add(updated_entries.keys())
+
+
+def _build(snapshot):
+    if snapshot.latest.empty:
+        return {}, empty_feature_matrix()
+    windows = window_stats(snapshot)
+    return build_stats_index(snapshot, windows), build_feature_matrix(snapshot, windows)
+
+
+def sync_stats_index():
+    """
+    Приводит индекс к текущей версии статистики в базе
+
+    Загрузки могут выполняться в другом процессе, поэтому версия читается из базы,
+    а перестраиваются только записи игроков из журнала обновлений.
+
+    Возвращает:
+    int: Версия статистики, которой соответствует индекс
+    """
+    global _index_version
+    version = get_stored_stats_version()
+    if _stats_index is not None and version == _index_version:
+        return version
+
+    with _build_lock:
+        if _stats_index is None or version < _index_version:
+            load_stats_index()
+        elif version != _index_version:
+            refresh_stats_index(get_updated_players(_index_version))
+            _index_version = version
+
+    return _index_version
+
+
+def get_stats_version():
+    """
+    Возвращает текущую версию статистики, предварительно синхронизировав с ней индекс
+    """
+    return sync_stats_index()
+
+
+def _ensure_loaded():
+    sync_stats_index()
+
+
+def get_index_entry(player_name):
+    """
+    Возвращает запись индекса для игрока или None, если игрок не найден
+    """
+    _ensure_loaded()
+    return _stats_index.get(player_name)
+
+
+def get_feature_matrix():
+    """
+    Возвращает показатели игроков для признаков матча, актуальные для текущей версии статистики
+    """
+    _ensure_loaded()
+    return _feature_matrix
+
+
+def resolve_player_name(query):
+    """
+    Возвращает имя игрока из статистики, если запрос совпадает с ним без учета регистра
+    """
+    _ensure_loaded()
+    return player_names.resolve(query)
+
+
+def suggest_player_names(query, limit=5):
+    """
+    Возвращает похожие имена игроков для подсказки "возможно, вы имели в виду"
+    """
+    _ensure_loaded()
+    return player_names.suggest(query, limit=limit)
@@ -0,0 +1,445 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+
+import numpy as np
+import pandas as pd
+
+from player_snapshot import PlayerSnapshot, build_snapshot
+
+
+DB_PATH = 'player_stats.db'
+CSV_PATH = 'player_stats.csv'
+
+# Сколько секунд ждать, пока другая загрузка освободит базу для записи
+BUSY_TIMEOUT = float(os.getenv("STATS_DB_BUSY_TIMEOUT", 600))
+
+STATS_COLUMNS = [
+    'player', 'court', 'stage', 'date', 'result', 'is_player1',
+    'match_id', 'cumulative_wins', 'cumulative_losses', 'streak',
+    'court_wins', 'court_losses', 'wins_last_5', 'wins_last_30d',
+    'matches_last_30d', 'win_rt', 'court_win_rt', 'win_rt_last_30'
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS player_stats (
+    player TEXT NOT NULL,
+    court TEXT,
+    stage TEXT,
+    date TEXT NOT NULL,
+    result INTEGER NOT NULL,
+    is_player1 INTEGER NOT NULL,
+    match_id INTEGER NOT NULL,
+    cumulative_wins INTEGER NOT NULL,
+    cumulative_losses INTEGER NOT NULL,
+    streak INTEGER NOT NULL,
+    court_wins INTEGER NOT NULL,
+    court_losses INTEGER NOT NULL,
+    wins_last_5 INTEGER NOT NULL,
+    wins_last_30d INTEGER NOT NULL,
+    matches_last_30d INTEGER NOT NULL,
+    win_rt REAL NOT NULL,
+    court_win_rt REAL NOT NULL,
+    win_rt_last_30 REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_player_stats_player_date ON player_stats (player, date);
+CREATE INDEX IF NOT EXISTS idx_player_stats_player_court_date ON player_stats (player, court, date);
+CREATE TABLE IF NOT EXISTS stats_updates (
+    version INTEGER NOT NULL,
+    player TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_stats_updates_version ON stats_updates (version);
+CREATE TABLE IF NOT EXISTS player_snapshot (
+    player TEXT PRIMARY KEY,
+    court TEXT,
+    stage TEXT,
+    date TEXT NOT NULL,
+    result INTEGER NOT NULL,
+    is_player1 INTEGER NOT NULL,
+    match_id INTEGER NOT NULL,
+    cumulative_wins INTEGER NOT NULL,
+    cumulative_losses INTEGER NOT NULL,
+    streak INTEGER NOT NULL,
+    court_wins INTEGER NOT NULL,
+    court_losses INTEGER NOT NULL,
+    wins_last_5 INTEGER NOT NULL,
+    wins_last_30d INTEGER NOT NULL,
+    matches_last_30d INTEGER NOT NULL,
+    win_rt REAL NOT NULL,
+    court_win_rt REAL NOT NULL,
+    win_rt_last_30 REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS player_court_snapshot (
+    player TEXT NOT NULL,
+    court TEXT NOT NULL,
+    court_wins INTEGER NOT NULL,
+    court_losses INTEGER NOT NULL,
+    result INTEGER NOT NULL,
+    PRIMARY KEY (player, court)
+);
+CREATE TABLE IF NOT EXISTS player_recent_results (
+    player TEXT NOT NULL,
+    date TEXT NOT NULL,
+    result INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_player_recent_results_player ON player_recent_results (player, date);
+CREATE TABLE IF NOT EXISTS ingested_match_hashes (
+    match_hash INTEGER PRIMARY KEY
+);
+"""
+
+SNAPSHOT_COURT_COLUMNS = ['player', 'court', 'court_wins', 'court_losses', 'result']
+SNAPSHOT_RECENT_COLUMNS = ['player', 'date', 'result']
+
+# Даты хранятся строкой ISO, чтобы сравнение строк совпадало с порядком дат
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Соединения для частой проверки версии статистики, по одному на поток
+_version_connections = threading.local()
+
+
+def connect(db_path=DB_PATH, csv_path=CSV_PATH):
+    """
+    Открывает базу статистики; если база пуста, переносит в нее player_stats.csv
+
+    База работает в режиме WAL: запись дописывается в журнал и публикуется при
+    фиксации транзакции, поэтому читатели видят согласованный снимок данных,
+    пока идет загрузка, а сбой посреди загрузки не портит уже записанную историю.
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+
+    if os.path.exists(csv_path) and _is_empty(conn):
+        migrate_from_csv(conn, csv_path)
+    _ensure_snapshot(conn)
+    _ensure_match_hashes(conn)
+
+    return conn
+
+
+def _is_empty(conn):
+    return conn.execute("SELECT 1 FROM player_stats LIMIT 1").fetchone() is None
+
+
+def begin_write(conn):
+    """
+    Начинает транзакцию записи, сразу захватывая блокировку записи
+
+    Писатель в базе всегда один: параллельная загрузка (в том числе из другого
+    процесса) ждет здесь, а не читает устаревший match_id до чужой фиксации.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+
+
+@contextmanager
+def open_transaction(db_path=DB_PATH):
+    """
+    Открывает соединение с одной транзакцией записи: фиксируется при успехе, откатывается при ошибке
+    """
+    with closing(connect(db_path)) as conn:
+        begin_write(conn)
+        with conn:
+            yield conn
+
+
+@contextmanager
+def _connection(db_path, conn):
+    # Внутри open_transaction используем переданное соединение, иначе открываем свое
+    if conn is not None:
+        yield conn
+    else:
+        with closing(connect(db_path)) as conn:
+            yield conn
+
+
+def migrate_from_csv(conn, csv_path=CSV_PATH):
+    """
+    Однократно переносит историю из player_stats.csv в базу
+
+    Перенос выполняется одной транзакцией записи, а пустота базы перепроверяется
+    под блокировкой, поэтому два процесса не перенесут историю дважды, а
+    прерванный перенос просто повторится при следующем открытии.
+    """
+    df_stats = pd.read_csv(csv_path)
+    df_stats['date'] = pd.to_datetime(df_stats['date'])
+    begin_write(conn)
+    with conn:
+        if _is_empty(conn):
+            _insert_rows(conn, df_stats)
+
+
+def _insert_rows(conn, df_stats, table='player_stats', columns=STATS_COLUMNS):
+    rows = df_stats[columns].copy()
+    if 'date' in columns:
+        rows['date'] = pd.to_datetime(rows['date']).dt.strftime(DATE_FORMAT)
+    if 'is_player1' in columns:
+        rows['is_player1'] = rows['is_player1'].astype(bool).astype(int)
+    rows = rows.astype(object).where(rows.notna(), None)
+
+    placeholders = ', '.join('?' * len(columns))
+    conn.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+        rows.itertuples(index=False, name=None)
+    )
+
+
+def _set_requested_players(conn, players):
+    # Список игроков для выборок передается через временную таблицу, а не через IN (...)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS requested_players (player TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.requested_players")
+    conn.executemany("INSERT OR IGNORE INTO temp.requested_players VALUES (?)",
+                     ((player,) for player in players))
+
+
+def _to_frame(df_stats):
+    if df_stats.empty:
+        return pd.DataFrame(columns=STATS_COLUMNS)
+
+    df_stats['date'] = pd.to_datetime(df_stats['date'])
+    df_stats['is_player1'] = df_stats['is_player1'].astype(bool)
+    return df_stats
+
+
+def append_stats(df_stats, db_path=DB_PATH, conn=None):
+    """
+    Дописывает новые строки статистики одной транзакцией
+    (или в рамках транзакции переданного соединения)
+    """
+    if conn is not None:
+        _insert_rows(conn, df_stats)
+        return
+
+    with open_transaction(db_path) as conn:
+        _insert_rows(conn, df_stats)
+
+
+def get_max_match_id(db_path=DB_PATH, conn=None):
+    """
+    Возвращает максимальный match_id в базе или -1, если база пуста
+    """
+    with _connection(db_path, conn) as conn:
+        max_match_id = conn.execute("SELECT MAX(match_id) FROM player_stats").fetchone()[0]
+
+    return -1 if max_match_id is None else max_match_id
+
+
+def record_update(conn, players):
+    """
+    Записывает в журнал обновлений новую версию статистики и затронутых игроков
+
+    Вызывается в транзакции загрузки, поэтому версия меняется вместе с данными.
+    По журналу другие процессы узнают, каких игроков перечитать.
+
+    Возвращает:
+    int: Новая версия статистики
+    """
+    version = conn.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM stats_updates").fetchone()[0]
+    conn.executemany("INSERT INTO stats_updates (version, player) VALUES (?, ?)",
+                     ((version, player) for player in players))
+    return version
+
+
+def get_stats_version(db_path=DB_PATH):
+    """
+    Возвращает текущую версию статистики (0, если загрузок еще не было)
+    """
+    connections = getattr(_version_connections, 'by_path', None)
+    if connections is None:
+        connections = _version_connections.by_path = {}
+    if db_path not in connections:
+        connections[db_path] = connect(db_path)
+
+    return connections[db_path].execute("SELECT COALESCE(MAX(version), 0) FROM stats_updates").fetchone()[0]
+
+
+def get_updated_players(since_version, db_path=DB_PATH):
+    """
+    Возвращает игроков, статистика которых менялась после указанной версии
+    """
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute("SELECT DISTINCT player FROM stats_updates WHERE version > ?", (since_version,))
+        return [player for player, in rows]
+
+
+def load_all_stats(db_path=DB_PATH, conn=None):
+    """
+    Загружает всю таблицу статистики, упорядоченную по дате
+    """
+    with _connection(db_path, conn) as conn:
+        df_stats = pd.read_sql_query(
+            f"SELECT {', '.join(STATS_COLUMNS)} FROM player_stats ORDER BY date, rowid", conn
+        )
+
+    return _to_frame(df_stats)
+
+
+def load_players_stats(players, before_date=None, db_path=DB_PATH, conn=None):
+    """
+    Загружает историю только указанных игроков (выборка по индексу (player, date))
+
+    Параметры:
+    players (iterable): Имена игроков
+    before_date (datetime, optional): Верхняя граница дат (не включительно)
+    db_path (str): Путь к базе статистики
+    conn (sqlite3.Connection, optional): Открытое соединение (видит незафиксированные строки своей транзакции)
+
+    Возвращает:
+    pd.DataFrame: Строки статистики, упорядоченные по игроку и дате
+    """
+    query = (f"SELECT {', '.join('s.' + col for col in STATS_COLUMNS)} FROM player_stats s "
+             "JOIN temp.requested_players p ON s.player = p.player")
+    params = []
+    if before_date is not None:
+        query += " WHERE s.date < ?"
+        params.append(pd.Timestamp(before_date).strftime(DATE_FORMAT))
+    query += " ORDER BY s.player, s.date, s.rowid"
+
+    with _connection(db_path, conn) as conn:
+        _set_requested_players(conn, players)
+        df_stats = pd.read_sql_query(query, conn, params=params)
+
+    return _to_frame(df_stats)
+
+
+def _ensure_snapshot(conn):
+    # База, заполненная до появления снимка: строим его один раз по всей истории
+    if conn.execute("SELECT 1 FROM player_snapshot LIMIT 1").fetchone() is not None or _is_empty(conn):
+        return
+
+    begin_write(conn)
+    with conn:
+        if conn.execute("SELECT 1 FROM player_snapshot LIMIT 1").fetchone() is None:
+            save_snapshot(conn, build_snapshot(load_all_stats(conn=conn)))
+
+
+def load_snapshot(players=None, db_path=DB_PATH, conn=None):
+    """
+    Загружает снимок состояния игроков (всех или только указанных)
+
+    Возвращает:
+    PlayerSnapshot: Последние строки, строки по кортам и последние результаты игроков
+    """
+    with _connection(db_path, conn) as conn:
+        join = ""
+        if players is not None:
+            _set_requested_players(conn, players)
+            join = " JOIN temp.requested_players p ON s.player = p.player"
+
+        latest = pd.read_sql_query(
+            f"SELECT {', '.join('s.' + col for col in STATS_COLUMNS)} FROM player_snapshot s{join}", conn
+        )
+        courts = pd.read_sql_query(
+            f"SELECT {', '.join('s.' + col for col in SNAPSHOT_COURT_COLUMNS)} FROM player_court_snapshot s{join}",
+            conn
+        )
+        recent = pd.read_sql_query(
+            f"SELECT {', '.join('s.' + col for col in SNAPSHOT_RECENT_COLUMNS)} FROM player_recent_results s{join} "
+            "ORDER BY s.player, s.date, s.rowid", conn
+        )
+
+    latest = _to_frame(latest).set_index('player', drop=False)
+    latest.index.name = None
+    recent['date'] = pd.to_datetime(recent['date'])
+    return PlayerSnapshot(latest=latest, courts=courts, recent=recent)
+
+
+def save_snapshot(conn, snapshot):
+    """
+    Заменяет сохраненный снимок игроков из snapshot (в рамках транзакции conn)
+    """
+    _set_requested_players(conn, snapshot.players)
+    for table in ['player_snapshot', 'player_court_snapshot', 'player_recent_results']:
+        conn.execute(f"DELETE FROM {table} WHERE player IN (SELECT player FROM temp.requested_players)")
+
+    _insert_rows(conn, snapshot.latest, table='player_snapshot')
+    _insert_rows(conn, snapshot.courts, table='player_court_snapshot', columns=SNAPSHOT_COURT_COLUMNS)
+    _insert_rows(conn, snapshot.recent, table='player_recent_results', columns=SNAPSHOT_RECENT_COLUMNS)
+
+
+def match_hashes(player1, player2, dates, player1_win, courts, stages, scores=None):
+    """
+    Считает хеши содержимого матчей для поиска уже загруженных
+
+    Матч определяется победителем, проигравшим, датой, кортом, кругом и счетом по
+    сетам с точки зрения победителя: порядок игроков в файле не важен, а разные матчи
+    одной пары в один день (например, в разных турнирах) различаются.
+
+    Параметры:
+    scores (iterable, optional): Счет победителя и проигравшего ("2-1"); счет в базе
+        не хранится, поэтому для истории, загруженной до появления хешей, его нет (None)
+
+    Возвращает:
+    np.ndarray: Хеши матчей (int64)
+    """
+    dates = pd.to_datetime(pd.Series(dates)).dt.strftime(DATE_FORMAT)
+    if scores is None:
+        scores = [None] * len(dates)
+    hashes = np.empty(len(dates), dtype=np.int64)
+    rows = zip(player1, player2, dates, player1_win, courts, stages, scores)
+    for position, (name1, name2, date, first_won, court, stage, score) in enumerate(rows):
+        winner, loser = (name1, name2) if first_won else (name2, name1)
+        details = ['' if pd.isna(value) else str(value) for value in (court, stage, score)]
+        key = "\x1f".join([winner, loser, date] + details)
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        hashes[position] = int.from_bytes(digest, 'big', signed=True)
+    return hashes
+
+
+def find_ingested_matches(conn, hashes):
+    """
+    Возвращает маску хешей матчей, которые уже есть в базе (поиск по первичному ключу)
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS requested_hashes (match_hash INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.requested_hashes")
+    conn.executemany("INSERT OR IGNORE INTO temp.requested_hashes VALUES (?)", ((int(h),) for h in hashes))
+    found = {match_hash for match_hash, in conn.execute(
+        "SELECT m.match_hash FROM ingested_match_hashes m JOIN temp.requested_hashes r ON m.match_hash = r.match_hash"
+    )}
+    return np.fromiter((int(h) in found for h in hashes), dtype=bool, count=len(hashes))
+
+
+def record_ingested_matches(conn, hashes):
+    """
+    Запоминает хеши загруженных матчей (в рамках транзакции conn)
+    """
+    conn.executemany("INSERT OR IGNORE INTO ingested_match_hashes (match_hash) VALUES (?)",
+                     ((int(h),) for h in hashes))
+
+
+def _ensure_match_hashes(conn):
+    # База, заполненная до появления хешей: строим их один раз по парам строк каждого матча.
+    # Хеши прежнего формата (только игроки и дата) склеивали разные матчи одного дня - их заменяем
+    has_legacy = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ingested_matches'"
+                              ).fetchone() is not None
+    if not has_legacy and (conn.execute("SELECT 1 FROM ingested_match_hashes LIMIT 1").fetchone() is not None
+                           or _is_empty(conn)):
+        return
+
+    begin_write(conn)
+    with conn:
+        conn.execute("DROP TABLE IF EXISTS ingested_matches")
+        if not _is_empty(conn) and conn.execute("SELECT 1 FROM ingested_match_hashes LIMIT 1").fetchone() is None:
+            matches = pd.read_sql_query(
+                "SELECT p1.player AS player1, p2.player AS player2, p1.date, p1.result, p1.court, p1.stage "
+                "FROM player_stats p1 "
+                "JOIN player_stats p2 ON p1.match_id = p2.match_id AND p2.is_player1 = 0 WHERE p1.is_player1 = 1",
+                conn
+            )
+            record_ingested_matches(conn, match_hashes(matches['player1'], matches['player2'], matches['date'],
+                                                       matches['result'], matches['court'], matches['stage']))
+
+
+def replace_players_stats(conn, first_dates, df_stats):
+    """
+    Заменяет строки игроков начиная с указанных дат пересчитанными (в рамках транзакции conn)
+
+    Параметры:
+    first_dates (pd.Series): Дата, с которой заменяются строки (индекс - имя игрока)
+    df_stats (pd.DataFrame): Пересчитанные строки этих игроков в порядке матчей
+    """
+    conn.executemany("DELETE FROM player_stats WHERE player = ? AND date >= ?",
+                     ((player, pd.Timestamp(date).strftime(DATE_FORMAT)) for player, date in first_dates.items()))
+    _insert_rows(conn, df_stats)
@@ -0,0 +1,169 @@
+import os
+from contextlib import closing
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from stats_store import DATE_FORMAT, DB_PATH, STATS_COLUMNS, connect
+
+
+TABLE_CACHE_PATH = 'player_stats_table.npz'
+# Сколько строк читается из базы за раз при построении таблицы
+READ_CHUNK_SIZE = 200000
+
+# Узкие типы колонок: счетчики матчей игрока не выходят за пределы int32,
+# окна 5 матчей и 30 дней - за пределы int8 и int16. Доли хранятся в float32:
+# точные значения при необходимости пересчитываются по счетчикам.
+COLUMN_DTYPES = {
+    'result': np.int8,
+    'is_player1': np.bool_,
+    'match_id': np.int32,
+    'cumulative_wins': np.int32,
+    'cumulative_losses': np.int32,
+    'streak': np.int32,
+    'court_wins': np.int32,
+    'court_losses': np.int32,
+    'wins_last_5': np.int8,
+    'wins_last_30d': np.int16,
+    'matches_last_30d': np.int16,
+    'win_rt': np.float32,
+    'court_win_rt': np.float32,
+    'win_rt_last_30': np.float32
+}
+CATEGORY_COLUMNS = ['court', 'stage']
+
+
+@dataclass(frozen=True)
+class StatsTable:
+    """
+    Вся таблица статистики в компактном виде
+
+    stats - строки статистики в порядке дат (как load_all_stats): player - номер игрока
+    (int32, индекс в players), court и stage - категории, date - datetime64, счетчики -
+    узкие целые типы; players - имена игроков по номерам; key - состояние базы,
+    по которому построена таблица.
+    """
+    stats: pd.DataFrame
+    players: np.ndarray
+    key: tuple
+
+    @cached_property
+    def player_ids(self):
+        return {player: player_id for player_id, player in enumerate(self.players)}
+
+    def player_id(self, player):
+        """
+        Возвращает номер игрока или -1, если игрока нет в таблице
+        """
+        return self.player_ids.get(player, -1)
+
+    def decoded(self, stats=None):
+        """
+        Возвращает строки (по умолчанию все) в формате load_all_stats: имена и корты строками
+        """
+        stats = self.stats if stats is None else stats
+        decoded = stats.copy()
+        decoded['player'] = self.players[stats['player'].to_numpy()]
+        for column in CATEGORY_COLUMNS:
+            decoded[column] = stats[column].astype(object).where(stats[column].notna(), None)
+        return decoded[STATS_COLUMNS]
+
+
+def load_stats_table(db_path=DB_PATH, cache_path=TABLE_CACHE_PATH):
+    """
+    Загружает всю таблицу статистики в компактном виде
+
+    Таблица сохраняется в cache_path (npz без объектов Python) и при следующем
+    вызове читается оттуда без разбора строк и дат, если база с тех пор не менялась.
+
+    Возвращает:
+    StatsTable: Таблица статистики
+    """
+    with closing(connect(db_path)) as conn:
+        key = _table_key(conn)
+        table = _read_cache(cache_path, key)
+        if table is None:
+            table = _read_table(conn, key)
+            _write_cache(cache_path, table)
+
+    return table
+
+
+def _table_key(conn):
+    # Строки статистики только дописываются, поэтому число строк и последний rowid
+    # вместе с версией обновлений однозначно задают содержимое таблицы
+    count, max_rowid = conn.execute("SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM player_stats").fetchone()
+    version = conn.execute("SELECT COALESCE(MAX(version), 0) FROM stats_updates").fetchone()[0]
+    return count, max_rowid, version
+
+
+def _read_table(conn, key):
+    players = np.array([player for player, in conn.execute("SELECT DISTINCT player FROM player_stats ORDER BY player")],
+                       dtype=str)
+    player_index = pd.Index(players)
+    categories = {
+        column: [value for value, in conn.execute(f"SELECT DISTINCT {column} FROM player_stats "
+                                                   f"WHERE {column} IS NOT NULL ORDER BY {column}")]
+        for column in CATEGORY_COLUMNS
+    }
+
+    chunks = []
+    query = f"SELECT {', '.join(STATS_COLUMNS)} FROM player_stats ORDER BY date, rowid"
+    for chunk in pd.read_sql_query(query, conn, chunksize=READ_CHUNK_SIZE):
+        # Строки переводятся в номера сразу, чтобы в памяти не лежала вся таблица строк
+        chunk['player'] = player_index.get_indexer(chunk['player']).astype(np.int32)
+        for column in CATEGORY_COLUMNS:
+            chunk[column] = pd.Categorical(chunk[column], categories=categories[column])
+        chunk['date'] = pd.to_datetime(chunk['date'], format=DATE_FORMAT)
+        chunks.append(chunk.astype(COLUMN_DTYPES))
+
+    if chunks:
+        stats = pd.concat(chunks, ignore_index=True)
+    else:
+        stats = _empty_stats(categories)
+    return StatsTable(stats=stats, players=players, key=key)
+
+
+def _empty_stats(categories):
+    stats = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in COLUMN_DTYPES.items()})
+    stats['player'] = pd.Series(dtype=np.int32)
+    stats['date'] = pd.Series(dtype='datetime64[ns]')
+    for column in CATEGORY_COLUMNS:
+        stats[column] = pd.Categorical([], categories=categories[column])
+    return stats[STATS_COLUMNS]
+
+
+def _read_cache(cache_path, key):
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path, allow_pickle=False) as cache:
+            if tuple(cache['key']) != key:
+                return None
+            columns = {column: cache[f"column_{column}"] for column in STATS_COLUMNS
+                       if column not in CATEGORY_COLUMNS}
+            for column in CATEGORY_COLUMNS:
+                columns[column] = pd.Categorical.from_codes(cache[f"codes_{column}"],
+                                                            categories=cache[f"categories_{column}"])
+            players = cache['players']
+    except (OSError, KeyError, ValueError):
+        # Поврежденный или устаревший по формату кеш просто строится заново
+        return None
+
+    return StatsTable(stats=pd.DataFrame(columns)[STATS_COLUMNS], players=players, key=key)
+
+
+def _write_cache(cache_path, table):
+    arrays = {f"column_{column}": table.stats[column].to_numpy() for column in STATS_COLUMNS
+              if column not in CATEGORY_COLUMNS}
+    for column in CATEGORY_COLUMNS:
+        arrays[f"codes_{column}"] = table.stats[column].cat.codes.to_numpy()
+        arrays[f"categories_{column}"] = table.stats[column].cat.categories.to_numpy(dtype=str)
+
+    # Запись во временный файл и замена: читатели не увидят недописанный кеш
+    temporary_path = f"{cache_path}.tmp"
+    with open(temporary_path, 'wb') as cache_file:
+        np.savez(cache_file, key=np.array(table.key, dtype=np.int64), players=table.players, **arrays)
+    os.replace(temporary_path, cache_path)
@@ -0,0 +1,61 @@
+import asyncio
+import threading
+
+from aiogram.fsm.storage.base import StorageKey
+
+from state_storage.bounded_storage import BoundedStorage
+
+
+def storage_key(chat_id):
+    return StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id)
+
+
+def test_reads_refresh_recency():
+    async def scenario():
+        storage = BoundedStorage(maxsize=2)
+        await storage.set_state(storage_key(1), "first")
+        await storage.set_state(storage_key(2), "second")
+        # Чтение делает первый диалог последним использованным - вытесняется второй
+        await storage.get_state(storage_key(1))
+        await storage.set_state(storage_key(3), "third")
+        return [await storage.get_state(storage_key(chat_id)) for chat_id in (1, 2, 3)], storage.stats()
+
+    states, stats = asyncio.run(scenario())
+
+    assert states == ["first", None, "third"]
+    assert stats['evictions'] == 1
+
+
+def test_disk_writes_run_off_the_event_loop(tmp_path):
+    db_path = str(tmp_path / 'fsm.db')
+
+    async def write():
+        storage = BoundedStorage(db_path=db_path)
+        loop_thread = threading.get_ident()
+        write_threads = []
+        original_write = storage._write
+
+        def write_pending(pending):
+            write_threads.append(threading.get_ident())
+            original_write(pending)
+
+        storage._write = write_pending
+        await storage.set_state(storage_key(1), "first")
+        await storage.set_data(storage_key(1), {"player": "Player 00001"})
+        await storage.set_state(storage_key(2), "second")
+        await storage.set_state(storage_key(2), None)
+        await storage.close()
+        return loop_thread, write_threads
+
+    async def restore():
+        storage = BoundedStorage(db_path=db_path)
+        try:
+            return [(await storage.get_state(storage_key(chat_id)), await storage.get_data(storage_key(chat_id)))
+                    for chat_id in (1, 2)]
+        finally:
+            await storage.close()
+
+    loop_thread, write_threads = asyncio.run(write())
+
+    assert write_threads and loop_thread not in write_threads
+    assert asyncio.run(restore()) == [("first", {"player": "Player 00001"}), (None, {})]
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import os
+
+import pytest
+
+from utils.job_runner import JobRunner, WorkerCrashedError
+
+
+def test_prewarm_waits_for_every_worker():
+    async def prewarm():
+        runner = JobRunner(max_workers=2, logger=logging.getLogger(__name__), worker_warmup=os.getpid)
+        runner.start()
+        try:
+            await asyncio.wait_for(runner.prewarm(), timeout=60)
+            return runner.stats()
+        finally:
+            await runner.shutdown()
+
+    stats = asyncio.run(prewarm())
+
+    assert stats['ready_workers'] == 2
+    assert stats['jobs']['prewarm']['completed'] == 2
+
+
+def crash_once(marker):
+    # Первый вызов убивает процесс пула, как это сделал бы OOM killer
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return "done"
+
+
+def crash_always():
+    os._exit(1)
+
+
+def test_broken_pool_is_replaced(tmp_path):
+    async def scenario():
+        runner = JobRunner(max_workers=1, logger=logging.getLogger(__name__))
+        runner.start()
+        try:
+            retried = await runner.run("prediction", crash_once, str(tmp_path / 'crashed'))
+            with pytest.raises(WorkerCrashedError):
+                await runner.run("prediction", crash_always)
+            # После повторного сбоя пул снова заменен и принимает задачи
+            return retried, await runner.run("prediction", os.getpid)
+        finally:
+            await runner.shutdown()
+
+    retried, pid = asyncio.run(scenario())
+
+    assert retried == "done"
+    assert pid != os.getpid()
+
+
+def report_steps(steps, progress):
+    for step in range(steps):
+        progress(f"step {step}")
+    return steps
+
+
+def test_upload_progress_is_delivered_in_order():
+    async def scenario():
+        runner = JobRunner(max_workers=1, logger=logging.getLogger(__name__))
+        runner.start()
+        messages = []
+
+        async def on_progress(text):
+            messages.append(text)
+
+        try:
+            result = await runner.submit_upload(report_steps, 20, on_progress=on_progress)
+        finally:
+            await runner.shutdown()
+        return result, messages, runner._progress_thread.is_alive()
+
+    result, messages, reader_alive = asyncio.run(scenario())
+
+    assert result == 20
+    assert messages == [f"step {step}" for step in range(20)]
+    assert not reader_alive
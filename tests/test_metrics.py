@@ -0,0 +1,29 @@
+from utils.lru_cache import LRUCache
+from utils.metrics import CacheMetrics, cache_metrics, render_metrics
+
+
+def test_cache_metrics_render_counters_and_gauges():
+    cache = LRUCache(maxsize=1)
+    metrics = CacheMetrics("test_cache")
+    metrics.register("prediction", cache.stats)
+    cache.get("a")
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("b")
+
+    lines = metrics.render().splitlines()
+    assert '# TYPE test_cache_hits_total counter' in lines
+    assert 'test_cache_hits_total{cache="prediction"} 1' in lines
+    assert 'test_cache_misses_total{cache="prediction"} 1' in lines
+    assert 'test_cache_evictions_total{cache="prediction"} 1' in lines
+    assert '# TYPE test_cache_size gauge' in lines
+    assert 'test_cache_size{cache="prediction"} 1' in lines
+    assert metrics.stats()["prediction"]["hits"] == 1
+
+
+def test_prediction_cache_is_exported():
+    import prediction_functions
+
+    prediction_functions.prediction_cache.get(("missing",))
+    assert cache_metrics.stats()["prediction"] == prediction_functions.get_prediction_cache_stats()
+    assert 'bot_cache_misses_total{cache="prediction"}' in render_metrics()
@@ -0,0 +1,21 @@
+from pathlib import Path
+
+import stats_index
+from benchmarks.synthetic_data import generate_matches, write_xlsx
+from prediction_functions import check_feature_consistency
+from stat_upload import add_batch_matches_and_update_stats
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_feature_matrix_matches_build_match_data(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    matches_xlsx = write_xlsx(generate_matches(40, 2000, days=120, seed=3), tmp_path / 'matches.xlsx')
+    add_batch_matches_and_update_stats(matches_xlsx, progress=lambda text: None)
+    # Индекс статистики общий для процесса: перечитываем его из базы этого теста
+    stats_index.load_stats_index()
+
+    result = check_feature_consistency(feature_info_path=ROOT / 'feature_info.pkl')
+
+    assert result == {'pairs': 2000, 'mismatched_values': 0}
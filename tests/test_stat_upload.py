@@ -0,0 +1,164 @@
+import openpyxl
+import pandas as pd
+from openpyxl.styles import Font
+
+from benchmarks.synthetic_data import generate_matches, write_xlsx
+from stat_upload import add_batch_matches_and_update_stats, strip_seed
+from stats_store import STATS_COLUMNS, load_all_stats
+
+
+def upload(directory, files, monkeypatch):
+    monkeypatch.chdir(directory)
+    for path in files:
+        add_batch_matches_and_update_stats(path, progress=lambda text: None)
+    stats = load_all_stats().sort_values(['player', 'date'], kind='stable')
+    # match_id зависит от порядка загрузки, остальные колонки должны совпадать
+    return stats[[column for column in STATS_COLUMNS if column != 'match_id']].reset_index(drop=True)
+
+
+def test_late_matches_match_full_rebuild(tmp_path, monkeypatch):
+    matches = generate_matches(30, 1500, days=120, seed=11)
+
+    # Опоздавшие матчи: у обоих игроков в истории есть более поздние матчи,
+    # поэтому их строки после даты матча пересчитываются
+    late = matches.sample(100, random_state=1)
+    history = matches.drop(late.index)
+    players = pd.concat([
+        pd.DataFrame({'player': strip_seed(history[column]), 'date': history['Дата']})
+        for column in ['Игрок 1', 'Игрок 2']
+    ])
+    last_dates = players.groupby('player')['date'].max()
+    is_late = ((late['Дата'] < strip_seed(late['Игрок 1']).map(last_dates))
+               & (late['Дата'] < strip_seed(late['Игрок 2']).map(last_dates)))
+    late = late[is_late].sort_values('Дата', kind='stable')
+    history = matches.drop(late.index)
+    assert len(late) > 50
+
+    history_xlsx = write_xlsx(history, tmp_path / 'history.xlsx')
+    late_xlsx = write_xlsx(late, tmp_path / 'late.xlsx')
+    # В базе опоздавший матч идет после матчей истории того же дня - так же и в общем файле
+    all_matches = pd.concat([history, late]).sort_values('Дата', kind='stable')
+    all_xlsx = write_xlsx(all_matches, tmp_path / 'all.xlsx')
+    (tmp_path / 'incremental').mkdir()
+    (tmp_path / 'full').mkdir()
+
+    incremental = upload(tmp_path / 'incremental', [history_xlsx, late_xlsx], monkeypatch)
+    full = upload(tmp_path / 'full', [all_xlsx], monkeypatch)
+
+    pd.testing.assert_frame_equal(incremental, full)
+
+
+def test_trailing_blank_rows_keep_streaming(tmp_path, monkeypatch):
+    matches_xlsx = write_xlsx(generate_matches(10, 50, seed=1), tmp_path / 'matches.xlsx')
+    # Оформленные строки без значений в конце листа read_only отдает как строки из None
+    workbook = openpyxl.load_workbook(matches_xlsx)
+    sheet = workbook.active
+    for row in range(sheet.max_row + 1, sheet.max_row + 6):
+        sheet.cell(row=row, column=1).font = Font(bold=True)
+    workbook.save(matches_xlsx)
+
+    messages = []
+    monkeypatch.chdir(tmp_path)
+    add_batch_matches_and_update_stats(matches_xlsx, progress=messages.append)
+
+    assert not any("не упорядочены" in message for message in messages)
+    assert "Обработано 50 матчей..." in messages
+
+
+def test_same_day_matches_of_one_pair_are_kept(tmp_path, monkeypatch):
+    columns = ['Игрок 1', 'Игрок 2', 'Дата', 'Круг', 'Корт', 'R1', 'R2', 'Сеты']
+    matches = pd.DataFrame([
+        ['Player A', 'Player B', '2023-04-20', 'F', 'i.hard', 100, 200, '2-0'],
+        ['Player A', 'Player B', '2023-04-20', 'QF', 'grass', 100, 200, '2-0'],
+        ['Player B', 'Player A', '2023-04-20', 'R2', 'grass', 200, 100, '0-2'],
+        # Тот же матч, что и первый, с игроками в другом порядке - повтор
+        ['Player B', 'Player A', '2023-04-20', 'F', 'i.hard', 200, 100, '0-2']
+    ], columns=columns)
+    matches_xlsx = write_xlsx(matches, tmp_path / 'matches.xlsx')
+
+    monkeypatch.chdir(tmp_path)
+    assert add_batch_matches_and_update_stats(matches_xlsx, progress=lambda text: None) == 6
+    # Повторная загрузка файла ничего не добавляет
+    assert add_batch_matches_and_update_stats(matches_xlsx, progress=lambda text: None) == 0
+
+    stats = load_all_stats()
+    expected = [('F', 'i.hard'), ('QF', 'grass'), ('R2', 'grass')] * 2
+    assert sorted(zip(stats['stage'], stats['court'])) == sorted(expected)
+
+
+def reference_stats(matches):
+    """
+    Последовательный расчет статистики по матчам (как прежний цикл update_player_cache,
+    с окном 30 дней без ограничения в 5 матчей), матчи одного дня - в порядке файла
+    """
+    players = {}
+    rows = []
+    matches = matches.sort_values('Дата', kind='stable')
+    for match_id, (player1, player2, date, court, sets) in enumerate(zip(
+            strip_seed(matches['Игрок 1']), strip_seed(matches['Игрок 2']), matches['Дата'], matches['Корт'],
+            matches['Сеты'])):
+        sets1, sets2 = map(int, sets.split('-'))
+        for player, result, is_player1 in [(player1, int(sets1 > sets2), True), (player2, int(sets1 < sets2), False)]:
+            state = players.setdefault(player, {
+                'cumulative_wins': 0, 'cumulative_losses': 0, 'streak': 0, 'court': court, 'court_wins': 0,
+                'court_losses': 0, 'wins_last_5': 0, 'wins_last_30d': 0, 'matches_last_30d': 0, 'history': []
+            })
+            rows.append({'player': player, 'date': date, 'result': result, 'is_player1': is_player1,
+                         'match_id': match_id, **{key: value for key, value in state.items()
+                                                  if key not in ('court', 'history')}})
+
+            state['cumulative_wins'] += result
+            state['cumulative_losses'] += 1 - result
+            if result:
+                state['streak'] = 1 if state['streak'] < 0 else state['streak'] + 1
+            else:
+                state['streak'] = -1 if state['streak'] > 0 else state['streak'] - 1
+            if court != state['court']:
+                state['court'], state['court_wins'], state['court_losses'] = court, 0, 0
+            state['court_wins'] += result
+            state['court_losses'] += 1 - result
+            state['history'].append((date, result))
+            state['wins_last_5'] = sum(won for _, won in state['history'][-5:])
+            recent = [won for played, won in state['history'] if played >= date - pd.Timedelta(days=30)]
+            state['matches_last_30d'] = len(recent)
+            state['wins_last_30d'] = sum(recent)
+    return pd.DataFrame(rows)
+
+
+def test_batch_stats_match_sequential_loop(tmp_path, monkeypatch):
+    # Мало игроков и дней: у каждого игрока много матчей в один день и между днями
+    matches = generate_matches(8, 400, days=60, seed=3).dropna(subset=['Сеты'])
+    matches_xlsx = write_xlsx(matches, tmp_path / 'matches.xlsx')
+    monkeypatch.chdir(tmp_path)
+    add_batch_matches_and_update_stats(matches_xlsx, chunk_size=150, progress=lambda text: None)
+
+    columns = ['player', 'date', 'result', 'is_player1', 'cumulative_wins', 'cumulative_losses', 'streak',
+               'court_wins', 'court_losses', 'wins_last_5', 'wins_last_30d', 'matches_last_30d']
+    stats = load_all_stats().sort_values(['match_id', 'is_player1'], ascending=[True, False], kind='stable')
+    expected = reference_stats(matches)
+    assert (expected.groupby(['player', 'date']).size() > 1).any()
+    pd.testing.assert_frame_equal(stats[columns].reset_index(drop=True), expected[columns], check_dtype=False)
+
+
+def test_30_day_window_boundary_and_same_day_matches(tmp_path, monkeypatch):
+    columns = ['Игрок 1', 'Игрок 2', 'Дата', 'Круг', 'Корт', 'R1', 'R2', 'Сеты']
+    matches = pd.DataFrame([
+        ['Player A', 'Player B', '2023-01-01', 'R1', 'hard', 100, 200, '2-0'],
+        # Ровно через 30 дней: матч 1 января еще в окне
+        ['Player A', 'Player C', '2023-01-31', 'R1', 'hard', 100, 200, '2-1'],
+        # Через 31 день матч 1 января выходит из окна; три матча в один день
+        ['Player A', 'Player D', '2023-02-01', 'R1', 'hard', 100, 200, '0-2'],
+        ['Player A', 'Player E', '2023-02-01', 'R2', 'hard', 100, 200, '2-0'],
+        ['Player A', 'Player F', '2023-02-01', 'QF', 'hard', 100, 200, '2-1'],
+        ['Player A', 'Player B', '2023-02-02', 'SF', 'hard', 100, 200, '1-2']
+    ], columns=columns)
+    matches_xlsx = write_xlsx(matches, tmp_path / 'matches.xlsx')
+
+    monkeypatch.chdir(tmp_path)
+    # Части по 4 матча: матчи одного дня попадают в разные части
+    add_batch_matches_and_update_stats(matches_xlsx, chunk_size=4, progress=lambda text: None)
+
+    stats = load_all_stats()
+    player_stats = stats[stats['player'] == 'Player A'].sort_values('match_id')
+    assert player_stats['matches_last_30d'].tolist() == [0, 1, 2, 2, 3, 4]
+    assert player_stats['wins_last_30d'].tolist() == [0, 1, 2, 1, 2, 3]
@@ -0,0 +1,17 @@
+from pathlib import Path
+
+import pytest
+
+from tree_model import check_parity
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_compiled_trees_match_xgboost():
+    pytest.importorskip("xgboost")
+    result = check_parity(ROOT / 'best_xgb_model.json', ROOT / 'feature_info.pkl', n_rows=500, tolerance=1e-6)
+
+    assert result['passed']
+    assert result['max_abs_difference'] <= 1e-6
+    assert result['margin_bitwise_equal']
@@ -0,0 +1,195 @@
+import json
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class CompiledTrees:
+    """
+    Деревья модели XGBoost, уложенные в непрерывные массивы NumPy
+
+    Узлы всех деревьев уложены подряд в одномерные массивы (дерево i начинается
+    с позиции roots[i]); потомки узла n лежат в children[2n] (левый) и
+    children[2n + 1] (правый), у листа оба указывают на сам лист, а в value
+    лежит его значение. Обход всех деревьев для всех строк выполняется
+    одновременно за max_depth шагов.
+    """
+    roots: np.ndarray
+    feature: np.ndarray
+    threshold: np.ndarray
+    children: np.ndarray
+    default_left: np.ndarray
+    value: np.ndarray
+    max_depth: int
+    base_margin: np.float32
+    feature_names: list
+
+    def predict_margin(self, features):
+        """
+        Возвращает сумму значений листьев и базовой оценки для каждой строки (float32)
+        """
+        if self.feature_names and hasattr(features, 'columns') and list(features.columns) != self.feature_names:
+            raise ValueError("Колонки признаков не совпадают с признаками модели")
+        rows = np.ascontiguousarray(features, dtype=np.float32)
+        if rows.ndim == 1:
+            rows = rows[np.newaxis, :]
+
+        # Позиции значений признаков строк в rows.ravel(): начало строки плюс номер признака
+        row_offsets = (np.arange(len(rows)) * rows.shape[1])[:, np.newaxis]
+        flat_rows = rows.ravel()
+        has_missing = np.isnan(flat_rows).any()
+        nodes = np.broadcast_to(self.roots, (len(rows), len(self.roots)))
+        for _ in range(self.max_depth):
+            values = flat_rows.take(row_offsets + self.feature.take(nodes))
+            # Как в XGBoost: влево, если значение меньше порога; пропуск идет по ветке по умолчанию
+            go_left = values < self.threshold.take(nodes)
+            if has_missing:
+                go_left = np.where(np.isnan(values), self.default_left.take(nodes), go_left)
+            nodes = self.children.take(2 * nodes + ~go_left)
+
+        # Значения деревьев складываются по порядку в float32, как в XGBoost
+        leaves = np.ascontiguousarray(self.value.take(nodes).T)
+        margin = np.full(len(rows), self.base_margin, dtype=np.float32)
+        for tree_leaves in leaves:
+            margin += tree_leaves
+        return margin
+
+    def predict_proba(self, features):
+        """
+        Возвращает вероятности классов в том же виде, что XGBClassifier.predict_proba
+        """
+        margin = self.predict_margin(features)
+        # Сумма деревьев совпадает с XGBoost бит в бит; экспонента считается в float64 и
+        # округляется до float32 - так вероятность отличается от XGBoost не больше чем на единицу
+        # последнего разряда (np.exp во float32 менее точна)
+        exp_margin = np.exp(-margin.astype(np.float64)).astype(np.float32)
+        positive = np.float32(1) / (np.float32(1) + exp_margin)
+        return np.column_stack([np.float32(1) - positive, positive])
+
+
+def compile_model(model_path='best_xgb_model.json'):
+    """
+    Читает модель XGBoost (binary:logistic, gbtree) из JSON и укладывает деревья в массивы
+
+    Учитываются только деревья до best_iteration включительно - как в predict_proba
+    у модели, обученной с ранней остановкой.
+    """
+    with open(model_path) as f:
+        learner = json.load(f)['learner']
+
+    objective = learner['objective']['name']
+    if objective != 'binary:logistic':
+        raise ValueError(f"Неподдерживаемая целевая функция модели: {objective}")
+
+    booster = learner['gradient_booster']
+    if booster.get('name', 'gbtree') != 'gbtree':
+        raise ValueError(f"Неподдерживаемый тип бустера: {booster.get('name')}")
+    model = booster['model']
+    trees = model['trees']
+    best_iteration = learner.get('attributes', {}).get('best_iteration')
+    if best_iteration is not None:
+        trees = trees[:(int(best_iteration) + 1) * int(model['gbtree_model_param']['num_parallel_tree'])]
+    if any(tree['categories_nodes'] for tree in trees):
+        raise ValueError("Категориальные разбиения не поддерживаются")
+
+    sizes = [len(tree['left_children']) for tree in trees]
+    roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32)
+    feature, threshold, left, right, default_left, value = [], [], [], [], [], []
+    max_depth = 0
+
+    for root, tree in zip(roots, trees):
+        node_left = np.array(tree['left_children'], dtype=np.int32)
+        node_right = np.array(tree['right_children'], dtype=np.int32)
+        is_leaf = node_left == -1
+        own_index = np.arange(len(node_left), dtype=np.int32)
+
+        feature.append(np.where(is_leaf, 0, tree['split_indices']))
+        threshold.append(np.where(is_leaf, 0, tree['split_conditions']))
+        left.append(root + np.where(is_leaf, own_index, node_left))
+        right.append(root + np.where(is_leaf, own_index, node_right))
+        default_left.append(np.array(tree['default_left'], dtype=bool))
+        # Для листьев split_conditions хранит значение листа
+        value.append(np.where(is_leaf, tree['split_conditions'], 0))
+        max_depth = max(max_depth, _tree_depth(node_left, node_right))
+
+    # base_score хранится как вероятность, в сумму деревьев входит ее логит
+    # (новые версии XGBoost пишут ее списком: "[5E-1]")
+    base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+    base_margin = np.float32(np.log(base_score / (1 - base_score)))
+
+    return CompiledTrees(roots=roots,
+                         feature=np.concatenate(feature).astype(np.int32),
+                         threshold=np.concatenate(threshold).astype(np.float32),
+                         children=np.column_stack([np.concatenate(left), np.concatenate(right)]).ravel().astype(np.int32),
+                         default_left=np.concatenate(default_left),
+                         value=np.concatenate(value).astype(np.float32),
+                         max_depth=max_depth, base_margin=base_margin,
+                         feature_names=list(learner.get('feature_names') or []))
+
+
+def _tree_depth(left, right):
+    depth = 0
+    level = [0]
+    while level:
+        level = [child for node in level if left[node] != -1 for child in (left[node], right[node])]
+        depth += bool(level)
+    return depth
+
+
+def check_parity(model_path='best_xgb_model.json', feature_info_path='feature_info.pkl', n_rows=10000, seed=0,
+                 tolerance=1e-6):
+    """
+    Сравнивает предсказания скомпилированных деревьев и XGBoost на случайных строках
+
+    Строки берутся из диапазонов, встречающихся в порогах модели, часть значений
+    заменяется пропусками. Проверяются одна строка и пакет целиком.
+
+    Возвращает:
+    dict: Максимальное расхождение вероятностей, доля совпавших бит в бит вероятностей
+    и совпадение сумм деревьев; при расхождении выбрасывает AssertionError
+    """
+    import pickle
+
+    import pandas as pd
+    import xgboost as xgb
+
+    with open(feature_info_path, 'rb') as f:
+        feature_cols = pickle.load(f)['feature_cols']
+    native = xgb.XGBClassifier()
+    native.load_model(model_path)
+    compiled = compile_model(model_path)
+
+    # Значения признаков вокруг порогов модели, чтобы проходить по разным веткам
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for position, column in enumerate(feature_cols):
+        thresholds = compiled.threshold[compiled.feature == position]
+        if len(thresholds) == 0:
+            thresholds = np.array([0.0], dtype=np.float32)
+        columns[column] = rng.choice(thresholds, n_rows) + rng.normal(0, 1, n_rows) * (np.std(thresholds) + 1e-3)
+    rows = pd.DataFrame(columns)
+    rows = rows.mask(rng.random(rows.shape) < 0.02)
+
+    expected = native.predict_proba(rows)
+    actual = compiled.predict_proba(rows)
+    expected_margin = native.get_booster().predict(xgb.DMatrix(rows), output_margin=True)
+    actual_margin = compiled.predict_margin(rows)
+    single_expected = native.predict_proba(rows.iloc[:1])
+    single_actual = compiled.predict_proba(rows.iloc[:1])
+
+    max_difference = float(max(np.abs(expected - actual).max(), np.abs(single_expected - single_actual).max()))
+    result = {
+        'rows': n_rows,
+        'max_abs_difference': max_difference,
+        'bitwise_equal_share': float(np.mean(expected[:, 1] == actual[:, 1])),
+        'margin_bitwise_equal': bool(np.array_equal(expected_margin, actual_margin)),
+        'passed': max_difference <= tolerance and bool(np.array_equal(expected_margin, actual_margin))
+    }
+    if not result['passed']:
+        raise AssertionError(f"Скомпилированная модель расходится с XGBoost: {result}")
+    return result
+
+
+if __name__ == '__main__':
+    print(check_parity())
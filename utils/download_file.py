@@ -1,29 +1,115 @@
+import io
 import os
+import tempfile
+from contextlib import asynccontextmanager
 
 from aiogram import types
 from pathlib import Path
+import aiofiles
 import aiohttp
 
 from loader import logger, bot
 
 
-async def download_file(message: types.Message):
+CHUNK_SIZE = 64 * 1024
+# Bot API не отдает ботам файлы больше 20 МБ
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 20 * 1024 * 1024))
+# Файлы не больше этого размера можно не сохранять на диск
+IN_MEMORY_FILE_SIZE = int(os.getenv("IN_MEMORY_FILE_SIZE", 2 * 1024 * 1024))
+
+_session: aiohttp.ClientSession | None = None
+
+
+class FileTooLargeError(ValueError):
+    pass
+
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession()
+    return _session
+
+
+async def close_session() -> None:
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+
+async def download_file(message: types.Message, in_memory: bool = False) -> Path | io.BytesIO:
+    """
+    Скачивает документ из сообщения по частям
+
+    Файл пишется во временный файл с уникальным именем, а при in_memory=True
+    небольшой файл возвращается как BytesIO без записи на диск.
+    Если файл больше MAX_FILE_SIZE, выбрасывается FileTooLargeError.
+    """
     document = message.document
-    file_id = document.file_id
+    if document.file_size is not None and document.file_size > MAX_FILE_SIZE:
+        raise FileTooLargeError(f"File {document.file_name} is larger than {MAX_FILE_SIZE} bytes")
 
-    file_info = await bot.get_file(file_id)
+    file_info = await bot.get_file(document.file_id)
     file_path = file_info.file_path
 
     file_url = f"https://api.telegram.org/file/bot{os.getenv("BOT_TOKEN")}/{file_path}"
-    
-    save_path = Path(__file__).parent.parent
-    save_path = save_path / document.file_name
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(file_url) as response:
-            if response.status == 200:
-                with save_path.open("wb") as f:
-                    f.write(await response.read())
+    async with get_session().get(file_url) as response:
+        response.raise_for_status()
+
+        size = document.file_size or response.content_length
+        if in_memory and size is not None and size <= IN_MEMORY_FILE_SIZE:
+            buffer = io.BytesIO()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                buffer.write(chunk)
+                _check_size(buffer.tell())
+            buffer.seek(0)
+            logger.debug("The file was successfuly received into memory")
+            return buffer
+
+        fd, save_path = tempfile.mkstemp(prefix="upload_", suffix=Path(document.file_name).suffix)
+        os.close(fd)
+        save_path = Path(save_path)
+        try:
+            received = 0
+            async with aiofiles.open(save_path, "wb") as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    received += len(chunk)
+                    _check_size(received)
+                    await f.write(chunk)
+        except BaseException:
+            save_path.unlink(missing_ok=True)
+            raise
 
     logger.debug("The file was successfuly received")
     return save_path
+
+
+def _check_size(received: int) -> None:
+    if received > MAX_FILE_SIZE:
+        raise FileTooLargeError(f"Received more than {MAX_FILE_SIZE} bytes")
+
+
+def remove_downloaded_file(source: Path | io.BytesIO) -> None:
+    if isinstance(source, Path):
+        source.unlink(missing_ok=True)
+        logger.debug("The file was successfuly deleted")
+
+
+@asynccontextmanager
+async def downloaded_document(message: types.Message, in_memory: bool = False):
+    """
+    Скачивает документ из сообщения на время блока with и затем удаляет его
+
+    Если файл больше MAX_FILE_SIZE, пользователю отправляется сообщение об этом,
+    а вместо файла возвращается None.
+    """
+    try:
+        source = await download_file(message, in_memory=in_memory)
+    except FileTooLargeError:
+        await message.answer(f"Файл слишком большой, максимальный размер - {MAX_FILE_SIZE // (1024 * 1024)} МБ")
+        yield None
+        return
+    try:
+        yield source
+    finally:
+        remove_downloaded_file(source)
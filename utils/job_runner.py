@@ -0,0 +1,279 @@
+import asyncio
+import contextlib
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from utils.metrics import collect_worker_spans, record_spans, take_worker_spans
+
+
+# Очередь сообщений о ходе задач в процессе пула (задается при запуске процесса)
+_worker_progress_queue = None
+# Вместо номера задачи в очереди сообщений: процесс пула закончил прогрев
+_WORKER_READY = None
+# Сообщение, по которому поток чтения сообщений о ходе задач завершается
+_STOP_PROGRESS = None
+# Сколько секунд после завершения загрузки ждать ее последних сообщений о ходе
+PROGRESS_DRAIN_TIMEOUT = 5
+
+
+def _init_worker(progress_queue, warmup):
+    global _worker_progress_queue
+    _worker_progress_queue = progress_queue
+    collect_worker_spans()
+    try:
+        if warmup is not None:
+            warmup()
+    finally:
+        progress_queue.put((_WORKER_READY, os.getpid()))
+
+
+def _report_progress(job_id, text):
+    _worker_progress_queue.put((job_id, text))
+
+
+def _run_with_progress(job_id, func, args, kwargs):
+    try:
+        return func(*args, progress=partial(_report_progress, job_id), **kwargs)
+    finally:
+        # Последнее сообщение задачи (None): после него сообщений о ее ходе не будет
+        _worker_progress_queue.put((job_id, None))
+
+
+def _noop():
+    pass
+
+
+class WorkerCrashedError(RuntimeError):
+    """
+    Процесс пула аварийно завершился (например, из-за нехватки памяти) и при повторе задачи
+    """
+
+
+def _run_collecting_spans(func):
+    # Этапы, замеренные в процессе пула, возвращаются вместе с результатом задачи
+    take_worker_spans()
+    try:
+        result = func()
+    finally:
+        spans = take_worker_spans()
+    return result, spans
+
+
+class JobRunner:
+    """
+    Выполняет тяжелые задачи (загрузка статистики, предсказания) в пуле процессов
+
+    Загрузки ставятся в очередь и выполняются по одной, поэтому запись в базу
+    остается однопоточной, а предсказания выполняются параллельно с ними на
+    свободных процессах. Сообщения о ходе загрузки передаются из процесса пула
+    в обработчик, который редактирует статусное сообщение в чате. Если процесс
+    пула погибает, пул заменяется новым, а задача повторяется один раз
+    (при повторном сбое - WorkerCrashedError).
+
+    worker_warmup - функция без аргументов (уровня модуля), которую каждый
+    процесс пула выполняет при запуске: импорт модулей, загрузка модели и т.п.
+    Модель нужна только процессам пула - все предсказания выполняются в них.
+    """
+
+    def __init__(self, max_workers, logger, history_size=100, worker_warmup=None):
+        self.max_workers = max_workers
+        self.logger = logger
+        self.worker_warmup = worker_warmup
+        self._executor = None
+        self._progress_queue = None
+        self._progress_messages = asyncio.Queue()
+        self._progress_thread = None
+        self._uploads = asyncio.Queue()
+        self._progress_callbacks = {}
+        self._progress_done = {}
+        self._job_ids = itertools.count()
+        self._tasks = []
+        self._running = defaultdict(int)
+        self._completed = defaultdict(int)
+        self._failed = defaultdict(int)
+        self._durations = defaultdict(lambda: deque(maxlen=history_size))
+        self._ready_workers = set()
+        self._all_workers_ready = asyncio.Event()
+
+    def start(self):
+        self._progress_queue = multiprocessing.get_context("spawn").Queue()
+        self._executor = self._create_executor()
+        # Очередь процессов читается в отдельном потоке, а не в потоках to_thread:
+        # ожидание сообщений не должно занимать потоки, общие с остальным кодом бота
+        self._progress_thread = threading.Thread(target=self._read_progress, args=(asyncio.get_running_loop(),),
+                                                 name="job-progress", daemon=True)
+        self._progress_thread.start()
+        self._tasks = [asyncio.create_task(self._process_uploads()),
+                       asyncio.create_task(self._dispatch_progress())]
+
+    def _create_executor(self):
+        # spawn: процессы пула не наследуют потоки и состояние event loop бота
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(self._progress_queue, self.worker_warmup))
+
+    def _replace_broken_executor(self, broken):
+        # Задачи, упавшие на одном сломанном пуле, заменяют его один раз
+        if self._executor is not broken:
+            return
+        self.logger.warning("Job pool is broken (a worker died), starting a new one")
+        self._executor = self._create_executor()
+        self._ready_workers.clear()
+        self._all_workers_ready.clear()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    async def _run_in_pool(self, call):
+        # Если процесс пула погиб, пул перестает принимать задачи: создаем новый
+        # (процессы заново выполнят worker_warmup) и повторяем задачу один раз
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            executor = self._executor
+            try:
+                return await loop.run_in_executor(executor, _run_collecting_spans, call)
+            except BrokenProcessPool as exc:
+                self._replace_broken_executor(executor)
+                if attempt:
+                    raise WorkerCrashedError("Процесс пула задач аварийно завершился при выполнении задачи") from exc
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._executor is not None:
+            await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+            self._progress_queue.put(_STOP_PROGRESS)
+            await asyncio.to_thread(self._progress_thread.join)
+            self._progress_queue.close()
+
+    async def prewarm(self):
+        """
+        Запускает все процессы пула заранее и ждет, пока каждый выполнит worker_warmup,
+        чтобы первые задачи не ждали запуска процесса и загрузки модели
+        """
+        # Пул запускает новый процесс, только когда нет свободного, поэтому задачи отправляются разом
+        await asyncio.gather(*(self.run("prewarm", _noop) for _ in range(self.max_workers)))
+        # Пустую задачу может выполнить уже прогретый процесс, поэтому ждем сообщения от каждого
+        await self._all_workers_ready.wait()
+
+    @property
+    def upload_queue_depth(self):
+        return self._uploads.qsize()
+
+    async def run(self, kind, func, *args, **kwargs):
+        """
+        Выполняет функцию в пуле процессов и учитывает длительность задачи
+        """
+        started = time.perf_counter()
+        self._running[kind] += 1
+        try:
+            result, spans = await self._run_in_pool(partial(func, *args, **kwargs))
+        except Exception:
+            self._failed[kind] += 1
+            raise
+        finally:
+            self._running[kind] -= 1
+            duration = time.perf_counter() - started
+            self._durations[kind].append(duration)
+
+        record_spans(spans)
+        self._completed[kind] += 1
+        self.logger.info(f"Job {kind} finished in {duration:.2f}s, uploads in queue: {self.upload_queue_depth}")
+        return result
+
+    async def submit_upload(self, func, *args, on_progress=None, **kwargs):
+        """
+        Ставит загрузку в очередь и ждет ее результата
+
+        func вызывается в процессе пула с дополнительным аргументом progress;
+        каждое сообщение о ходе передается в корутину on_progress.
+        """
+        job_id = next(self._job_ids)
+        future = asyncio.get_running_loop().create_future()
+        if on_progress is not None:
+            self._progress_callbacks[job_id] = on_progress
+            self._progress_done[job_id] = asyncio.Event()
+        await self._uploads.put((job_id, func, args, kwargs, future))
+        self.logger.info(f"Upload job {job_id} queued, uploads in queue: {self.upload_queue_depth}")
+        try:
+            result = await future
+            if on_progress is not None:
+                # Сообщения о ходе идут отдельной очередью и могут прийти позже результата
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._progress_done[job_id].wait(), PROGRESS_DRAIN_TIMEOUT)
+            return result
+        finally:
+            self._progress_callbacks.pop(job_id, None)
+            self._progress_done.pop(job_id, None)
+
+    async def _process_uploads(self):
+        while True:
+            job_id, func, args, kwargs, future = await self._uploads.get()
+            try:
+                result = await self.run("upload", _run_with_progress, job_id, func, args, kwargs)
+            except Exception as exc:
+                if not future.done():
+                    future.set_exception(exc)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self._uploads.task_done()
+
+    def _read_progress(self, loop):
+        # Выполняется в потоке job-progress: передает сообщения процессов в цикл событий
+        while True:
+            message = self._progress_queue.get()
+            if message is _STOP_PROGRESS:
+                return
+            try:
+                loop.call_soon_threadsafe(self._progress_messages.put_nowait, message)
+            except RuntimeError:
+                # Цикл событий уже закрыт
+                return
+
+    async def _dispatch_progress(self):
+        while True:
+            job_id, text = await self._progress_messages.get()
+
+            if job_id is _WORKER_READY:
+                self._ready_workers.add(text)
+                if len(self._ready_workers) >= self.max_workers:
+                    self._all_workers_ready.set()
+                continue
+
+            if text is None:
+                done = self._progress_done.get(job_id)
+                if done is not None:
+                    done.set()
+                continue
+
+            callback = self._progress_callbacks.get(job_id)
+            if callback is None:
+                continue
+            try:
+                await callback(text)
+            except Exception as exc:
+                self.logger.debug(exc)
+
+    def stats(self):
+        """
+        Возвращает глубину очереди загрузок и длительности задач по видам
+        """
+        jobs = {}
+        for kind in set(self._durations) | set(self._running):
+            durations = list(self._durations[kind])
+            jobs[kind] = {
+                'running': self._running[kind],
+                'completed': self._completed[kind],
+                'failed': self._failed[kind],
+                'last_duration': durations[-1] if durations else None,
+                'avg_duration': sum(durations) / len(durations) if durations else None,
+                'max_duration': max(durations) if durations else None
+            }
+        return {'upload_queue_depth': self.upload_queue_depth, 'ready_workers': len(self._ready_workers), 'jobs': jobs}
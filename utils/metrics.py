@@ -0,0 +1,188 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Границы корзин гистограмм в секундах: от быстрых обращений к индексу до загрузки больших файлов
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """
+    Гистограмма длительностей с метками в формате Prometheus
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Счетчики по корзинам (без +Inf), сумма и количество наблюдений
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_labels(labels + [_bound_label(bound)])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_labels(labels + [_bound_label('+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(labels)} {count}")
+        return "\n".join(lines)
+
+
+class CacheMetrics:
+    """
+    Счетчики кешей процесса (размер, попадания, промахи, вытеснения) в формате Prometheus
+
+    Кеш регистрируется вместе с функцией, возвращающей его счетчики (как LRUCache.stats);
+    значения читаются в момент выдачи метрик.
+    """
+
+    # Счетчики, которые только растут; остальные значения выдаются как gauge
+    COUNTERS = ("hits", "misses", "evictions", "expirations")
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def register(self, cache, stats):
+        with self._lock:
+            self._caches[cache] = stats
+
+    def stats(self):
+        with self._lock:
+            caches = sorted(self._caches.items())
+        return {cache: stats() for cache, stats in caches}
+
+    def render(self):
+        values = {}
+        for cache, stats in self.stats().items():
+            for key, value in stats.items():
+                values.setdefault(key, []).append((cache, value))
+
+        lines = []
+        for key, series in values.items():
+            if key in self.COUNTERS:
+                name, metric_type = f"{self.prefix}_{key}_total", "counter"
+            else:
+                name, metric_type = f"{self.prefix}_{key}", "gauge"
+            lines += [f"# HELP {name} Кеши процесса бота: {key}", f"# TYPE {name} {metric_type}"]
+            lines += [f'{name}{{cache="{_escape(cache)}"}} {value}' for cache, value in series]
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _bound_label(bound):
+    return f'le="{bound}"'
+
+
+def _labels(labels):
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+handler_duration = Histogram("bot_handler_duration_seconds", "Длительность обработчиков бота",
+                             labelnames=("router", "handler", "status"))
+stage_duration = Histogram("bot_stage_duration_seconds", "Длительность этапов обработки запросов",
+                           labelnames=("stage",))
+cache_metrics = CacheMetrics("bot_cache")
+
+
+def render_metrics():
+    """
+    Возвращает все метрики в текстовом формате Prometheus
+    """
+    sections = [metric.render() for metric in (handler_duration, stage_duration, cache_metrics)]
+    return "\n".join(section for section in sections if section) + "\n"
+
+
+# Этапы текущего запроса бота (для журнала медленных запросов)
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+# В процессе пула задач этапы не попадают в гистограммы процесса, а копятся до конца задачи
+# и передаются в процесс бота вместе с результатом
+_worker_spans = None
+
+
+def collect_worker_spans():
+    global _worker_spans
+    _worker_spans = []
+
+
+def take_worker_spans():
+    spans = list(_worker_spans)
+    _worker_spans.clear()
+    return spans
+
+
+def record_span(stage, seconds):
+    if _worker_spans is not None:
+        _worker_spans.append((stage, seconds))
+        return
+    stage_duration.observe(seconds, stage=stage)
+    request_spans = _request_spans.get()
+    if request_spans is not None:
+        request_spans.append((stage, seconds))
+
+
+def record_spans(spans):
+    for stage, seconds in spans:
+        record_span(stage, seconds)
+
+
+@contextmanager
+def span(stage):
+    """
+    Замеряет длительность этапа: with span("prediction.model_predict"): ...
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - started)
+
+
+def timed_iter(iterable, stage):
+    """
+    Отдает элементы iterable, замеряя время получения каждого как этап stage
+    """
+    iterator = iter(iterable)
+    while True:
+        with span(stage):
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+
+@contextmanager
+def track_request_spans():
+    """
+    Собирает этапы, выполненные внутри блока (в том числе в потоках и задачах пула)
+    """
+    spans = []
+    token = _request_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _request_spans.reset(token)
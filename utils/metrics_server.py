@@ -0,0 +1,21 @@
+from aiohttp import web
+
+from utils.metrics import render_metrics
+
+
+async def metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render_metrics().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """
+    Запускает HTTP-сервер, который отдает метрики в формате Prometheus по GET /metrics
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    return runner
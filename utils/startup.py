@@ -0,0 +1,72 @@
+import asyncio
+import importlib
+import sys
+import time
+
+from loguru import logger
+
+
+# Импорты тяжелых модулей, начатые import_module (имя модуля -> задача)
+_imports = {}
+
+
+async def import_module(name: str):
+    """
+    Импортирует модуль в потоке, не блокируя цикл событий
+
+    Модули с pandas, xgboost и openpyxl импортируются при первом обращении, а не
+    при запуске бота. Одновременные вызовы для одного модуля ждут один импорт.
+    """
+    task = _imports.get(name)
+    if task is None:
+        module = sys.modules.get(name)
+        if module is not None:
+            return module
+        task = _imports[name] = asyncio.ensure_future(asyncio.to_thread(importlib.import_module, name))
+    try:
+        return await asyncio.shield(task)
+    except Exception:
+        # Неудачный импорт можно повторить при следующем обращении
+        if _imports.get(name) is task and task.done():
+            del _imports[name]
+        raise
+
+
+def warm_worker() -> None:
+    """
+    Прогревает процесс пула задач: импорт модулей, индекс статистики и модель
+
+    Выполняется при запуске каждого процесса пула; ошибка прогрева не мешает
+    процессу выполнять задачи (данные загрузятся при первой задаче).
+    """
+    try:
+        from model_holder import get_model_holder
+        from prediction_functions import PREDICTION_ENGINE
+        from stats_index import load_stats_index
+        # Модуль загрузки статистики (openpyxl, расчет статистики) не нужен для прогрева,
+        # но импортируется заранее, чтобы первая загрузка не ждала импорта в процессе пула
+        import stat_upload  # noqa: F401
+
+        load_stats_index()
+        get_model_holder(engine=PREDICTION_ENGINE).get()
+    except Exception:
+        logger.exception("Worker warmup failed")
+
+
+class StartupReport:
+    """
+    Время этапов запуска бота в секундах от начала запуска процесса
+    """
+
+    def __init__(self, started_at: float) -> None:
+        self.started_at = started_at
+        self.stages = {}
+
+    def mark(self, stage: str) -> None:
+        self.stages[stage] = round(time.perf_counter() - self.started_at, 3)
+
+    def as_dict(self) -> dict:
+        return dict(self.stages)
+
+    def summary(self) -> str:
+        return ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in self.stages.items())
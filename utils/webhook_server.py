@@ -0,0 +1,80 @@
+import asyncio
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик webhook с ограничением числа одновременно обрабатываемых обновлений
+
+    Ответ Telegram отправляется сразу, а обновление обрабатывается в фоне. Когда
+    заняты все max_concurrency мест, ответ задерживается до освобождения места -
+    так Telegram не присылает новые обновления быстрее, чем бот их обрабатывает.
+    При остановке сервера close() дожидается завершения уже начатых обработчиков.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_concurrency: int, drain_timeout: float,
+                 **kwargs: Any) -> None:
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self.max_concurrency = max_concurrency
+        self.drain_timeout = drain_timeout
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.processed = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        await self._slots.acquire()
+        task = asyncio.create_task(self._background_feed_update(bot=bot, update=update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        task.add_done_callback(self._release_slot)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    def _release_slot(self, task: asyncio.Task) -> None:
+        self.processed += 1
+        self._slots.release()
+
+    async def close(self) -> None:
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.drain_timeout)
+        await super().close()
+
+
+def create_webhook_app(dispatcher: Dispatcher, bot: Bot, path: str, secret_token: str | None = None,
+                       max_concurrency: int = 64, drain_timeout: float = 30.0,
+                       health_info=None) -> web.Application:
+    """
+    Создает aiohttp-приложение с webhook бота и проверкой состояния GET /health
+
+    health_info - необязательная функция, которая дополняет ответ /health
+    (например, очередью задач и числом диалогов).
+    """
+    app = web.Application()
+    handler = LimitedRequestHandler(dispatcher=dispatcher, bot=bot, max_concurrency=max_concurrency,
+                                    drain_timeout=drain_timeout, secret_token=secret_token)
+    # Обработчик регистрируется раньше setup_application: при остановке сначала
+    # дожидаемся начатых обработчиков, и только потом закрывается хранилище диспетчера
+    handler.register(app, path=path)
+    setup_application(app, dispatcher, bot=bot)
+
+    async def health(request: web.Request) -> web.Response:
+        info = {
+            "status": "ok",
+            "in_flight": handler.in_flight,
+            "max_concurrency": handler.max_concurrency,
+            "processed": handler.processed
+        }
+        if health_info is not None:
+            info.update(health_info())
+        return web.json_response(info)
+
+    app.router.add_get("/health", health)
+    return app